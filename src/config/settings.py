@@ -34,6 +34,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -98,6 +99,18 @@ DATABASES = {
 }
 
 
+# Cache of list responses and facets. Local memory by default, set
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and
+# CACHE_LOCATION=<directory> to share it between worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'swipe'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -143,6 +156,10 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 MEDIA_URL = '/media/'
 
+# Uploaded files are stored once per content, see swipe.storage.
+# Run `manage.py rehash_media` to move files uploaded before.
+DEFAULT_FILE_STORAGE = 'swipe.storage.ContentAddressedStorage'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -177,10 +194,52 @@ LOGGING = {
     },
 }
 
+# Postgres text search configuration of announcement search.
+# Announcement.search_vector has to be rebuilt after changing it.
+SWIPE_SEARCH_CONFIG = os.getenv('SWIPE_SEARCH_CONFIG', 'russian')
+
+# Hours an announcement is moved up the feed by every option of its promotion.
+# Run `manage.py refresh_announcement_ranks` after changing them.
+SWIPE_PROMOTION_BOOSTS = {
+    'is_turbo': 7 * 24,
+    'is_big': 3 * 24,
+    'phrase': 24,
+    'color': 24,
+}
+
+# Minutes a moderator keeps the announcements claimed from the moderation queue.
+SWIPE_MODERATION_LEASE = int(os.getenv('SWIPE_MODERATION_LEASE', 15))
+
+# Longest side in pixels of the image variants made by `manage.py process_images`.
+# Images processed before a change keep their old variants.
+SWIPE_IMAGE_VARIANTS = {
+    'thumb': 160,
+    'card': 480,
+    'full': 1600,
+}
+
+# WebP and JPEG quality of the image variants.
+SWIPE_IMAGE_QUALITY = int(os.getenv('SWIPE_IMAGE_QUALITY', 82))
+
+# Limits of the batch photo upload (`add-photos`) of announcements and houses.
+# nginx/nginx.conf has to accept SWIPE_UPLOAD_MAX_FILES * SWIPE_UPLOAD_MAX_FILE_SIZE bytes.
+SWIPE_UPLOAD_MAX_FILES = int(os.getenv('SWIPE_UPLOAD_MAX_FILES', 30))
+SWIPE_UPLOAD_MAX_FILE_SIZE = int(os.getenv('SWIPE_UPLOAD_MAX_FILE_SIZE', 10 * 1024 * 1024))
+
+# Most flats created by one request of flat generation for a house.
+SWIPE_MAX_GENERATED_FLATS = int(os.getenv('SWIPE_MAX_GENERATED_FLATS', 5000))
+
+# Minutes a flat held by an agent is not available to others before it has to be reserved.
+SWIPE_FLAT_HOLD = int(os.getenv('SWIPE_FLAT_HOLD', 15))
+
+# Seconds to keep cached lists and facets. They are invalidated by generation
+# counters on changes, so this only bounds the size of the cache.
+SWIPE_CACHE_TIMEOUT = int(os.getenv('SWIPE_CACHE_TIMEOUT', 60 * 60))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.TokenAuthentication',
+        'users.authentication.JWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
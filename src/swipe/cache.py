@@ -0,0 +1,97 @@
+'''
+Cached values are keyed with generation counters: every change of a model
+bumps the generations depending on it, which makes all the values cached
+for the previous generation unreachable, so nothing has to be deleted.
+'''
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def get_generation_key(scope):
+    return f'swipe:generation:{scope}'
+
+
+def get_generation(scope):
+    key = get_generation_key(scope)
+    generation = cache.get(key)
+    if generation is None:
+        # start from the clock, not from 1, so an evicted counter never
+        # returns to a generation that already has values cached
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(*scopes):
+    '''
+    Bumps the generations after the current transaction commits (right away
+    outside of transactions). Bumped earlier, a concurrent request could still
+    read the old rows and cache them under the new generation.
+    '''
+    transaction.on_commit(lambda: increment_generations(scopes))
+
+
+def increment_generations(scopes):
+    for scope in scopes:
+        key = get_generation_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def get_house_scope(house_id):
+    '''Scope of the values cached for a single house, like its chessboard'''
+    return f'house:{house_id}'
+
+
+def bump_house_generations(house_ids):
+    bump_generation(*(get_house_scope(house_id) for house_id in house_ids))
+
+
+def normalize_query(query_params, exclude=()):
+    '''Query string with sorted parameters and values, so their order does not matter'''
+    return '&'.join(
+        f'{name}={value}'
+        for name in sorted(query_params) if name not in exclude
+        for value in sorted(query_params.getlist(name)))
+
+
+def get_digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def make_key(prefix, *parts):
+    return f'swipe:{prefix}:{get_digest(*parts)}'
+
+
+
+def get_metrics_key(scope, outcome):
+    return f'swipe:metrics:{scope}:{outcome}'
+
+
+def record_access(scope, hit):
+    '''Counts hits and misses in the cache itself, so processes sharing it share the counters'''
+    key = get_metrics_key(scope, 'hits' if hit else 'misses')
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_metrics(*scopes):
+    metrics = {}
+    for scope in scopes:
+        hits = cache.get(get_metrics_key(scope, 'hits'), 0)
+        misses = cache.get(get_metrics_key(scope, 'misses'), 0)
+        metrics[scope] = {'hits': hits, 'misses': misses,
+            'hit_ratio': hits / (hits + misses) if hits + misses else None}
+    return metrics
+
+
+def reset_metrics(*scopes):
+    cache.delete_many([get_metrics_key(scope, outcome) for scope in scopes for outcome in ('hits', 'misses')])
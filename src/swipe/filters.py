@@ -1,7 +1,9 @@
+from django import forms
 from django.core.validators import EMPTY_VALUES
 import django_filters as filters
 
-from swipe.models import Flat, Announcement
+from swipe.geo import bounding_box, distance_km
+from swipe.models import Flat, House, Announcement
 
 
 class EmptyStringFilter(filters.BooleanFilter):
@@ -15,11 +17,90 @@ class EmptyStringFilter(filters.BooleanFilter):
         return method(**{self.field_name: None})
 
 
-class AnnouncementFilter(filters.FilterSet):
+class FloatListField(forms.CharField):
+    '''Comma separated list of `size` numbers'''
+    def __init__(self, *args, size, **kwargs):
+        self.size = size
+        super().__init__(*args, **kwargs)
+
+    def clean(self, value):
+        value = super().clean(value)
+        if value in EMPTY_VALUES:
+            return None
+        try:
+            numbers = [float(number) for number in value.split(',')]
+        except ValueError:
+            numbers = []
+        if len(numbers) != self.size:
+            raise forms.ValidationError(f'Ожидается {self.size} числа через запятую.')
+        return numbers
+
+
+class FloatListFilter(filters.Filter):
+    field_class = FloatListField
+
+
+class LocationFilterSet(filters.FilterSet):
+    '''
+    Filters by the location of the house: `bbox=min_lat,min_lon,max_lat,max_lon`,
+    `geohash=<prefix>` and `near=lat,lon` with optional `radius` (km)
+    and `ordering=distance`.
+    '''
+    location_prefix = ''
+
+    bbox = FloatListFilter(size=4, method='filter_bbox')
+    geohash = filters.CharFilter(method='filter_geohash')
+    near = FloatListFilter(size=2, method='filter_near')
+    radius = filters.NumberFilter(method='filter_near', min_value=0)
+    ordering = filters.ChoiceFilter(choices=(('distance', 'distance'),), method='filter_near')
+
+    def location_lookups(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        return {
+            f'{self.location_prefix}latitude__range': (min_latitude, max_latitude),
+            f'{self.location_prefix}longitude__range': (min_longitude, max_longitude),
+        }
+
+    def filter_bbox(self, queryset, name, value):
+        return queryset.filter(**self.location_lookups(*value))
+
+    def filter_geohash(self, queryset, name, value):
+        return queryset.filter(**{f'{self.location_prefix}geohash__startswith': value.lower()})
+
+    def filter_near(self, queryset, name, value):
+        # applied in filter_queryset, all the `near` parameters are needed together
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        near = self.form.cleaned_data.get('near')
+        if near is None:
+            return queryset
+        latitude, longitude = near
+        queryset = queryset.annotate(distance=distance_km(latitude, longitude, self.location_prefix))
+        radius = self.form.cleaned_data.get('radius')
+        if radius is not None:
+            queryset = queryset.filter(
+                **self.location_lookups(*bounding_box(latitude, longitude, float(radius))),
+                distance__lte=radius)
+        if self.form.cleaned_data.get('ordering') == 'distance':
+            queryset = queryset.order_by('distance', 'id')
+        return queryset
+
+
+class HouseFilter(LocationFilterSet):
+    class Meta:
+        model = House
+        fields = []
+
+
+class AnnouncementFilter(LocationFilterSet):
+    location_prefix = 'flat__house__'
+
     flat__isempty = EmptyStringFilter(field_name='flat')
     price__gt = filters.NumberFilter(field_name='price', lookup_expr='gte')
     price__lt = filters.NumberFilter(field_name='price', lookup_expr='lte')
     address = filters.CharFilter(field_name='address', lookup_expr='icontains')
+    description = filters.CharFilter(field_name='description', lookup_expr='icontains')
     total_area__gt = filters.NumberFilter(field_name='total_area', lookup_expr='gte')
     total_area__lt = filters.NumberFilter(field_name='total_area', lookup_expr='lte')
 
@@ -0,0 +1,72 @@
+'''Helpers for locations of houses stored as latitude/longitude in degrees'''
+import math
+import re
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 8
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+_COORDS_RE = re.compile(r'^\s*\(?\s*(-?\d+(?:\.\d+)?)\s*[,; ]\s*(-?\d+(?:\.\d+)?)\s*\)?\s*$')
+
+
+def parse_coords(value):
+    '''
+    Parses free-form "latitude, longitude" of House.coords.
+    Returns (None, None) for values that are not valid coordinates.
+    '''
+    match = _COORDS_RE.match(value or '')
+    if match is None:
+        return None, None
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, None
+    return latitude, longitude
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    '''Encodes a point into a geohash: nearby points share prefixes'''
+    latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+    result, bits, bit_count, even = [], 0, 0, True
+    while len(result) < precision:
+        value, interval = (longitude, longitude_range) if even else (latitude, latitude_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            result.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(result)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    '''(min_lat, min_lon, max_lat, max_lon) of the circle, used to prefilter it by the index'''
+    delta_latitude = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_latitude = math.cos(math.radians(latitude))
+    if cos_latitude < 1e-6 or delta_latitude >= 90:
+        return -90.0, -180.0, 90.0, 180.0
+    delta_longitude = min(math.degrees(radius_km / (EARTH_RADIUS_KM * cos_latitude)), 180.0)
+    return (max(latitude - delta_latitude, -90.0), max(longitude - delta_longitude, -180.0),
+        min(latitude + delta_latitude, 90.0), min(longitude + delta_longitude, 180.0))
+
+
+def distance_km(latitude, longitude, prefix=''):
+    '''Haversine distance from the point to `<prefix>latitude/longitude` as a database expression'''
+    latitude_field, longitude_field = F(f'{prefix}latitude'), F(f'{prefix}longitude')
+    point_latitude = Value(latitude, output_field=FloatField())
+    point_longitude = Value(longitude, output_field=FloatField())
+    haversine = (
+        Power(Sin(Radians(latitude_field - point_latitude) / 2), 2)
+        + Cos(Radians(point_latitude)) * Cos(Radians(latitude_field))
+        * Power(Sin(Radians(longitude_field - point_longitude) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(haversine))
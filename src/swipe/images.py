@@ -0,0 +1,86 @@
+from io import BytesIO
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# file extension and Pillow format of every stored variant
+IMAGE_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+
+
+def render_variants(name):
+    '''
+    Renders resized copies of the uploaded image `name` for every size of
+    settings.SWIPE_IMAGE_VARIANTS in every format of IMAGE_FORMATS and
+    returns them as `{variant: {'width': ..., 'height': ..., 'webp': bytes, 'jpeg': bytes}}`.
+
+    The photo is rotated by its EXIF orientation, and the variants are
+    encoded without EXIF and other metadata. Runs in worker processes,
+    so it only reads the original and never touches the database.
+    '''
+    with default_storage.open(name) as file, Image.open(file) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+    variants = {}
+    for variant, max_side in settings.SWIPE_IMAGE_VARIANTS.items():
+        resized = image.copy()
+        # never upscales
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        variants[variant] = {'width': resized.width, 'height': resized.height}
+        for extension, image_format in IMAGE_FORMATS:
+            content = BytesIO()
+            resized.save(content, image_format, quality=settings.SWIPE_IMAGE_QUALITY)
+            variants[variant][extension] = content.getvalue()
+    return variants
+
+
+def process_image(name):
+    '''render_variants() that returns no variants for files which are not readable images'''
+    try:
+        return render_variants(name)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning('Could not process image %s', name, exc_info=True)
+        return {}
+
+
+def save_variants(name, rendered):
+    '''Stores the variants of the image `name` rendered by process_image() and returns them with file names'''
+    stem = os.path.splitext(os.path.basename(name))[0]
+    variants = {}
+    for variant, formats in rendered.items():
+        variants[variant] = {'width': formats['width'], 'height': formats['height']}
+        for extension, _ in IMAGE_FORMATS:
+            variants[variant][extension] = default_storage.save(
+                f'{stem}_{variant}.{extension}', ContentFile(formats[extension]))
+    return variants
+
+
+def variant_names(variants):
+    '''File names of the `variants` of an image'''
+    for formats in variants.values():
+        for extension, _ in IMAGE_FORMATS:
+            if formats.get(extension):
+                yield formats[extension]
+
+
+def variant_url(image, variant, extension='jpeg'):
+    '''URL of a variant of an AnnouncementImage/HouseImage, the original until it is processed'''
+    name = image.variants.get(variant, {}).get(extension)
+    return default_storage.url(name) if name else image.image.url
+
+
+def variant_urls(image):
+    return {
+        variant: {extension: variant_url(image, variant, extension) for extension, _ in IMAGE_FORMATS}
+        for variant in settings.SWIPE_IMAGE_VARIANTS
+    }
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DateTimeField, F, Value
+from django.utils import timezone
+
+from swipe.cache import bump_generation
+from swipe.models import Announcement, BumpSchedule
+
+
+class Command(BaseCommand):
+    help = ('Applies due bump schedules of announcements in batches. Every batch is '
+        'one UPDATE of announcements and one of schedules, so workers may run in parallel.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Schedules applied per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep running and check for due schedules')
+        parser.add_argument('--sleep', type=float, default=60, help='Seconds between checks with --loop')
+
+    def apply_batch(self, batch_size):
+        now = timezone.now()
+        with transaction.atomic():
+            # schedules locked by another worker are left to it
+            schedules = list(BumpSchedule.objects.filter(next_bump_at__lte=now).order_by('next_bump_at')
+                .select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+            if not schedules:
+                return 0
+            Announcement.objects.filter(bump_schedules__in=schedules).bump(now)
+            BumpSchedule.objects.filter(pk__in=schedules).update(
+                next_bump_at=Value(now, output_field=DateTimeField()) + F('interval'))
+            BumpSchedule.objects.filter(pk__in=schedules, next_bump_at__gt=F('ends_at')).delete()
+        return len(schedules)
+
+    def apply_due(self, batch_size):
+        applied = 0
+        while True:
+            count = self.apply_batch(batch_size)
+            applied += count
+            if count < batch_size:
+                break
+        if applied:
+            # bulk updates send no signals
+            bump_generation('announcements')
+        return applied
+
+    def handle(self, *args, **options):
+        while True:
+            applied = self.apply_due(options['batch_size'])
+            self.stdout.write(f'Applied {applied} scheduled bumps')
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
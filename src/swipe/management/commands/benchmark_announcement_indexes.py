@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from swipe.management.seed import seed_announcements, seed_clients
+from swipe.models import Announcement
+
+
+class Command(BaseCommand):
+    help = ('Seeds announcements inside a transaction that is rolled back and prints '
+        'EXPLAIN plans of the hot announcement queries without and with their indexes')
+
+    index_names = ('announcement_rank_idx', 'announcement_moderation_idx', 'announcement_advertiser_idx')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Number of announcements to seed')
+        parser.add_argument('--clients', type=int, default=1000, help='Number of advertisers to seed')
+        parser.add_argument('--analyze', action='store_true', help='Run EXPLAIN ANALYZE instead of EXPLAIN')
+
+    def get_queries(self, advertiser):
+        page_size = 8
+        return {
+            'feed': Announcement.objects.filter(moder_status='2', available_status='1')
+                .order_by('-rank_score', '-id')[:page_size],
+            'moderation queue': Announcement.objects.filter(moder_status='1')
+                .order_by('publication_date')[:page_size],
+            'client announcements': Announcement.objects.filter(advertiser=advertiser)
+                .order_by('-publication_date'),
+        }
+
+    def explain(self, queries, analyze):
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_LABEL(f'-- {name}'))
+            self.stdout.write(queryset.explain(analyze=analyze))
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.monotonic()
+            advertisers = seed_clients(options['clients'])
+            seed_announcements(options['rows'], advertisers, seed=42)
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Announcement._meta.db_table}')
+            self.stdout.write(f'Seeded {options["rows"]} announcements in {time.monotonic() - started:.1f}s')
+
+            queries = self.get_queries(advertisers[0])
+            self.stdout.write(self.style.SUCCESS('== With indexes'))
+            self.explain(queries, options['analyze'])
+
+            with connection.cursor() as cursor:
+                for name in self.index_names:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+            self.stdout.write(self.style.SUCCESS('== Without indexes'))
+            self.explain(queries, options['analyze'])
+
+            transaction.set_rollback(True)
@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from swipe.management.seed import seed_announcements, seed_clients
+from swipe.models import Announcement
+from swipe.search import announcement_search_vector, search_announcements
+
+
+class Command(BaseCommand):
+    help = ('Seeds announcements inside a transaction that is rolled back and compares '
+        'the address icontains filter with and without trigram indexes and the full-text search')
+
+    trigram_indexes = ('announcement_address_upper_trgm_idx', 'announcement_description_upper_trgm_idx')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Number of announcements to seed')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of every query')
+        parser.add_argument('--term', action='append', dest='terms',
+            help='Searched text, may be repeated (default: two streets and a description word)')
+
+    def measure(self, label, queryset, repeat):
+        '''Times a page and the count of the queryset, as a paginated list request does'''
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset[:8])
+            queryset.count()
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f'{label:<50} {statistics.median(timings):10.2f} ms')
+
+    def run_icontains(self, terms, repeat):
+        feed = Announcement.objects.filter(moder_status='2', available_status='1').order_by('-rank_score', '-id')
+        for term in terms:
+            self.measure(f'address icontains "{term}"', feed.filter(address__icontains=term), repeat)
+            self.measure(f'description icontains "{term}"', feed.filter(description__icontains=term), repeat)
+
+    def handle(self, *args, **options):
+        terms = options['terms'] or ['Арнаутская', 'Левитана', 'терраса']
+        repeat = options['repeat']
+        with transaction.atomic():
+            started = time.monotonic()
+            seed_announcements(options['rows'], seed_clients(100), seed=42)
+            Announcement.objects.update(search_vector=announcement_search_vector())
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Announcement._meta.db_table}')
+            self.stdout.write(f'Seeded {options["rows"]} announcements in {time.monotonic() - started:.1f}s')
+
+            feed = Announcement.objects.filter(moder_status='2', available_status='1')
+            self.stdout.write(self.style.SUCCESS('== Full-text search'))
+            for term in terms:
+                self.measure(f'search "{term}"', search_announcements(feed, term), repeat)
+            self.stdout.write(search_announcements(feed, terms[0])[:8].explain())
+
+            self.stdout.write(self.style.SUCCESS('== icontains with trigram indexes'))
+            self.run_icontains(terms, repeat)
+
+            with connection.cursor() as cursor:
+                for name in self.trigram_indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+            self.stdout.write(self.style.SUCCESS('== icontains without trigram indexes'))
+            self.run_icontains(terms, repeat)
+
+            transaction.set_rollback(True)
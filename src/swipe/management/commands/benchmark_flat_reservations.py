@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from swipe.management.seed import seed_clients, seed_house
+from swipe.models import Flat
+from swipe.views.flats import APIFlatViewSet
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Seeds a house and lets concurrent clients hold and reserve random flats of it through '
+        'the flat API views until all are reserved, then prints the outcomes and latencies and checks that no flat '
+        'was reserved twice. The seeded data is deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=32, help='Concurrent agents, one connection each')
+        parser.add_argument('--flats', type=int, default=200, help='Flats of the seeded house')
+        parser.add_argument('--size', type=int, default=2, help='Flats held and reserved by one request')
+        parser.add_argument('--lease', type=float, default=2, help='Seconds of a hold, overrides SWIPE_FLAT_HOLD')
+        parser.add_argument('--abandon', type=float, default=0.2,
+            help='Share of holds that are never reserved and have to expire')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def post(self, operation, user, data):
+        '''
+        Posts `data` to the `operation` action of the flat API as `user`, so the
+        permissions and querysets of the endpoint apply. Returns the outcome and
+        the response data.
+        '''
+        request = self.factory.post('/', data, format='json')
+        force_authenticate(request, user=user)
+        started = time.perf_counter()
+        try:
+            response = self.views[operation](request)
+        except Exception as error:
+            self.record(operation, 'error', started)
+            self.stderr.write(f'{operation}: {error!r}')
+            return 'error', None
+        outcome = {status.HTTP_200_OK: 'ok', status.HTTP_409_CONFLICT: 'conflict'}.get(response.status_code, 'error')
+        self.record(operation, outcome, started)
+        if outcome == 'error':
+            self.stderr.write(f'{operation}: {response.status_code} {response.data}')
+        return outcome, response.data
+
+    def record(self, operation, outcome, started):
+        with self.lock:
+            self.results.append((operation, outcome, (time.perf_counter() - started) * 1000))
+
+    def work(self, user, ids, options, rng):
+        '''Holds and reserves random flats that looked free until none is left or a request fails'''
+        try:
+            while True:
+                free = list(Flat.objects.filter(pk__in=ids, reserved_at__isnull=True).values_list('pk', flat=True))
+                if not free:
+                    return
+                wanted = rng.sample(free, min(options['size'], len(free)))
+                outcome, data = self.post('hold', user, {'ids': wanted})
+                if outcome == 'error':
+                    return
+                if outcome == 'conflict' or rng.random() < options['abandon']:
+                    continue
+                outcome, data = self.post('reserve', user, {'flats': data['flats']})
+                if outcome == 'error':
+                    return
+                if outcome == 'ok':
+                    with self.lock:
+                        self.reserved.extend(flat['id'] for flat in data['flats'])
+        finally:
+            connections.close_all()
+
+    def report(self, elapsed):
+        self.stdout.write(f'{"operation":<10} {"outcome":<10} {"count":>8} {"median ms":>10} {"p95 ms":>10}')
+        for operation in ('hold', 'reserve'):
+            for outcome in ('ok', 'conflict', 'error'):
+                timings = sorted(ms for op, out, ms in self.results if (op, out) == (operation, outcome))
+                if timings:
+                    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+                    self.stdout.write(f'{operation:<10} {outcome:<10} {len(timings):>8} '
+                        f'{statistics.median(timings):>10.2f} {p95:>10.2f}')
+        self.stdout.write(f'{len(self.results)} requests in {elapsed:.1f}s, {len(self.results) / elapsed:.0f} per second')
+
+    def handle(self, *args, **options):
+        self.lock = threading.Lock()
+        self.results, self.reserved = [], []
+        self.factory = APIRequestFactory()
+        self.views = {operation: APIFlatViewSet.as_view({'post': operation}) for operation in ('hold', 'reserve')}
+        house = seed_house(options['flats'])
+        users = [client.user for client in seed_clients(options['workers'])]
+        try:
+            ids = list(house.flats.values_list('pk', flat=True))
+            rngs = [random.Random(options['seed'] + i) for i in range(len(users))]
+            started = time.monotonic()
+            with override_settings(SWIPE_FLAT_HOLD=options['lease'] / 60), \
+                    ThreadPoolExecutor(max_workers=len(users)) as pool:
+                for future in [pool.submit(self.work, user, ids, options, rng) for user, rng in zip(users, rngs)]:
+                    future.result()
+            self.report(time.monotonic() - started)
+
+            reserved = house.flats.filter(reserved_at__isnull=False).count()
+            if len(self.reserved) == len(set(self.reserved)) == reserved == len(ids):
+                self.stdout.write(self.style.SUCCESS(f'All {reserved} flats were reserved once'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{len(self.reserved)} reservations '
+                    f'of {len(set(self.reserved))} flats, {reserved} of {len(ids)} flats are reserved'))
+        finally:
+            house.delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from swipe.cache import get_metrics, reset_metrics
+from swipe.models import CACHE_SCOPES
+
+
+class Command(BaseCommand):
+    help = 'Prints hits and misses of the list response cache by scope'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        scopes = sorted({scope for scopes in CACHE_SCOPES.values() for scope in scopes})
+        self.stdout.write(f'{"scope":<15} {"hits":>10} {"misses":>10} {"hit ratio":>10}')
+        for scope, metrics in get_metrics(*scopes).items():
+            ratio = '-' if metrics['hit_ratio'] is None else f'{metrics["hit_ratio"]:.1%}'
+            self.stdout.write(f'{scope:<15} {metrics["hits"]:>10} {metrics["misses"]:>10} {ratio:>10}')
+        if options['reset']:
+            reset_metrics(*scopes)
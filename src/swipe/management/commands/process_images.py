@@ -0,0 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from swipe.cache import bump_generation
+from swipe.images import process_image, save_variants
+from swipe.models import CACHE_SCOPES, IMAGE_MODELS
+
+
+class Command(BaseCommand):
+    help = ('Makes resized WebP and JPEG variants without EXIF of uploaded announcement '
+        'and house photos. Photos locked by another worker are skipped, so workers may run in parallel.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Images processed per transaction')
+        parser.add_argument('--workers', type=int, default=None,
+            help='Processes resizing images, the number of CPUs by default; 0 resizes in this process')
+        parser.add_argument('--loop', action='store_true', help='Keep running and check for new images')
+        parser.add_argument('--sleep', type=float, default=10, help='Seconds between checks with --loop')
+
+    def process_batch(self, image_model, parent_model, parent_field, batch_size):
+        with transaction.atomic():
+            images = list(image_model.objects.filter(processed_at__isnull=True).order_by('pk')
+                .select_for_update(skip_locked=True)[:batch_size])
+            if not images:
+                return 0
+            names = [image.image.name for image in images]
+            rendered = self.pool.map(process_image, names) if self.pool else map(process_image, names)
+            now = timezone.now()
+            for image, image_rendered in zip(images, rendered):
+                # saved here to take the file references in this transaction
+                image.variants = save_variants(image.image.name, image_rendered)
+                image.processed_at = now
+            image_model.objects.bulk_update(images, ['variants', 'processed_at'])
+            # images are serialized with their parents, see touch_parent()
+            parent_model.objects.filter(pk__in={getattr(image, f'{parent_field}_id') for image in images}
+                ).update(updated_at=now)
+        return len(images)
+
+    def process_pending(self, batch_size):
+        processed = 0
+        for image_model, parent_model, parent_field in IMAGE_MODELS:
+            model_processed = 0
+            while True:
+                count = self.process_batch(image_model, parent_model, parent_field, batch_size)
+                model_processed += count
+                if count < batch_size:
+                    break
+            if model_processed:
+                # bulk updates send no signals
+                bump_generation(*CACHE_SCOPES[image_model])
+            processed += model_processed
+        return processed
+
+    def handle(self, *args, **options):
+        self.pool = None
+        if options['workers'] != 0:
+            # the workers only read images from the storage, but it is configured by the settings
+            self.pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+        try:
+            while True:
+                processed = self.process_pending(options['batch_size'])
+                self.stdout.write(f'Processed {processed} images')
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+        finally:
+            if self.pool:
+                self.pool.shutdown()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from swipe.cache import bump_generation
+from swipe.models import Announcement
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the feed rank of all announcements, e.g. after SWIPE_PROMOTION_BOOSTS changed'
+
+    def handle(self, *args, **options):
+        updated = Announcement.objects.refresh_rank_score()
+        # the update sends no signals
+        bump_generation('announcements')
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} announcements'))
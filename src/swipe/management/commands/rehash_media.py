@@ -0,0 +1,57 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from swipe.cache import bump_generation
+from swipe.models import CACHE_SCOPES, IMAGE_MODELS
+from swipe.storage import deletion_queue, is_content_name
+
+
+class Command(BaseCommand):
+    help = ('Moves photos and their variants uploaded before the content addressed storage '
+        'to content addressed names. Files are read in chunks, one photo per transaction, '
+        'so it can be stopped and run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Photos loaded from the database at once')
+
+    def rehash(self, name, moved):
+        '''Stores the file `name` under its content addressed name, `moved` collects the old names'''
+        if not name or is_content_name(name):
+            return name
+        if not default_storage.exists(name):
+            self.stderr.write(f'Missing file {name}')
+            return name
+        with default_storage.open(name) as file:
+            new_name = default_storage.save(name, file)
+        moved.append(name)
+        return new_name
+
+    def rehash_image(self, image_model, image):
+        moved = []
+        with transaction.atomic():
+            name = self.rehash(image.image.name, moved)
+            variants = {variant: {key: self.rehash(value, moved) if key in ('webp', 'jpeg') else value
+                for key, value in formats.items()} for variant, formats in image.variants.items()}
+            if not moved:
+                return False
+            image_model.objects.filter(pk=image.pk).update(image=name, variants=variants)
+        # files from before the storage have no references, so they are deleted
+        default_storage.delete_many(moved)
+        return True
+
+    def handle(self, *args, **options):
+        for image_model, parent_model, parent_field in IMAGE_MODELS:
+            rehashed = set()
+            for image in image_model.objects.order_by('pk').iterator(chunk_size=options['chunk_size']):
+                if self.rehash_image(image_model, image):
+                    rehashed.add(getattr(image, f'{parent_field}_id'))
+            if rehashed:
+                # media URLs changed and updates send no signals
+                parent_model.objects.filter(pk__in=rehashed).update(updated_at=timezone.now())
+                bump_generation(*CACHE_SCOPES[image_model])
+            self.stdout.write(self.style.SUCCESS(
+                f'Rehashed photos of {len(rehashed)} {parent_model._meta.verbose_name_plural}'))
+        # the old files are deleted in the background
+        deletion_queue.join()
@@ -0,0 +1,63 @@
+from itertools import islice
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from swipe.images import variant_names
+from swipe.models import IMAGE_MODELS
+
+
+class Command(BaseCommand):
+    help = ('Deletes media files that no photo refers to. MEDIA_ROOT is scanned lazily '
+        'and orphans are deleted batch by batch, so the command can be stopped at any time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=60,
+            help='Minutes since the last change of a file, younger files may belong to running uploads')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Files deleted at once')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orphans')
+
+    def scan(self, path, prefix=''):
+        '''Names and modification times of the files under `path`, relative to it'''
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.scan(entry.path, f'{prefix}{entry.name}/')
+                elif entry.is_file(follow_symlinks=False):
+                    yield f'{prefix}{entry.name}', entry.stat().st_mtime
+
+    def get_referenced(self):
+        referenced = set()
+        for image_model, _, _ in IMAGE_MODELS:
+            for name, variants in image_model.objects.values_list('image', 'variants').iterator():
+                referenced.add(name)
+                referenced.update(variant_names(variants))
+        return referenced
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(settings.MEDIA_ROOT):
+            self.stdout.write('MEDIA_ROOT does not exist')
+            return
+        # files are listed after the photos, so only files of uploads
+        # that started later can be missing there, which --min-age skips
+        referenced = self.get_referenced()
+        modified_before = time.time() - options['min_age'] * 60
+        orphans = (name for name, modified in self.scan(settings.MEDIA_ROOT)
+            if modified < modified_before and name not in referenced)
+
+        found = deleted = 0
+        while True:
+            batch = list(islice(orphans, options['batch_size']))
+            if not batch:
+                break
+            found += len(batch)
+            if not options['dry_run']:
+                # files that got references meanwhile are kept
+                deleted += len(default_storage.delete_unreferenced(batch))
+        if options['dry_run']:
+            self.stdout.write(f'Found {found} orphan files')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} of {found} orphan files'))
@@ -0,0 +1,113 @@
+'''Helpers for seeding large fake datasets used by the benchmark commands'''
+from contextlib import contextmanager
+from datetime import timedelta
+import random
+import uuid
+
+from django.utils import timezone
+
+from swipe.models import Announcement, Flat, House
+from users.models import Client, User
+
+
+STREETS = (
+    'Дерибасовская', 'Французский бульвар', 'Фонтанская дорога', 'Генуэзская',
+    'Пушкинская', 'Екатерининская', 'Садовая', 'Малая Арнаутская', 'Большая Арнаутская',
+    'Канатная', 'Преображенская', 'Ришельевская', 'Греческая', 'Жуковского',
+    'Маршала Говорова', 'Армейская', 'Костанди', 'Левитана', 'Академика Королёва',
+    'Черноморского казачества', 'Балковская', 'Водопроводная', 'Люстдорфская дорога',
+)
+
+WORDS = (
+    'квартира', 'ремонт', 'море', 'парк', 'школа', 'садик', 'балкон', 'вид',
+    'новострой', 'евроремонт', 'мебель', 'техника', 'паркинг', 'охрана', 'лифт',
+    'тихий', 'центр', 'просторная', 'светлая', 'уютная', 'солнечная', 'сторона',
+    'рядом', 'транспорт', 'магазины', 'рынок', 'кухня', 'студия', 'торг', 'ипотека',
+    'собственник', 'документы', 'готова', 'заселению', 'терраса', 'кладовая',
+)
+
+
+def seed_clients(count):
+    '''Creates `count` clients with unique fake credentials'''
+    token = uuid.uuid4().hex[:6]
+    users = User.objects.bulk_create([
+        User(email=f'seed-{token}-{i}@example.com', phone_number=f'seed{token}{i}')
+        for i in range(count)
+    ])
+    return Client.objects.bulk_create([Client(user=user) for user in users])
+
+
+def seed_house(flats, flats_per_floor=4, square_meter_price=1000):
+    '''Creates a one-section house with at least `flats` flats of `flats_per_floor` on every floor'''
+    floors = -(-flats // flats_per_floor)
+    house = House.objects.create(
+        name='Seed house', description='Seed house', status='2', type='1', _class='2',
+        building_technology='1', territory='2', sea_distance=1000, communal_payments='1',
+        ceiling_height=2.8, has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+        calculation_type='Ипотека', perpose='Жилое помещение', summ_in_contract='Неполная',
+        coords='46.4335, 30.7213', housings=1, sections=1, floors=floors,
+    )
+    Flat.objects.generate(house, [1] * flats_per_floor, square_meter_price,
+        housings=[1], sections=[1], floors=range(1, floors + 1))
+    return house
+
+
+def fake_address(rng):
+    return f'ул. {rng.choice(STREETS)}, {rng.randint(1, 200)}'
+
+
+def fake_description(rng, words=20):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+@contextmanager
+def explicit_dates(model, *field_names):
+    '''Lets bulk_create keep given values of auto_now_add fields'''
+    fields = [model._meta.get_field(name) for name in field_names]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def seed_announcements(count, advertisers, batch_size=10000, seed=None):
+    '''
+    Inserts `count` announcements spread over `advertisers` with a realistic
+    mix of moderation and availability statuses and publication dates
+    spread over the last year.
+    '''
+    rng = random.Random(seed)
+    now = timezone.now()
+    created = 0
+    with explicit_dates(Announcement, 'publication_date'):
+        while created < count:
+            size = min(batch_size, count - created)
+            dates = [now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)) for _ in range(size)]
+            Announcement.objects.bulk_create([
+                Announcement(
+                    address=fake_address(rng),
+                    publication_date=publication_date,
+                    # no promotions are seeded, see swipe.ranking
+                    rank_score=publication_date.timestamp(),
+                    foundation_document=rng.choice('1234'),
+                    appointment=rng.choice('123'),
+                    rooms=rng.choice('12345'),
+                    layout=rng.choice('123456'),
+                    state=rng.choice('12'),
+                    total_area=round(rng.uniform(18.0, 150.0), 1),
+                    has_balcony=rng.choice('12'),
+                    calculation_options=rng.choice('123'),
+                    commision=rng.randint(0, 5),
+                    communication='Звонок',
+                    description=fake_description(rng),
+                    price=rng.randint(14000, 450000),
+                    moder_status=rng.choices('123', weights=(15, 80, 5))[0],
+                    available_status=rng.choices('12', weights=(90, 10))[0],
+                    advertiser=rng.choice(advertisers),
+                ) for publication_date in dates
+            ], batch_size=batch_size)
+            created += size
+
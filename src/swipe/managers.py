@@ -0,0 +1,327 @@
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, ExpressionWrapper, F, Max, Min, OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from swipe.ranking import announcement_rank_score
+from swipe.search import announcement_search_vector
+
+
+def get_field_choices(model, path):
+    '''Choices of the field at the end of a `relation__field` lookup path'''
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name).choices
+
+
+class AnnouncementQuerySet(models.QuerySet):
+    FACET_FIELDS = ('rooms', 'state', 'appointment', 'calculation_options', 'flat__house__status')
+    RANGE_FIELDS = ('price', 'total_area')
+
+    def for_listing(self):
+        '''
+        Loads everything AnnouncementListSerializer needs with a constant
+        number of queries: flat and promotion are joined and only the first
+        image of every announcement is prefetched into `first_images`.
+        '''
+        image_model = self.model._meta.get_field('images').related_model
+        first_image = image_model.objects.filter(
+            announcement=OuterRef('announcement')).order_by('pk').values('pk')[:1]
+        return self.select_related('flat', 'promotion').prefetch_related(
+            Prefetch('images', queryset=image_model.objects.filter(pk=Subquery(first_image)),
+                to_attr='first_images'))
+
+    def refresh_rank_score(self):
+        '''Recomputes the feed rank of the selected announcements with a single UPDATE'''
+        return self.refresh_computed(search_vector=False)
+
+    def refresh_computed(self, search_vector=True, rank_score=True):
+        '''Recomputes the search vector and/or the feed rank of the selected announcements with a single UPDATE'''
+        values = {}
+        if search_vector:
+            values['search_vector'] = announcement_search_vector()
+        if rank_score:
+            values['rank_score'] = announcement_rank_score(apps.get_model('swipe', 'Promotion'))
+        return self.update(**values) if values else 0
+
+    def bump(self, bumped_at):
+        '''Moves the selected announcements to the top of the feed with a single UPDATE'''
+        return self.update(bumped_at=bumped_at, updated_at=bumped_at,
+            rank_score=announcement_rank_score(apps.get_model('swipe', 'Promotion'), bumped_at))
+
+    def claimable_by(self, user, now):
+        '''Announcements waiting for moderation that are not claimed by somebody else'''
+        return self.filter(moder_status='1').filter(
+            Q(claimed_until__isnull=True) | Q(claimed_until__lt=now) | Q(claimed_by=user))
+
+    def claim(self, user, size, lease):
+        '''
+        Claims up to `size` of the oldest claimable announcements for `lease`.
+        Rows locked by a concurrent claim are skipped, so moderators never get
+        the same announcements. Returns their ids and the end of the lease.
+        '''
+        now = timezone.now()
+        claimed_until = now + lease
+        with transaction.atomic():
+            ids = list(self.claimable_by(user, now).order_by('publication_date')
+                .select_for_update(skip_locked=True).values_list('pk', flat=True)[:size])
+            self.filter(pk__in=ids).update(claimed_by=user, claimed_until=claimed_until, updated_at=now)
+        return ids, claimed_until
+
+    def release(self, user, ids):
+        return self.filter(pk__in=ids, claimed_by=user).update(
+            claimed_by=None, claimed_until=None, updated_at=timezone.now())
+
+    def decide(self, user, ids, moder_status):
+        '''Sets moder_status of the announcements claimed by `user` with a single UPDATE'''
+        now = timezone.now()
+        return self.filter(pk__in=ids, moder_status='1', claimed_by=user, claimed_until__gte=now).update(
+            moder_status=moder_status, claimed_by=None, claimed_until=None, updated_at=now)
+
+    def facets(self):
+        '''
+        Counts of every option of FACET_FIELDS and min/max of RANGE_FIELDS,
+        computed by a single query of conditional aggregates.
+        '''
+        options, aggregates = [], {'count': Count('pk')}
+        for field in self.FACET_FIELDS:
+            for value, label in get_field_choices(self.model, field):
+                alias = f'option_{len(options)}'
+                options.append((field, value, label, alias))
+                aggregates[alias] = Count('pk', filter=Q(**{field: value}))
+        for field in self.RANGE_FIELDS:
+            aggregates[f'{field}_min'] = Min(field)
+            aggregates[f'{field}_max'] = Max(field)
+        result = self.order_by().aggregate(**aggregates)
+
+        facets = {field: [] for field in self.FACET_FIELDS}
+        for field, value, label, alias in options:
+            facets[field].append({'value': value, 'label': label, 'count': result[alias]})
+        return {
+            'count': result['count'],
+            'facets': facets,
+            'ranges': {field: {'min': result[f'{field}_min'], 'max': result[f'{field}_max']}
+                for field in self.RANGE_FIELDS},
+        }
+
+
+class HouseQuerySet(models.QuerySet):
+    def for_developer(self, developer):
+        '''Houses of the developer, filtered by a join instead of a pk list'''
+        return self.filter(dv_house__developer=developer)
+
+    def for_listing(self):
+        '''Joins the listing summary HouseListSerializer is served from'''
+        return self.select_related('summary__cover_image')
+
+
+class HouseSummaryQuerySet(models.QuerySet):
+    def refresh(self):
+        '''
+        Recomputes the summaries of the selected houses with a single UPDATE
+        of correlated subqueries over their announcements and images.
+        '''
+        announcements = apps.get_model('swipe', 'Announcement').objects.filter(
+            flat__house=OuterRef('house')).order_by()
+        images = apps.get_model('swipe', 'HouseImage').objects.filter(house=OuterRef('house'))
+
+        def aggregate(expression):
+            return Subquery(announcements.values('flat__house').annotate(value=expression).values('value'))
+
+        return self.update(
+            address=Coalesce(Subquery(announcements.order_by('pk').values('address')[:1]), Value('')),
+            min_price=aggregate(Min('price')),
+            min_area=aggregate(Min('total_area')),
+            announcement_count=Coalesce(aggregate(Count('pk')), 0),
+            cover_image=Subquery(images.order_by('pk').values('pk')[:1]),
+        )
+
+
+class FlatQuerySet(models.QuerySet):
+    CHESSBOARD_COLUMNS = ('id', 'housing', 'section', 'floor', 'number', 'status', 'square_meter_price',
+        'announcement', 'price', 'rooms', 'total_area')
+
+    def for_developer(self, developer):
+        '''Flats in houses of the developer'''
+        return self.filter(house__dv_house__developer=developer)
+
+    def for_listing(self):
+        '''
+        Joins the house and annotates the rooms and total area of the first
+        announcement of every flat, which FlatSerializer shows, so any number
+        of flats is serialized from one query.
+        '''
+        announcements = apps.get_model('swipe', 'Announcement').objects.filter(flat=OuterRef('pk')).order_by('pk')
+        return self.select_related('house').annotate(
+            announcement_rooms=Subquery(announcements.values('rooms')[:1]),
+            announcement_total_area=Subquery(announcements.values('total_area')[:1]),
+        )
+
+    def generate(self, house, layout, square_meter_price, housings, sections, floors, status=False):
+        '''
+        Creates a flat for every item of `layout` on every floor of every section of
+        every housing with one bulk INSERT. Numbers continue from the last flat of the house.
+        '''
+        with transaction.atomic():
+            # concurrent generations for the house wait here instead of taking the same numbers
+            apps.get_model('swipe', 'House').objects.select_for_update().filter(pk=house.pk).exists()
+            number = self.filter(house=house).aggregate(last=Coalesce(Max('number'), 0))['last']
+            flats = []
+            for housing in housings:
+                for section in sections:
+                    for floor in floors:
+                        for coefficient in layout:
+                            number += 1
+                            flats.append(self.model(house=house, housing=housing, section=section, floor=floor,
+                                number=number, status=status, square_meter_price=square_meter_price * coefficient))
+            return self.bulk_create(flats, batch_size=1000)
+
+    def change(self, square_meter_price=None, percent=None, base_price=None, floor_step=None, status=None):
+        '''
+        Changes the selected flats with a single UPDATE: sets `square_meter_price`,
+        changes the price by `percent` or sets it to `base_price` + `floor_step`
+        for every floor above the first, and/or sets `status`.
+        '''
+        changes = {}
+        if square_meter_price is not None:
+            changes['square_meter_price'] = Value(square_meter_price, output_field=models.FloatField())
+        elif percent is not None:
+            changes['square_meter_price'] = F('square_meter_price') * (1 + percent / 100)
+        elif base_price is not None:
+            changes['square_meter_price'] = ExpressionWrapper(
+                Value(base_price) + Value(floor_step) * (F('floor') - 1), output_field=models.FloatField())
+        if status is not None:
+            changes['status'] = status
+        return self.update(version=F('version') + 1, **changes)
+
+    def available_to(self, user, now):
+        '''Not reserved flats that are not held by somebody else, expired holds need no cleanup'''
+        return self.filter(reserved_at__isnull=True).filter(Q(held_until__isnull=True) | Q(held_until__lt=now) | Q(held_by=user))
+
+    def compare_and_swap(self, versions, **values):
+        '''
+        Sets `values` on the flats of `versions` (`{pk: version}`) with a single
+        UPDATE that also increments their versions, all or nothing: if any of
+        them has another version or is not in the queryset, nothing changes.
+        Returns the new versions and the sorted pks of the flats that were not
+        updated, which are empty on success.
+
+        No row is locked before the UPDATE, so concurrent changes of the same
+        flats only wait for each other's single statement.
+        '''
+        versions = dict(versions)
+        if not versions:
+            return {}, []
+        matching = Q()
+        for pk, version in versions.items():
+            matching |= Q(pk=pk, version=version)
+        with transaction.atomic():
+            updated = self.filter(matching).update(version=F('version') + 1, **values)
+            if updated == len(versions):
+                return {pk: version + 1 for pk, version in versions.items()}, []
+            transaction.set_rollback(True)
+        # read after the rollback, the change that conflicted may have been rolled back meanwhile
+        current = dict(self.filter(pk__in=versions).values_list('pk', 'version'))
+        taken = [pk for pk, version in versions.items() if current.get(pk) != version]
+        return {}, sorted(taken or versions)
+
+    def hold(self, user, ids, lease):
+        '''
+        Holds the flats `ids` available to `user` for `lease`, all or nothing.
+        Returns the end of the hold, the new versions and the pks of the taken flats.
+        '''
+        now = timezone.now()
+        held_until = now + lease
+        flats = self.available_to(user, now)
+        # read without locks, holds racing for a flat are decided by compare_and_swap()
+        versions = dict(flats.filter(pk__in=ids).values_list('pk', 'version'))
+        taken = sorted(set(ids) - set(versions))
+        if taken:
+            return held_until, {}, taken
+        versions, taken = flats.compare_and_swap(versions, held_by=user, held_until=held_until)
+        return held_until, versions, taken
+
+    def reserve(self, user, versions):
+        '''
+        Reserves the flats of `versions` (`{pk: version}`) that are available to
+        `user` and still have the versions the user has read, and ends their holds.
+        '''
+        now = timezone.now()
+        return self.available_to(user, now).compare_and_swap(
+            versions, reserved_by=user, reserved_at=now, held_by=None, held_until=None)
+
+    def release(self, user, ids):
+        '''Ends the holds of `user` on the flats `ids`'''
+        return self.filter(pk__in=ids, held_by=user).update(
+            held_by=None, held_until=None, version=F('version') + 1)
+
+    def chessboard(self):
+        '''
+        The selected flats as parallel arrays of CHESSBOARD_COLUMNS ordered by
+        housing, section, floor and number, with the first published
+        announcement of every flat, from a single query.
+        '''
+        announcements = apps.get_model('swipe', 'Announcement').objects.filter(
+            flat=OuterRef('pk'), moder_status='2', available_status='1').order_by('pk')
+        rows = self.annotate(
+            announcement=Subquery(announcements.values('pk')[:1]),
+            price=Subquery(announcements.values('price')[:1]),
+            rooms=Subquery(announcements.values('rooms')[:1]),
+            total_area=Subquery(announcements.values('total_area')[:1]),
+        ).order_by('housing', 'section', 'floor', 'number', 'pk').values_list(*self.CHESSBOARD_COLUMNS)
+        columns = zip(*rows) if rows else [()] * len(self.CHESSBOARD_COLUMNS)
+        return {name: list(column) for name, column in zip(self.CHESSBOARD_COLUMNS, columns)}
+
+
+class StoredFileQuerySet(models.QuerySet):
+    def acquire(self, name):
+        '''
+        Adds a reference to the file `name`. The row stays locked until the
+        end of the transaction, so the file cannot be released meanwhile.
+        '''
+        with transaction.atomic():
+            if self.filter(name=name).update(references=F('references') + 1):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(name=name, references=1)
+            except IntegrityError:
+                # created by a concurrent transaction
+                self.filter(name=name).update(references=F('references') + 1)
+
+    def release(self, names):
+        '''
+        Removes a reference to every file of `names` (a file may be listed more
+        than once) and returns the ones that are not referenced anymore. Rows
+        without references are kept until purge(). Files stored before
+        references were counted have no rows and are never referenced.
+        '''
+        counts = Counter(names)
+        by_count = defaultdict(list)
+        for name, count in counts.items():
+            by_count[count].append(name)
+        with transaction.atomic():
+            for count, group in by_count.items():
+                self.filter(name__in=group, references__gte=count).update(references=F('references') - count)
+            referenced = set(self.filter(name__in=counts, references__gt=0).values_list('name', flat=True))
+        return [name for name in counts if name not in referenced]
+
+    def purge(self, names, delete_file):
+        '''
+        Deletes the files of `names` that have no references with `delete_file`
+        and returns their names. The rows are created if missing and locked,
+        which waits for transactions adding references, so a file cannot get
+        a new reference while it is deleted.
+        '''
+        with transaction.atomic():
+            self.bulk_create([self.model(name=name) for name in names], ignore_conflicts=True)
+            unreferenced = list(self.filter(name__in=names, references=0)
+                .select_for_update().values_list('name', flat=True))
+            for name in unreferenced:
+                delete_file(name)
+            self.filter(name__in=unreferenced).delete()
+        return unreferenced
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:19
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0004_alter_client_notification_status'),
+        ('swipe', '0012_flat_square_meter_price'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('available_status', '1'), ('moder_status', '2')), fields=['-publication_date', '-id'], name='announcement_feed_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('moder_status', '1')), fields=['publication_date'], name='announcement_moderation_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='announcement',
+            index=models.Index(fields=['advertiser', '-publication_date'], name='announcement_advertiser_idx'),
+        ),
+        migrations.AlterField(
+            model_name='announcement',
+            name='advertiser',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='announcements', to='users.client'),
+        ),
+    ]
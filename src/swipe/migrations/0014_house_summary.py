@@ -0,0 +1,53 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:26
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_house_summaries(apps, schema_editor):
+    House = apps.get_model('swipe', 'House')
+    HouseSummary = apps.get_model('swipe', 'HouseSummary')
+    Announcement = apps.get_model('swipe', 'Announcement')
+    HouseImage = apps.get_model('swipe', 'HouseImage')
+
+    HouseSummary.objects.bulk_create(
+        [HouseSummary(house_id=pk) for pk in House.objects.values_list('pk', flat=True).iterator()],
+        batch_size=1000)
+
+    announcements = Announcement.objects.filter(flat__house=OuterRef('house')).order_by()
+    images = HouseImage.objects.filter(house=OuterRef('house'))
+
+    def aggregate(expression):
+        return Subquery(announcements.values('flat__house').annotate(value=expression).values('value'))
+
+    HouseSummary.objects.update(
+        address=Coalesce(Subquery(announcements.order_by('pk').values('address')[:1]), Value('')),
+        min_price=aggregate(Min('price')),
+        min_area=aggregate(Min('total_area')),
+        announcement_count=Coalesce(aggregate(Count('pk')), 0),
+        cover_image=Subquery(images.order_by('pk').values('pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swipe', '0013_announcement_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HouseSummary',
+            fields=[
+                ('house', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='swipe.house')),
+                ('address', models.CharField(blank=True, max_length=50)),
+                ('min_price', models.FloatField(null=True)),
+                ('min_area', models.FloatField(null=True)),
+                ('announcement_count', models.IntegerField(default=0)),
+                ('cover_image', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='swipe.houseimage')),
+            ],
+        ),
+        migrations.RunPython(fill_house_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swipe', '0014_house_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='housesummary',
+            index=models.Index(condition=models.Q(('announcement_count__gt', 0)), fields=['house'], name='house_summary_listed_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:31
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.contrib.postgres.search import SearchVector
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def fill_search_vectors(apps, schema_editor):
+    Announcement = apps.get_model('swipe', 'Announcement')
+    config = settings.SWIPE_SEARCH_CONFIG
+    Announcement.objects.update(search_vector=(
+        SearchVector('address', weight='A', config=config)
+        + SearchVector('description', weight='B', config=config)))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('swipe', '0015_house_summary_listed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='announcement',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='announcement_search_idx'),
+        ),
+        # icontains is compiled to UPPER(column::text) LIKE UPPER(pattern)
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS announcement_address_upper_trgm_idx '
+            'ON swipe_announcement USING gin ((UPPER(address::text)) gin_trgm_ops)',
+            'DROP INDEX CONCURRENTLY IF EXISTS announcement_address_upper_trgm_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS announcement_description_upper_trgm_idx '
+            'ON swipe_announcement USING gin ((UPPER(description::text)) gin_trgm_ops)',
+            'DROP INDEX CONCURRENTLY IF EXISTS announcement_description_upper_trgm_idx',
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+from swipe.geo import encode_geohash, parse_coords
+
+
+def fill_house_locations(apps, schema_editor):
+    House = apps.get_model('swipe', 'House')
+    houses = []
+    for house in House.objects.only('id', 'coords').iterator():
+        house.latitude, house.longitude = parse_coords(house.coords)
+        house.geohash = '' if house.latitude is None else encode_geohash(house.latitude, house.longitude)
+        houses.append(house)
+    House.objects.bulk_update(houses, ['latitude', 'longitude', 'geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swipe', '0016_announcement_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='house',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='latitude',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='longitude',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_house_locations, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='house',
+            index=models.Index(fields=['latitude', 'longitude'], name='house_location_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swipe', '0017_house_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='house',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:47
+
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+from django.db.models import F
+
+from swipe.ranking import announcement_rank_score
+
+
+def fill_rank_scores(apps, schema_editor):
+    Announcement = apps.get_model('swipe', 'Announcement')
+    Announcement.objects.update(rank_score=announcement_rank_score(
+        apps.get_model('swipe', 'Promotion'), ranked_at=F('publication_date')))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('swipe', '0018_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='rank_score',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.RunPython(fill_rank_scores, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('available_status', '1'), ('moder_status', '2')), fields=['-rank_score', '-id'], name='announcement_rank_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='announcement',
+            name='announcement_feed_idx',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swipe', '0019_announcement_rank_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='bumped_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='BumpSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('interval', models.DurationField()),
+                ('next_bump_at', models.DateTimeField(db_index=True)),
+                ('ends_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('announcement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bump_schedules', to='swipe.announcement')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 02:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('swipe', '0020_bump_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='claimed_by',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_announcements', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='claimed_until',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.8 on 2026-10-18 03:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('swipe', '0021_announcement_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcementimage',
+            name='processed_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='announcementimage',
+            name='variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='houseimage',
+            name='processed_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='houseimage',
+            name='variants',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        AddIndexConcurrently(
+            model_name='announcementimage',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='announcement_image_pending_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='houseimage',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='house_image_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2.8 on 2026-10-18 03:14
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+logger = logging.getLogger(__name__)
+
+
+def renumber_duplicate_flats(apps, schema_editor):
+    '''
+    Flats could share a position before the constraint. All flats of a
+    position but the first one get new numbers after the last flat of their
+    house, so the unique index can be built, and every change is logged.
+    '''
+    Flat = apps.get_model('swipe', 'Flat')
+    fields = ('house', 'housing', 'section', 'floor', 'number')
+    positions = (Flat.objects.values(*fields).annotate(count=Count('pk'), first=Min('pk'))
+        .filter(count__gt=1).order_by(*fields))
+    for position in positions:
+        first = position.pop('first')
+        del position['count']
+        number = Flat.objects.filter(house=position['house']).aggregate(last=Max('number'))['last']
+        for flat in Flat.objects.filter(**position).exclude(pk=first).order_by('pk'):
+            number += 1
+            logger.warning('Flat %s of house %s renumbered from %s to %s', flat.pk, flat.house_id, flat.number, number)
+            flat.number = number
+            flat.save(update_fields=['number'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('swipe', '0023_stored_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_flats, migrations.RunPython.noop, atomic=True),
+        # an index left INVALID by a failed build is skipped by IF NOT EXISTS, so it is dropped first
+        migrations.RunSQL(
+            '''
+            DO $$
+            BEGIN
+                IF EXISTS (SELECT FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+                        WHERE pg_class.relname = 'flat_position_unique' AND NOT pg_index.indisvalid) THEN
+                    DROP INDEX flat_position_unique;
+                END IF;
+            END
+            $$
+            ''',
+            migrations.RunSQL.noop,
+        ),
+        # the index is built without locking the table and then becomes the constraint
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS flat_position_unique '
+                    'ON swipe_flat (house_id, housing, section, floor, number)',
+                    'DROP INDEX CONCURRENTLY IF EXISTS flat_position_unique',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE swipe_flat ADD CONSTRAINT flat_position_unique UNIQUE USING INDEX flat_position_unique',
+                    'ALTER TABLE swipe_flat DROP CONSTRAINT flat_position_unique',
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='flat',
+                    constraint=models.UniqueConstraint(fields=('house', 'housing', 'section', 'floor', 'number'), name='flat_position_unique'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.8 on 2026-10-18 03:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('swipe', '0024_flat_position_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flat',
+            name='held_by',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='held_flats', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='flat',
+            name='held_until',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='flat',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 14:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swipe', '0025_flat_reservation'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='housenews',
+            options={'ordering': ['-publication_date']},
+        ),
+    ]
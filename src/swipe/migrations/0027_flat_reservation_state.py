@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 04:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('swipe', '0026_alter_housenews_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flat',
+            name='reserved_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='flat',
+            name='reserved_by',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reserved_flats', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,12 +1,18 @@
 from datetime import datetime as dt
 from pathlib import Path
-import os
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core import validators
 from django.db import models
 from django.dispatch.dispatcher import receiver
+from django.utils import timezone
 
-from users.models import Client, Notary, Developer
+from swipe.cache import bump_generation, bump_house_generations
+from swipe.geo import encode_geohash, parse_coords
+from swipe.images import variant_names
+from swipe.managers import AnnouncementQuerySet, FlatQuerySet, HouseQuerySet, HouseSummaryQuerySet, StoredFileQuerySet
+from users.models import Client, Notary, Developer, User
 
 
 def get_upload_path(instance, filename):
@@ -95,6 +101,18 @@ class House(models.Model):
     sections = models.IntegerField(validators=[validators.MinValueValidator(1)])
     floors = models.IntegerField(validators=[validators.MinValueValidator(1)])
     coords = models.CharField(max_length=150)
+    latitude = models.FloatField(null=True, editable=False)
+    longitude = models.FloatField(null=True, editable=False)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
+    # also touched by changes of images, see touch_parent
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = HouseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='house_location_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -126,6 +144,23 @@ class Flat(models.Model):
     number = models.IntegerField(validators=[validators.MinValueValidator(1)])
     status = models.BooleanField(default=False)
     square_meter_price = models.FloatField(validators=[validators.MinValueValidator(0.0)], default=0.0)
+    # incremented by every change of the flat, updates compare it to the version the client has read
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # a hold keeps the flat for its user until held_until, expired holds are simply ignored
+    held_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, editable=False,
+        related_name='held_flats')
+    held_until = models.DateTimeField(null=True, editable=False)
+    # set by reserving the flat, status is left to the developer
+    reserved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, editable=False,
+        related_name='reserved_flats')
+    reserved_at = models.DateTimeField(null=True, editable=False)
+
+    objects = FlatQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['house', 'housing', 'section', 'floor', 'number'], name='flat_position_unique'),
+        ]
 
 
 class Announcement(models.Model):
@@ -203,17 +238,105 @@ class Announcement(models.Model):
     price = models.FloatField(validators=[validators.MinValueValidator(0.0)])
     moder_status = models.CharField(max_length=2, choices=MODERATION_STATUSES, default='1')
     available_status = models.CharField(max_length=2, choices=AVAILABILITY, default='1')
-    advertiser = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='announcements')
+    # covered by announcement_advertiser_idx
+    advertiser = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='announcements', db_index=False)
+    # address and description, maintained by a post_save receiver
+    search_vector = SearchVectorField(null=True, editable=False)
+    # also touched by changes of images and promotion, see touch_parent
+    updated_at = models.DateTimeField(auto_now=True)
+    # set by to_the_top and bump schedules instead of publication_date
+    bumped_at = models.DateTimeField(null=True, editable=False)
+    # bump (or publication) time and promotion, maintained by update_announcement_rank_score
+    rank_score = models.FloatField(default=0.0, editable=False)
+    # moderator working on the announcement until the lease expires
+    claimed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, editable=False,
+        related_name='claimed_announcements')
+    claimed_until = models.DateTimeField(null=True, editable=False)
+
+    objects = AnnouncementQuerySet.as_manager()
+
+    # fields search_vector and rank_score are computed from
+    SEARCH_VECTOR_FIELDS = ('address', 'description')
+    RANK_SCORE_FIELDS = ('publication_date', 'bumped_at')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # lets signal receivers see which flat the announcement was moved from
+        instance._loaded_flat_id = instance.__dict__.get('flat_id')
+        # and which computed fields are out of date
+        instance._loaded_values = {name: instance.__dict__[name]
+            for name in cls.SEARCH_VECTOR_FIELDS + cls.RANK_SCORE_FIELDS if name in instance.__dict__}
+        return instance
+
+    def has_changed(self, names, update_fields=None):
+        '''Whether any of the fields `names` was saved with another value than it was loaded with'''
+        loaded = getattr(self, '_loaded_values', {})
+        # deferred fields are not saved
+        return any((update_fields is None or name in update_fields) and name in self.__dict__
+            and (name not in loaded or loaded[name] != self.__dict__[name]) for name in names)
+
+    class Meta:
+        indexes = [
+            # public feed: moderated and available announcements, by rank
+            models.Index(fields=['-rank_score', '-id'], name='announcement_rank_idx',
+                condition=models.Q(moder_status='2', available_status='1')),
+            # moderation queue: announcements waiting for a check, oldest first
+            models.Index(fields=['publication_date'], name='announcement_moderation_idx',
+                condition=models.Q(moder_status='1')),
+            # client's own announcements
+            models.Index(fields=['advertiser', '-publication_date'], name='announcement_advertiser_idx'),
+            # full-text search; address and description icontains filters are served
+            # by trigram indexes on UPPER(address) and UPPER(description) created in migrations
+            GinIndex(fields=['search_vector'], name='announcement_search_idx'),
+        ]
 
 
 class AnnouncementImage(models.Model):
     announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to=get_upload_path)
+    # filled by the process_images command, see swipe.images
+    variants = models.JSONField(default=dict, editable=False)
+    processed_at = models.DateTimeField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='announcement_image_pending_idx',
+                condition=models.Q(processed_at__isnull=True)),
+        ]
 
 
 class HouseImage(models.Model):
     house = models.ForeignKey(House, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to=get_upload_path)
+    # filled by the process_images command, see swipe.images
+    variants = models.JSONField(default=dict, editable=False)
+    processed_at = models.DateTimeField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='house_image_pending_idx',
+                condition=models.Q(processed_at__isnull=True)),
+        ]
+
+
+class HouseSummary(models.Model):
+    '''Listing aggregates of a house, kept up to date by signals'''
+    house = models.OneToOneField(House, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    address = models.CharField(max_length=50, blank=True)
+    min_price = models.FloatField(null=True)
+    min_area = models.FloatField(null=True)
+    announcement_count = models.IntegerField(default=0)
+    cover_image = models.ForeignKey(HouseImage, on_delete=models.SET_NULL, null=True, related_name='+')
+
+    objects = HouseSummaryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # houses shown to clients
+            models.Index(fields=['house'], name='house_summary_listed_idx',
+                condition=models.Q(announcement_count__gt=0)),
+        ]
 
 
 class ClientAnnouncementFavourites(models.Model):
@@ -258,51 +381,125 @@ class Promotion(models.Model):
     is_big = models.BooleanField(default=False)
 
 
-image_attributes = ('image',)
+class BumpSchedule(models.Model):
+    '''Paid bumps of an announcement every `interval` until `ends_at`, applied by the apply_bumps command'''
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='bump_schedules')
+    interval = models.DurationField()
+    next_bump_at = models.DateTimeField(db_index=True)
+    ends_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
 
 
-@receiver(models.signals.post_delete, sender=AnnouncementImage)
+@receiver(models.signals.pre_save, sender=House)
+def fill_house_location(sender, instance, **kwargs):
+    instance.latitude, instance.longitude = parse_coords(instance.coords)
+    instance.geohash = '' if instance.latitude is None else encode_geohash(instance.latitude, instance.longitude)
+
+
+@receiver(models.signals.post_save, sender=House)
+def create_house_summary(sender, instance, created, **kwargs):
+    if created:
+        HouseSummary.objects.create(house=instance)
+
+
+@receiver(models.signals.post_save, sender=Announcement)
+@receiver(models.signals.post_delete, sender=Announcement)
+def refresh_announcement_house_summary(sender, instance, **kwargs):
+    flat_ids = {instance.flat_id, getattr(instance, '_loaded_flat_id', None)} - {None}
+    if flat_ids:
+        house_ids = set(Flat.objects.filter(pk__in=flat_ids).values_list('house_id', flat=True))
+        HouseSummary.objects.filter(house__in=house_ids).refresh()
+        bump_house_generations(house_ids)
+    instance._loaded_flat_id = instance.flat_id
+
+
+@receiver(models.signals.post_save, sender=Announcement)
+def update_announcement_computed_fields(sender, instance, created, update_fields=None, **kwargs):
+    '''Recomputes search_vector and rank_score with one UPDATE when the fields they are computed from change'''
+    search_vector = created or instance.has_changed(Announcement.SEARCH_VECTOR_FIELDS, update_fields)
+    rank_score = created or instance.has_changed(Announcement.RANK_SCORE_FIELDS, update_fields)
+    if search_vector or rank_score:
+        Announcement.objects.filter(pk=instance.pk).refresh_computed(search_vector, rank_score)
+    instance._loaded_values = {name: instance.__dict__[name]
+        for name in Announcement.SEARCH_VECTOR_FIELDS + Announcement.RANK_SCORE_FIELDS if name in instance.__dict__}
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Promotion)
+def update_promoted_announcement_rank_score(sender, instance, **kwargs):
+    Announcement.objects.filter(pk=instance.announcement_id).refresh_rank_score()
+
+
+class StoredFile(models.Model):
+    '''A file of the content addressed storage (swipe.storage) and the number of references to it'''
+    name = models.CharField(max_length=255, primary_key=True)
+    references = models.PositiveIntegerField(default=0)
+
+    objects = StoredFileQuerySet.as_manager()
+
+
+@receiver(models.signals.post_save, sender=Flat)
+@receiver(models.signals.post_delete, sender=Flat)
+@receiver(models.signals.post_save, sender=HouseImage)
 @receiver(models.signals.post_delete, sender=HouseImage)
-def auto_delete_file_on_delete(sender, instance, **kwargs):
-    """
-    Deletes file from filesystem
-    when corresponding sender object is deleted.
-    """
-    for attribute in image_attributes:
-        if hasattr(instance, attribute):
-            attr = getattr(instance, attribute)
-            if attr:
-                try:
-                    if os.path.isfile(attr.path):
-                        os.remove(attr.path)
-                except ValueError:
-                    pass
+def refresh_house_summary(sender, instance, **kwargs):
+    HouseSummary.objects.filter(house_id=instance.house_id).refresh()
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=HouseImage)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=AnnouncementImage)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Promotion)
+def touch_parent(sender, instance, **kwargs):
+    '''Children are serialized with their parent, so they change its version'''
+    if sender is HouseImage:
+        House.objects.filter(pk=instance.house_id).update(updated_at=timezone.now())
+    else:
+        Announcement.objects.filter(pk=instance.announcement_id).update(updated_at=timezone.now())
+
+
+# image models, their parent models and the parent foreign keys
+IMAGE_MODELS = (
+    (AnnouncementImage, Announcement, 'announcement'),
+    (HouseImage, House, 'house'),
+)
+
+
+# cache generations (see swipe.cache) depending on every model
+CACHE_SCOPES = {
+    House: ('announcements', 'houses', 'flats', 'house_news'),
+    HouseNews: ('house_news',),
+    DeveloperHouse: ('houses', 'flats'),
+    Flat: ('announcements', 'houses', 'flats'),
+    Announcement: ('announcements', 'houses', 'flats'),
+    AnnouncementImage: ('announcements',),
+    HouseImage: ('houses',),
+    Promotion: ('announcements',),
+}
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=House)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=HouseNews)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=DeveloperHouse)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Flat)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Announcement)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=AnnouncementImage)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=HouseImage)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Promotion)
+def bump_cache_generations(sender, instance, **kwargs):
+    bump_generation(*CACHE_SCOPES[sender])
+
+
+@receiver([models.signals.post_save, models.signals.post_delete], sender=House)
+@receiver([models.signals.post_save, models.signals.post_delete], sender=Flat)
+def bump_house_cache_generation(sender, instance, **kwargs):
+    '''Values cached per house, announcements bump theirs in refresh_announcement_house_summary()'''
+    bump_house_generations([instance.pk if sender is House else instance.house_id])
+
 
 @receiver(models.signals.post_delete, sender=AnnouncementImage)
 @receiver(models.signals.post_delete, sender=HouseImage)
-def auto_delete_file_on_change(sender, instance, **kwargs):
-    """
-    Deletes old file from filesystem
-    when corresponding sender object is updated
-    with new file.
-    """
-    if not instance.pk:
-        return False
-
-    try:
-        sender_obj = sender.objects.get(pk=instance.pk)
-    except sender.DoesNotExist:
-        return False
-    old_file = new_file = None
-    for attribute in image_attributes:
-        if hasattr(sender_obj, attribute):
-            old_file = getattr(sender_obj, attribute)
-        if hasattr(instance, attribute):
-            new_file = getattr(instance, attribute)
-
-    if not old_file == new_file:
-        try:
-            if os.path.isfile(old_file.path):
-                os.remove(old_file.path)
-        except ValueError as e:
-            pass
\ No newline at end of file
+def delete_image_files(sender, instance, **kwargs):
+    '''
+    Releases the photo and its variants. Files left without references are
+    deleted in the background after the commit, see swipe.storage.
+    '''
+    instance.image.storage.delete_many([instance.image.name, *variant_names(instance.variants)])
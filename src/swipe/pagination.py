@@ -0,0 +1,154 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPageNumberPagination(PageNumberPagination):
+    '''
+    Page number pagination with an opt-in keyset (cursor) mode.
+
+    Old clients keep getting `?page=N` pages with a total count. Clients that
+    send `?pagination=cursor` (or a `cursor` returned by a previous page) get
+    pages filtered by the last seen `ordering` values instead, so there is no
+    OFFSET scan, no COUNT(*) and no skipped or repeated rows when the order
+    of already seen items changes.
+    '''
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    # Every field must be unique together with the following ones,
+    # so the last one should always be the primary key.
+    ordering = ('-id',)
+
+    def is_cursor_mode(self, request):
+        return (self.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == self.cursor_mode)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.is_cursor_mode(request)
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        queryset = queryset.order_by(*self.ordering)
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(self.get_keyset_filter(self.decode_cursor(queryset, encoded)))
+
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_position = self.get_position(page[-1]) if self.has_next else None
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_cursor_link(),
+            'results': data,
+        })
+
+    def get_schema_fields(self, view):
+        import coreapi
+        import coreschema
+        return super().get_schema_fields(view) + [
+            coreapi.Field(
+                name=self.mode_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.Enum(
+                    enum=[self.cursor_mode],
+                    title='Pagination mode',
+                    description='Use keyset (cursor) pagination instead of page numbers.'
+                )
+            ),
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description='Opaque cursor returned in the `next` link of the previous page.'
+                )
+            ),
+        ]
+
+    def get_next_cursor_link(self):
+        if not self.has_next:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_position(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    def get_keyset_filter(self, position):
+        '''
+        Builds `(a < x) OR (a = x AND b < y) OR ...` for the ordering fields
+        and the position of the last row of the previous page.
+        '''
+        keyset_filter = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{name}__{lookup}': position[index]})
+            for previous, value in zip(self.ordering[:index], position[:index]):
+                condition &= Q(**{previous.lstrip('-'): value})
+            keyset_filter |= condition
+        return keyset_filter
+
+    def encode_cursor(self, position):
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('ascii')).decode('ascii')
+
+    def get_ordering_field(self, queryset, name):
+        '''Returns the model field or the output field of the annotation the queryset is ordered by'''
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, queryset, encoded):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [self.get_ordering_field(queryset, field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, UnicodeEncodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class AnnouncementFeedPagination(KeysetPageNumberPagination):
+    '''Pagination of the public announcement feed'''
+    ordering = ('-rank_score', '-id')
+
+
+class ModerationQueuePagination(KeysetPageNumberPagination):
+    '''Pagination of the moderation queue, oldest first'''
+    ordering = ('publication_date', 'id')
+
+
+class FavouritesPagination(KeysetPageNumberPagination):
+    '''
+    Pagination of client favourites, recently added first.
+
+    The queryset must be annotated with `favourite_id`, the id of the
+    favourites row of the client.
+    '''
+    ordering = ('-favourite_id',)
@@ -0,0 +1,40 @@
+from datetime import timezone
+
+from django.conf import settings
+from django.db.models import Case, DateTimeField, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Extract
+
+
+# promotion options counted by SWIPE_PROMOTION_BOOSTS
+PROMOTION_OPTIONS = {
+    'is_turbo': Q(is_turbo=True),
+    'is_big': Q(is_big=True),
+    'phrase': ~Q(phrase='0'),
+    'color': ~Q(color='0'),
+}
+
+
+def promotion_boost():
+    '''Seconds added to the publication time by the options of a promotion'''
+    boost = Value(0.0)
+    for option, hours in settings.SWIPE_PROMOTION_BOOSTS.items():
+        boost += Case(When(PROMOTION_OPTIONS[option], then=Value(hours * 3600.0)), default=Value(0.0))
+    return boost
+
+
+def announcement_rank_score(promotion_model, ranked_at=None):
+    '''
+    Sort key of the feed stored in Announcement.rank_score: the time of the
+    last bump (or publication) as a unix timestamp, moved forward by the
+    boost of the promotion. A promoted announcement ranks as if it was
+    bumped that much later. `ranked_at` overrides the time, e.g. when
+    bumped_at is set by the same UPDATE, which would see its old value.
+    '''
+    if ranked_at is None:
+        ranked_at = Coalesce('bumped_at', 'publication_date')
+    elif not hasattr(ranked_at, 'resolve_expression'):
+        ranked_at = Value(ranked_at, output_field=DateTimeField())
+    boost = promotion_model.objects.filter(announcement=OuterRef('pk')).annotate(
+        boost=promotion_boost()).values('boost')
+    return (Extract(ranked_at, 'epoch', tzinfo=timezone.utc, output_field=FloatField())
+        + Coalesce(Subquery(boost, output_field=FloatField()), Value(0.0)))
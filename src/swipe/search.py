@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery, SearchRank,
+    SearchVector, TrigramSimilarity)
+from django.db.models import F, Q
+from django.db.models.functions import Upper
+
+
+def announcement_search_vector():
+    '''Weighted document stored in Announcement.search_vector'''
+    config = settings.SWIPE_SEARCH_CONFIG
+    return (SearchVector('address', weight='A', config=config)
+        + SearchVector('description', weight='B', config=config))
+
+
+def search_announcements(queryset, text):
+    '''
+    Filters announcements by a web-search style query over address and
+    description, by a part of the address or by an address similar to the
+    query (misspelled), ranked by full-text relevance plus trigram
+    similarity of the address.
+    '''
+    config = settings.SWIPE_SEARCH_CONFIG
+    query = SearchQuery(text, config=config, search_type='websearch')
+    # UPPER() like icontains, so both use the trigram index of UPPER(address)
+    return queryset.alias(upper_address=Upper('address')).filter(
+        Q(search_vector=query) | Q(address__icontains=text) | Q(upper_address__trigram_similar=text.upper())
+    ).annotate(
+        rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('address', text),
+        address_highlight=SearchHeadline('address', query, config=config, highlight_all=True),
+        description_highlight=SearchHeadline('description', query, config=config,
+            max_words=25, min_words=10, max_fragments=2),
+    ).order_by('-rank', '-id')
@@ -1,10 +1,14 @@
+from datetime import timedelta
 import logging
 
+from django.conf import settings
 from django.core import validators
 from django.db.models import fields
+from django.utils import timezone
 from rest_framework import serializers
 
-from swipe.models import AnnouncementImage, House, Announcement, Flat, HouseImage, HouseNews, DeveloperHouse, Promotion, ClientAnnouncementFavourites, ClientHouseFavourites
+from swipe.images import variant_url, variant_urls
+from swipe.models import AnnouncementImage, House, Announcement, Flat, HouseImage, HouseNews, HouseSummary, DeveloperHouse, Promotion, BumpSchedule, ClientAnnouncementFavourites, ClientHouseFavourites
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +19,15 @@ class HouseNewsSerializer(serializers.ModelSerializer):
 
 
 class HouseImagesSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField('get_variants')
+
+    def get_variants(self, image):
+        # the original image until it is processed by the process_images command
+        return variant_urls(image)
+
     class Meta:
         model = HouseImage
-        exclude = 'house',
+        exclude = 'house', 'processed_at'
 
 
 class HouseListSerializer(serializers.HyperlinkedModelSerializer):
@@ -28,37 +38,56 @@ class HouseListSerializer(serializers.HyperlinkedModelSerializer):
     from_summ = serializers.SerializerMethodField('get_from_summ')
     from_area = serializers.SerializerMethodField('get_from_area')
     avatar = serializers.SerializerMethodField('get_avatar')
+    avatar_webp = serializers.SerializerMethodField('get_avatar_webp')
+    distance = serializers.SerializerMethodField('get_distance')
+    is_favourite = serializers.SerializerMethodField('get_is_favourite')
+
+    def get_summary(self, house):
+        try:
+            summary = house.summary
+        except HouseSummary.DoesNotExist:
+            return None
+        return summary if summary.announcement_count else None
 
     def get_address(self, house):
-        if len(house.flats.all()) and len(house.flats.first().announcements.all()):
-            announcements = Announcement.objects.filter(
-                flat__in=[flat.pk for flat in house.flats.all()])
-            return announcements.first().address
-        else:
-            return '-'
+        summary = self.get_summary(house)
+        return '-' if summary is None else summary.address
 
     def get_from_summ(self, house):
-        if len(house.flats.all()) and len(house.flats.first().announcements.all()):
-            announcements = Announcement.objects.filter(
-                flat__in=[flat.pk for flat in house.flats.all()])
-            return min([an.price for an in announcements])
-        else:
-            return '-'
+        summary = self.get_summary(house)
+        return '-' if summary is None else summary.min_price
 
     def get_from_area(self, house):
-        if len(house.flats.all()) and len(house.flats.first().announcements.all()):
-            announcements = Announcement.objects.filter(
-                flat__in=[flat.pk for flat in house.flats.all()])
-            return min([an.total_area for an in announcements])
-        else:
-            return '-'
+        summary = self.get_summary(house)
+        return '-' if summary is None else summary.min_area
+
+    def get_cover_image(self, house):
+        try:
+            return house.summary.cover_image
+        except HouseSummary.DoesNotExist:
+            return None
 
     def get_avatar(self, house):
-        return '-' if not house.images.all() else house.images.first().image.url
+        cover_image = self.get_cover_image(house)
+        return '-' if cover_image is None else variant_url(cover_image, 'card')
+
+    def get_avatar_webp(self, house):
+        cover_image = self.get_cover_image(house)
+        return '-' if cover_image is None else variant_url(cover_image, 'card', 'webp')
+
+    def get_distance(self, house):
+        '''Distance in km to the `near` point, if it was given'''
+        distance = getattr(house, 'distance', None)
+        return None if distance is None else round(distance, 3)
+
+    def get_is_favourite(self, house):
+        # filled by ClientFavouritesMixin for the whole page
+        return house.pk in self.context.get('favourite_ids', ())
 
     class Meta:
         model = House
-        fields = 'detail_url', 'id', 'name', 'address', 'from_summ', 'from_area', 'avatar'
+        fields = ('detail_url', 'id', 'name', 'address', 'from_summ', 'from_area', 'avatar', 'avatar_webp',
+            'latitude', 'longitude', 'distance', 'is_favourite')
 
 
 class HouseSerializer(serializers.HyperlinkedModelSerializer):
@@ -69,7 +98,8 @@ class HouseSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('id', 'name', 'description', 'status', 'type', '_class', 'building_technology',
             'territory', 'sea_distance', 'communal_payments', 'ceiling_height', 'has_gas', 
             'heating_type', 'sewerage', 'water_supply', 'water_supply', 'calculation_type',
-            'perpose', 'summ_in_contract', 'housings', 'sections', 'floors', 'coords', 'images')
+            'perpose', 'summ_in_contract', 'housings', 'sections', 'floors', 'coords', 'latitude',
+            'longitude', 'images')
     
     def validate(self, data):
         user = self.context['request'].user
@@ -101,9 +131,15 @@ class PromotionSerializer(serializers.ModelSerializer):
 
 
 class AnnouncementImagesSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField('get_variants')
+
+    def get_variants(self, image):
+        # the original image until it is processed by the process_images command
+        return variant_urls(image)
+
     class Meta:
         model = AnnouncementImage
-        exclude = 'announcement',
+        exclude = 'announcement', 'processed_at'
 
 
 class AnnouncementListSerializer(serializers.HyperlinkedModelSerializer):
@@ -113,6 +149,8 @@ class AnnouncementListSerializer(serializers.HyperlinkedModelSerializer):
     flat_detail = serializers.SerializerMethodField('get_flat_detail')
     promotion = PromotionSerializer(read_only=True)
     avatar = serializers.SerializerMethodField('get_avatar')
+    avatar_webp = serializers.SerializerMethodField('get_avatar_webp')
+    is_favourite = serializers.SerializerMethodField('get_is_favourite')
 
     def get_flat_detail(self, announcement):
         result = f'{announcement.rooms} квартира, {announcement.total_area} м2'
@@ -120,13 +158,38 @@ class AnnouncementListSerializer(serializers.HyperlinkedModelSerializer):
             result += f', {announcement.flat.section}/{announcement.flat.floor} эт.'
         return result
     
+    def get_first_image(self, announcement):
+        # filled by Announcement.objects.for_listing()
+        images = getattr(announcement, 'first_images', None)
+        if images is None:
+            images = announcement.first_images = list(announcement.images.order_by('pk')[:1])
+        return images[0] if images else None
+
     def get_avatar(self, announcement):
-        return '-' if not announcement.images.all() else announcement.images.first().image.url
+        image = self.get_first_image(announcement)
+        return '-' if image is None else variant_url(image, 'card')
+
+    def get_avatar_webp(self, announcement):
+        image = self.get_first_image(announcement)
+        return '-' if image is None else variant_url(image, 'card', 'webp')
+
+    def get_is_favourite(self, announcement):
+        # filled by ClientFavouritesMixin for the whole page
+        return announcement.pk in self.context.get('favourite_ids', ())
 
     class Meta:
         model = Announcement
         fields = ['detail_url', 'flat_detail', 'id', 'price', 'address', 
-            'publication_date', 'promotion', 'avatar']
+            'publication_date', 'promotion', 'avatar', 'avatar_webp', 'is_favourite']
+
+
+class AnnouncementSearchSerializer(AnnouncementListSerializer):
+    rank = serializers.FloatField(read_only=True)
+    address_highlight = serializers.CharField(read_only=True)
+    description_highlight = serializers.CharField(read_only=True)
+
+    class Meta(AnnouncementListSerializer.Meta):
+        fields = AnnouncementListSerializer.Meta.fields + ['rank', 'address_highlight', 'description_highlight']
 
 
 class AnnouncementRetrieveSerializer(serializers.ModelSerializer):
@@ -154,16 +217,38 @@ class ClientAnnouncementRetrieveSerializer(AnnouncementRetrieveSerializer):
 
 
 class AnnouncementToTheTopSerializer(serializers.ModelSerializer):
-    publication_date = serializers.DateTimeField()
     class Meta:
         model = Announcement
-        fields = ['publication_date']
+        fields = ['bumped_at']
+        read_only_fields = ['bumped_at']
+
+
+class BumpScheduleSerializer(serializers.ModelSerializer):
+    interval_hours = serializers.IntegerField(min_value=1, max_value=24 * 7, write_only=True)
+    days = serializers.IntegerField(min_value=1, max_value=90, write_only=True)
+
+    class Meta:
+        model = BumpSchedule
+        fields = ['id', 'announcement', 'interval_hours', 'days', 'interval', 'next_bump_at', 'ends_at']
+        read_only_fields = ['announcement', 'interval', 'next_bump_at', 'ends_at']
+
+    def create(self, validated_data):
+        now = timezone.now()
+        # the first bump is applied by the next run of apply_bumps
+        return BumpSchedule.objects.create(
+            announcement=validated_data['announcement'],
+            interval=timedelta(hours=validated_data['interval_hours']),
+            next_bump_at=now,
+            ends_at=now + timedelta(days=validated_data['days']),
+        )
 
 
 class AnnouncementAdminSerializer(AnnouncementRetrieveSerializer):
 
     class Meta(AnnouncementRetrieveSerializer.Meta):
-        fields = '__all__'
+        fields = None
+        # computed ranking columns and moderation claims are managed by the app
+        exclude = ('search_vector', 'rank_score', 'bumped_at', 'claimed_by', 'claimed_until')
 
 
 class AnnoncementFavouritesSerializer(serializers.ModelSerializer):
@@ -180,6 +265,107 @@ class AnnoncementFavouritesCreateSerializer(serializers.ModelSerializer):
         fields = []
 
 
+class ModerationClaimSerializer(serializers.Serializer):
+    size = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class ModerationReleaseSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=100)
+
+
+class ModerationDecisionSerializer(ModerationReleaseSerializer):
+    moder_status = serializers.ChoiceField(choices=Announcement.MODERATION_STATUSES[1:])
+
+
+class FlatGenerationSerializer(serializers.Serializer):
+    '''Flats of a house to create: every floor gets a flat for every item of `layout`'''
+    layout = serializers.ListField(child=serializers.FloatField(min_value=0), allow_empty=False, max_length=50,
+        help_text='Price coefficients of the flats of a floor, in the order of their numbers')
+    square_meter_price = serializers.FloatField(min_value=0)
+    housings = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, required=False,
+        help_text='All housings of the house by default')
+    sections = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, required=False,
+        help_text='All sections of the house by default')
+    floors = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, required=False,
+        help_text='All floors of the house by default')
+
+    def validate(self, data):
+        house = self.context['house']
+        for field, count, message in (('housings', house.housings, 'У дома корпусов меньше'),
+                ('sections', house.sections, 'У дома секций меньше'),
+                ('floors', house.floors, 'У дома этажей меньше')):
+            if field not in data:
+                data[field] = range(1, count + 1)
+            elif max(data[field]) > count:
+                raise serializers.ValidationError(message)
+            data[field] = sorted(set(data[field]))
+        total = len(data['housings']) * len(data['sections']) * len(data['floors']) * len(data['layout'])
+        if total > settings.SWIPE_MAX_GENERATED_FLATS:
+            raise serializers.ValidationError(f'Нельзя создать больше {settings.SWIPE_MAX_GENERATED_FLATS} квартир за раз')
+        return data
+
+
+class FlatBulkUpdateSerializer(serializers.Serializer):
+    '''
+    Flats to change (house and optional housing, section, floors and status)
+    and the changes: one way to change the price and/or a new status
+    '''
+    PRICE_FIELDS = ('square_meter_price', 'percent', 'base_price')
+
+    house = serializers.IntegerField(min_value=1)
+    housing = serializers.IntegerField(min_value=1, required=False)
+    section = serializers.IntegerField(min_value=1, required=False)
+    min_floor = serializers.IntegerField(min_value=1, required=False)
+    max_floor = serializers.IntegerField(min_value=1, required=False)
+    # a missing BooleanField would be False in form data
+    status = serializers.BooleanField(allow_null=True, default=None)
+
+    square_meter_price = serializers.FloatField(min_value=0, required=False,
+        help_text='New price of a square meter')
+    percent = serializers.FloatField(min_value=-99, required=False,
+        help_text='Change of the price of a square meter in percents')
+    base_price = serializers.FloatField(min_value=0, required=False,
+        help_text='Price of a square meter on the first floor, which grows by `floor_step` every floor')
+    floor_step = serializers.FloatField(required=False)
+    new_status = serializers.BooleanField(allow_null=True, default=None)
+
+    def validate(self, data):
+        price_fields = [field for field in self.PRICE_FIELDS if field in data]
+        if len(price_fields) > 1:
+            raise serializers.ValidationError('Цену можно менять только одним способом')
+        if not price_fields and data['new_status'] is None:
+            raise serializers.ValidationError('Нечего менять')
+        if ('base_price' in data) != ('floor_step' in data):
+            raise serializers.ValidationError('base_price и floor_step задаются вместе')
+        if 'min_floor' in data and 'max_floor' in data and data['min_floor'] > data['max_floor']:
+            raise serializers.ValidationError('min_floor больше max_floor')
+        return data
+
+
+class PriceStatsQuerySerializer(serializers.Serializer):
+    section = serializers.IntegerField(min_value=1, required=False)
+    rooms = serializers.ChoiceField(choices=Announcement.ROOMS, required=False,
+        help_text='Only flats with a published announcement of these rooms')
+    buckets = serializers.IntegerField(min_value=1, max_value=50, default=10, help_text='Ranges of the histograms')
+
+
+class FlatHoldSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=100)
+
+
+class FlatVersionSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    version = serializers.IntegerField(min_value=0, help_text='Version of the flat the client has read')
+
+
+class FlatReservationSerializer(serializers.Serializer):
+    flats = serializers.ListField(child=FlatVersionSerializer(), allow_empty=False, max_length=100)
+
+
+class FavouritesBulkSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+
+
 class HouseFavouritesSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -198,19 +384,27 @@ class FlatSerializer(serializers.HyperlinkedModelSerializer):
     flat_detail_url = serializers.HyperlinkedIdentityField(
         view_name='swipe:flat-detail'
     )
+    version = serializers.IntegerField(min_value=0, required=False,
+        help_text='Updates fail with 409 if the flat has changed since this version')
 
     def get_flat_details(self, flat):
-        announcement = flat.announcements.first()
-        if announcement is not None:
-            result = f'{announcement.rooms} квартира, {announcement.total_area} м2'
+        # filled by Flat.objects.for_listing()
+        if not hasattr(flat, 'announcement_rooms'):
+            announcement = flat.announcements.order_by('pk').first()
+            flat.announcement_rooms = announcement and announcement.rooms
+            flat.announcement_total_area = announcement and announcement.total_area
+        if flat.announcement_rooms is not None:
+            result = f'{flat.announcement_rooms} квартира, {flat.announcement_total_area} м2'
             return result + f', {flat.section}/{flat.floor} эт.'
         else:
             return '-'
 
     class Meta:
         model = Flat
-        fields = ('id', 'flat_details', 'flat_detail_url', 'housing', 'section', 'floor', 'square_meter_price')
-    
+        fields = ('id', 'flat_details', 'flat_detail_url', 'housing', 'section', 'floor', 'square_meter_price',
+            'status', 'held_until', 'reserved_at', 'version')
+        read_only_fields = ('status',)
+
     def validate(self, data):
         if self.partial:
             if 'house' in data and data['house'] != self.instance.house:
@@ -231,6 +425,8 @@ class FlatSerializer(serializers.HyperlinkedModelSerializer):
         return data
 
     def create(self, validated_data):
+        # new flats start from the first version
+        validated_data.pop('version', None)
         flat = Flat.objects.create(**validated_data)
         if self.context['request'].user.user_developer is not None:
             flat.status = True
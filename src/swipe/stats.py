@@ -0,0 +1,30 @@
+import statistics
+
+
+def histogram(values, low, high, buckets):
+    '''Counts of `values` in `buckets` equal ranges from `low` to `high`, the last one includes `high`'''
+    if low == high:
+        buckets = 1
+    width = (high - low) / buckets
+    counts = [0] * buckets
+    for value in values:
+        counts[min(int((value - low) / width), buckets - 1) if width else 0] += 1
+    return [
+        {'from': low + width * i, 'to': high if i == buckets - 1 else low + width * (i + 1), 'count': count}
+        for i, count in enumerate(counts)
+    ]
+
+
+def describe(values, buckets):
+    '''Count, min, max, mean, median and a histogram of `buckets` ranges of `values`'''
+    values = sorted(values)
+    if not values:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'median': None, 'histogram': []}
+    return {
+        'count': len(values),
+        'min': values[0],
+        'max': values[-1],
+        'mean': statistics.fmean(values),
+        'median': statistics.median(values),
+        'histogram': histogram(values, values[0], values[-1], buckets),
+    }
@@ -0,0 +1,135 @@
+from collections import defaultdict
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connections, transaction
+from django.utils.deconstruct import deconstructible
+
+from swipe.models import StoredFile
+
+logger = logging.getLogger(__name__)
+
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def is_content_name(name):
+    return bool(CONTENT_NAME_RE.match(name))
+
+
+class FileDeletionQueue:
+    '''
+    Deletes files in a background thread, taking all files queued meanwhile
+    (up to `batch_size`) at once. Files queued by a process that stopped
+    before deleting them are found by the sweep_media command.
+    '''
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, storage, names):
+        for name in names:
+            self.queue.put((storage, name))
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='file-deletion', daemon=True)
+                self.thread.start()
+
+    def get_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            by_storage = defaultdict(list)
+            for storage, name in batch:
+                by_storage[storage].append(name)
+            try:
+                for storage, names in by_storage.items():
+                    storage.delete_unreferenced(names)
+            except Exception:
+                logger.exception('Could not delete %s files', len(batch))
+            finally:
+                # connections of this thread are not closed by requests
+                connections.close_all()
+                for _ in batch:
+                    self.queue.task_done()
+
+    def join(self):
+        '''Waits until all queued files are deleted'''
+        self.queue.join()
+
+
+deletion_queue = FileDeletionQueue()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    Stores files under the SHA-256 of their content, `ab/cd/abcd....jpg`,
+    keeping only the extension of the given name.
+
+    Identical files are stored once and every save() adds a reference to
+    the file (StoredFile), which delete() removes. Files left without
+    references are deleted after the commit by `deletion_queue`. A name
+    never changes its content, so the URLs can be cached forever.
+    '''
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return f'{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        with transaction.atomic():
+            # the reference is taken first, so purging the file
+            # either finishes before or waits for this transaction
+            StoredFile.objects.acquire(name)
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length)
+
+    def delete(self, name):
+        self.delete_many([name])
+
+    def delete_many(self, names):
+        '''Removes a reference to every file of `names`, the unreferenced ones are deleted after the commit'''
+        unreferenced = StoredFile.objects.release([name for name in names if name])
+        if unreferenced:
+            transaction.on_commit(lambda: deletion_queue.put(self, unreferenced))
+
+    def delete_unreferenced(self, names):
+        '''
+        Deletes the files of `names` without references and returns their names.
+        Files from before the content addressed names are not counted, so they
+        are deleted right away.
+        '''
+        content_names = [name for name in names if is_content_name(name)]
+        deleted = StoredFile.objects.purge(content_names, super().delete)
+        for name in names:
+            if not is_content_name(name):
+                super().delete(name)
+                deleted.append(name)
+        return deleted
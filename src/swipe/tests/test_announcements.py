@@ -1,16 +1,30 @@
+import io
 import logging
+import os
 import random
+import tempfile
+import time
 
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse_lazy
 from django.utils import timezone
 from faker import Faker
+from PIL import Image
 from rest_framework import status
 from rest_framework.request import Request
-from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework.test import APITestCase, APIRequestFactory, APITransactionTestCase
 from swipe import serializers
 
-from swipe.models import Announcement, AnnouncementImage, ClientAnnouncementFavourites, Flat, House
+from swipe.cache import bump_generation, get_generation, get_metrics
+from swipe.models import Announcement, AnnouncementImage, BumpSchedule, ClientAnnouncementFavourites, Flat, House, Promotion, StoredFile
 from swipe.serializers import AnnouncementListSerializer
+from swipe.storage import deletion_queue, is_content_name
 from swipe.views import announcements
 from users.models import User, Developer
 
@@ -18,7 +32,7 @@ from users.models import User, Developer
 logger = logging.getLogger(__name__)
 
 
-class GetAllAnnouncementsTest(APITestCase):
+class GetAllAnnouncementsTest(APITransactionTestCase):
     """ Test class for getting list of announcements API"""
 
     def setUp(self):
@@ -292,13 +306,15 @@ class GetClientAnnouncementFavouritesTest(APITestCase):
                 client=self.first_client
             )]
         )
-        serializer = AnnouncementListSerializer(client_announcement_favourites, many=True, context={'request': Request(request)})
-        self.assertEqual(response.data, serializer.data)
-        self.assertEqual(len(response.data), 1)
+        serializer = AnnouncementListSerializer(client_announcement_favourites, many=True, context={
+            'request': Request(request), 'favourite_ids': {self.client_announcement.pk}})
+        self.assertEqual(response.data['results'], serializer.data)
+        self.assertEqual(response.data['count'], 1)
+        self.assertTrue(response.data['results'][0]['is_favourite'])
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class AddToFavouritesAndRemoveTest(APITestCase):
+class AddToFavouritesAndRemoveTest(APITransactionTestCase):
     '''Test for add announcement to favourites'''
 
     def setUp(self):
@@ -337,6 +353,64 @@ class AddToFavouritesAndRemoveTest(APITestCase):
         response = self.client.delete(reverse_lazy('swipe:announcement-remove_from_client_favourites', kwargs={'pk': self.announcement.pk}), {})
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def login(self, client):
+        response = self.client.post('/auth/token/login/', {'email': client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def test_adding_announcement_twice_is_not_an_error(self):
+        self.login(self.first_client)
+        url = reverse_lazy('swipe:announcement-add_to_client_favourites', kwargs={'pk': self.announcement.pk})
+        self.assertEqual(self.client.post(url, {}).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(url, {}).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ClientAnnouncementFavourites.objects.filter(client=self.first_client).count(), 1)
+
+    def test_bulk_add_and_remove(self):
+        self.login(self.first_client)
+        ClientAnnouncementFavourites.objects.create(announcement=self.announcement, client=self.first_client)
+        other = Announcement.objects.get(pk=self.announcement.pk)
+        other.pk = None
+        other.save()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse_lazy('swipe:announcement-bulk_add_to_client_favourites'),
+                {'ids': [self.announcement.pk, other.pk, 999999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['ids'], [self.announcement.pk, other.pk])
+        self.assertEqual(len([query for query in context.captured_queries
+            if 'ON CONFLICT DO NOTHING' in query['sql']]), 1)
+        self.assertEqual(ClientAnnouncementFavourites.objects.filter(client=self.first_client).count(), 2)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse_lazy('swipe:announcement-bulk_remove_from_client_favourites'),
+                {'ids': [self.announcement.pk, other.pk]}, format='json')
+        self.assertEqual(response.data['removed'], 2)
+        self.assertEqual(len([query for query in context.captured_queries
+            if 'swipe_clientannouncementfavourites' in query['sql']]), 1)
+        response = self.client.post(reverse_lazy('swipe:announcement-bulk_remove_from_client_favourites'),
+            {'ids': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_favourite_flags_of_cached_list_follow_the_client(self):
+        cache.clear()
+        second_client = User.objects.create_user(email='second_client@gmail.com', 
+            phone_number='+38(098)136-02-39', password='123').client
+        ClientAnnouncementFavourites.objects.create(announcement=self.announcement, client=self.first_client)
+        self.login(self.first_client)
+        response = self.client.get(reverse_lazy('swipe:announcement-list'))
+        self.assertTrue(response.data['results'][0]['is_favourite'])
+        etag = response['ETag']
+
+        self.login(second_client)
+        response = self.client.get(reverse_lazy('swipe:announcement-list'))
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertFalse(response.data['results'][0]['is_favourite'])
+
+        self.login(self.first_client)
+        self.client.delete(reverse_lazy('swipe:announcement-remove_from_client_favourites', kwargs={'pk': self.announcement.pk}))
+        response = self.client.get(reverse_lazy('swipe:announcement-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['results'][0]['is_favourite'])
+
 
 class GetUnmoderatedAnnouncementsTest(APITestCase):
     '''Test for getting unmoderated announcements'''
@@ -403,8 +477,8 @@ class GetUnmoderatedAnnouncementsTest(APITestCase):
         announcements = Announcement.objects.filter(moder_status='1').order_by('publication_date')
         serializer = AnnouncementListSerializer(announcements, many=True, context={'request': Request(request)})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'], serializer.data)
 
 
 class AnnouncementDetailsTest(APITestCase):
@@ -578,3 +652,951 @@ class UpdateAnnouncementToTheTopOfTheListTest(APITestCase):
         response = self.client.get(reverse_lazy('swipe:announcement-list'))
         self.assertEqual(response.data['results'][0]['id'], self.announcement_cottege.pk)
         self.assertNotEqual(response.data['results'][0]['address'], 'test address')
+
+
+class AnnouncementCursorPaginationTest(APITestCase):
+    '''Test class for keyset (cursor) pagination of the announcements\' list'''
+
+    def setUp(self):
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        for _ in range(11):
+            Announcement.objects.create(**{
+                "address": self.faker.name(),
+                "foundation_document": "1",
+                "appointment": "1",
+                "rooms": "1",
+                "layout": "1",
+                "state": "1",
+                "total_area": random.uniform(1.0, 70.0),
+                "has_balcony": "1",
+                "calculation_options": "1",
+                "commision": random.randint(1, 100),
+                "communication": self.faker.name(),
+                "description": self.faker.name(),
+                "price": random.randint(14000, 45000),
+                "moder_status": '2',
+                "available_status": '1',
+                "advertiser": self.first_client
+            })
+        # two announcements with the same rank are ordered by id
+        Announcement.objects.filter(pk__in=Announcement.objects.order_by('id').values('pk')[:2]).update(
+            publication_date=timezone.now())
+        Announcement.objects.refresh_rank_score()
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def test_client_can_walk_announcements_list_with_cursor(self):
+        response = self.client.get(reverse_lazy('swipe:announcement-list'), {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        ids = [an['id'] for an in response.data['results']]
+        self.assertEqual(len(ids), 8)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['next'])
+        ids += [an['id'] for an in response.data['results']]
+        expected_ids = list(Announcement.objects.order_by('-rank_score', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected_ids)
+
+    def test_page_number_pagination_is_kept_by_default(self):
+        response = self.client.get(reverse_lazy('swipe:announcement-list'), {'page': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 11)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse_lazy('swipe:announcement-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def walk(self, url):
+        response = self.client.get(url, {'pagination': 'cursor'})
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [an['id'] for an in response.data['results']]
+            if response.data['next'] is None:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_client_favourites_are_walked_in_order_of_adding(self):
+        added = list(Announcement.objects.values_list('id', flat=True))
+        random.shuffle(added)
+        for pk in added:
+            ClientAnnouncementFavourites.objects.create(client=self.first_client, announcement_id=pk)
+        ids = self.walk(reverse_lazy('swipe:announcement-get_client_favourites'))
+        self.assertEqual(ids, added[::-1])
+
+    def test_moderation_queue_is_walked_oldest_first(self):
+        User.objects.filter(pk=self.first_client.user.pk).update(is_staff=True)
+        Announcement.objects.update(moder_status='1')
+        ids = self.walk(reverse_lazy('swipe:announcement-get_unmoderated_announcements'))
+        expected_ids = list(Announcement.objects.order_by('publication_date', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected_ids)
+
+
+class AnnouncementListQueryCountTest(APITransactionTestCase):
+    '''Test class for the number of queries of announcement list APIs'''
+
+    def setUp(self):
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.house = House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=2, sections=5, floors=13
+        )
+
+    def create_announcements(self, count, moder_status='2'):
+        for _ in range(count):
+            flat = Flat.objects.create(house=self.house, housing=1, section=1, floor=1,
+                number=Flat.objects.count() + 1, square_meter_price=12500)
+            announcement = Announcement.objects.create(**{
+                "address": self.faker.name(),
+                "flat": flat,
+                "foundation_document": "1",
+                "appointment": "1",
+                "rooms": "1",
+                "layout": "1",
+                "state": "1",
+                "total_area": random.uniform(1.0, 70.0),
+                "has_balcony": "1",
+                "calculation_options": "1",
+                "commision": random.randint(1, 100),
+                "communication": self.faker.name(),
+                "description": self.faker.name(),
+                "price": random.randint(14000, 45000),
+                "moder_status": moder_status,
+                "available_status": '1',
+                "advertiser": self.first_client
+            })
+            Promotion.objects.create(announcement=announcement)
+            AnnouncementImage.objects.create(announcement=announcement, image='first.jpg')
+            AnnouncementImage.objects.create(announcement=announcement, image='second.jpg')
+            ClientAnnouncementFavourites.objects.create(announcement=announcement, client=self.first_client)
+
+    def count_queries(self, user, url):
+        response = self.client.post('/auth/token/login/', {'email': user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response.data
+
+    def assert_constant_number_of_queries(self, user, url, moder_status='2'):
+        self.create_announcements(1, moder_status)
+        queries, data = self.count_queries(user, url)
+        self.create_announcements(7, moder_status)
+        more_queries, more_data = self.count_queries(user, url)
+        self.assertEqual(queries, more_queries)
+        self.assertNotEqual(data, more_data)
+        return more_data
+
+    def test_announcements_list(self):
+        data = self.assert_constant_number_of_queries(self.first_client.user,
+            reverse_lazy('swipe:announcement-list'))
+        self.assertTrue(data['results'][0]['avatar'].endswith('first.jpg'))
+
+    def test_client_announcements(self):
+        self.assert_constant_number_of_queries(self.first_client.user,
+            reverse_lazy('swipe:announcement-get_client_announcements'))
+
+    def test_client_favourites(self):
+        self.assert_constant_number_of_queries(self.first_client.user,
+            reverse_lazy('swipe:announcement-get_client_favourites'))
+
+    def test_unmoderated_announcements(self):
+        self.assert_constant_number_of_queries(self.admin_user,
+            reverse_lazy('swipe:announcement-get_unmoderated_announcements'), moder_status='1')
+
+
+class AnnouncementSearchTest(APITestCase):
+    '''Test class for full-text search of announcements'''
+
+    def setUp(self):
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.sea_view = self.create_announcement('ул. Дерибасовская, 10', 'Просторная квартира с видом на море', '1')
+        self.park_view = self.create_announcement('ул. Садовая, 5', 'Уютная квартира рядом с парком', '2')
+        self.unmoderated = self.create_announcement('ул. Дерибасовская, 12', 'Квартира с видом на море', '1', moder_status='1')
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_announcement(self, address, description, rooms, moder_status='2'):
+        return Announcement.objects.create(**{
+            "address": address,
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": rooms,
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": description,
+            "price": random.randint(14000, 45000),
+            "moder_status": moder_status,
+            "available_status": '1',
+            "advertiser": self.first_client
+        })
+
+    def search(self, **params):
+        response = self.client.get(reverse_lazy('swipe:announcement-search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_search_by_word_forms_of_description(self):
+        results = self.search(q='моря')
+        self.assertEqual([an['id'] for an in results], [self.sea_view.pk])
+        self.assertIn('<b>', results[0]['description_highlight'])
+        self.assertGreater(results[0]['rank'], 0)
+
+    def test_search_by_part_of_address(self):
+        results = self.search(q='Дерибасовска')
+        self.assertEqual([an['id'] for an in results], [self.sea_view.pk])
+
+    def test_search_by_misspelled_address(self):
+        results = self.search(q='Дерибосовская 10')
+        self.assertEqual([an['id'] for an in results], [self.sea_view.pk])
+        self.assertEqual(self.search(q='Дерибосовская 10', rooms='2'), [])
+
+    def test_search_is_combined_with_filters(self):
+        self.assertEqual(self.search(q='квартира', rooms='2')[0]['id'], self.park_view.pk)
+        self.assertEqual(len(self.search(q='квартира')), 2)
+
+    def test_search_vector_follows_changes(self):
+        self.park_view.description = 'Квартира с террасой'
+        self.park_view.save()
+        self.assertEqual([an['id'] for an in self.search(q='терраса')], [self.park_view.pk])
+
+    def test_computed_fields_are_updated_with_one_query(self):
+        announcement = Announcement.objects.get(pk=self.park_view.pk)
+        announcement.price += 1
+        with CaptureQueriesContext(connection) as queries:
+            announcement.save()
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "swipe_announcement"')]
+        self.assertEqual(len(updates), 1)
+
+        announcement.address = 'ул. Генуэзская, 3'
+        announcement.bumped_at = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            announcement.save()
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "swipe_announcement"')]
+        self.assertEqual(len(updates), 2)
+        self.assertIn('"search_vector" =', updates[1])
+        self.assertIn('"rank_score" =', updates[1])
+        self.assertEqual([an['id'] for an in self.search(q='Генуэзская')], [self.park_view.pk])
+
+    def test_search_requires_query(self):
+        response = self.client.get(reverse_lazy('swipe:announcement-search'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AnnouncementFacetsTest(APITransactionTestCase):
+    '''Test class for faceted counts of announcements'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.create_announcement(rooms='1', price=20000, total_area=30.0)
+        self.create_announcement(rooms='1', price=30000, total_area=45.0)
+        self.create_announcement(rooms='2', price=40000, total_area=60.0)
+        self.create_announcement(rooms='3', price=90000, total_area=90.0, moder_status='1')
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_announcement(self, rooms, price, total_area, moder_status='2'):
+        return Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": rooms,
+            "layout": "1",
+            "state": "1",
+            "total_area": total_area,
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": price,
+            "moder_status": moder_status,
+            "available_status": '1',
+            "advertiser": self.first_client
+        })
+
+    def get_facets(self, **params):
+        response = self.client.get(reverse_lazy('swipe:announcement-facets'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_facets_of_public_announcements(self):
+        data = self.get_facets()
+        self.assertEqual(data['count'], 3)
+        rooms = {option['value']: option['count'] for option in data['facets']['rooms']}
+        self.assertEqual(rooms, {'1': 2, '2': 1, '3': 0, '4': 0, '5': 0})
+        self.assertEqual(data['facets']['state'][0], {'value': '1', 'label': 'Требует ремонта', 'count': 3})
+        self.assertEqual(data['ranges']['price'], {'min': 20000, 'max': 40000})
+        self.assertEqual(data['ranges']['total_area'], {'min': 30.0, 'max': 60.0})
+
+    def test_facets_take_list_filters(self):
+        data = self.get_facets(price__lt=35000)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['facets']['rooms'][1]['count'], 0)
+        self.assertEqual(data['ranges']['price'], {'min': 20000, 'max': 30000})
+
+    def test_facets_are_cached_until_announcements_change(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get_facets(rooms='1')
+        self.assertEqual(len([query for query in context.captured_queries
+            if 'swipe_announcement' in query['sql']]), 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_facets(rooms='1')['count'], 2)
+        self.assertFalse([query for query in context.captured_queries if 'swipe_announcement' in query['sql']])
+
+        self.create_announcement(rooms='1', price=10000, total_area=20.0)
+        data = self.get_facets(rooms='1')
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['ranges']['price']['min'], 10000)
+
+
+class AnnouncementResponseCacheTest(APITransactionTestCase):
+    '''Test class for the response cache and conditional requests of announcements'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.announcement = self.create_announcement()
+
+    def create_announcement(self, moder_status='2'):
+        return Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": random.randint(14000, 45000),
+            "moder_status": moder_status,
+            "available_status": '1',
+            "advertiser": self.first_client
+        })
+
+    def login(self, user):
+        response = self.client.post('/auth/token/login/', {'email': user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def get_list(self, params=''):
+        response = self.client.get(f'{reverse_lazy("swipe:announcement-list")}?{params}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_list_is_cached_by_normalised_query(self):
+        self.login(self.first_client.user)
+        self.assertEqual(self.get_list('rooms=1&state=1')['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as context:
+            response = self.get_list('state=1&rooms=1')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertFalse([query for query in context.captured_queries if 'swipe_announcement' in query['sql']])
+        self.assertEqual(response.data['results'][0]['id'], self.announcement.pk)
+        self.assertEqual(get_metrics('announcements')['announcements']['hits'], 1)
+        self.assertEqual(get_metrics('announcements')['announcements']['misses'], 1)
+
+    def test_roles_are_cached_separately(self):
+        self.create_announcement(moder_status='1')
+        self.login(self.first_client.user)
+        self.assertEqual(len(self.get_list().data['results']), 1)
+        self.login(self.admin_user)
+        response = self.get_list()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_changes_invalidate_list(self):
+        self.login(self.first_client.user)
+        self.get_list()
+        Promotion.objects.create(announcement=self.announcement, color='1')
+        self.assertEqual(self.get_list()['X-Cache'], 'MISS')
+        AnnouncementImage.objects.create(announcement=self.announcement, image='first.jpg')
+        response = self.get_list()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.data['results'][0]['avatar'].endswith('first.jpg'))
+        self.announcement.delete()
+        self.assertEqual(self.get_list().data['results'], [])
+
+    def test_generations_are_bumped_after_commit(self):
+        generation = get_generation('announcements')
+        with transaction.atomic():
+            bump_generation('announcements')
+            # a concurrent request still reads the old rows and caches them under this generation
+            self.assertEqual(get_generation('announcements'), generation)
+        self.assertNotEqual(get_generation('announcements'), generation)
+
+        with transaction.atomic():
+            bump_generation('announcements')
+            generation = get_generation('announcements')
+            transaction.set_rollback(True)
+        self.assertEqual(get_generation('announcements'), generation)
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location, self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+            self.login(self.first_client.user)
+            self.assertEqual(self.get_list()['X-Cache'], 'MISS')
+            self.assertEqual(self.get_list()['X-Cache'], 'HIT')
+            self.create_announcement()
+            response = self.get_list()
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertEqual(len(response.data['results']), 2)
+
+    def test_announcement_detail_version_follows_promotion(self):
+        self.login(self.first_client.user)
+        url = reverse_lazy('swipe:announcement-detail', kwargs={'pk': self.announcement.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        Promotion.objects.create(announcement=self.announcement, color='1')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.login(self.admin_user)
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+
+class AnnouncementRankTest(APITransactionTestCase):
+    '''Test class for promotion-aware order of the announcement feed'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.old = self.create_announcement(timezone.now() - timezone.timedelta(days=2))
+        self.older = self.create_announcement(timezone.now() - timezone.timedelta(days=4))
+        self.new = self.create_announcement(timezone.now())
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_announcement(self, publication_date):
+        announcement = Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": random.randint(14000, 45000),
+            "moder_status": '2',
+            "available_status": '1',
+            "advertiser": self.first_client
+        })
+        announcement.publication_date = publication_date
+        announcement.save()
+        return announcement
+
+    def get_feed_ids(self, **params):
+        response = self.client.get(reverse_lazy('swipe:announcement-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [announcement['id'] for announcement in response.data['results']]
+
+    def test_feed_is_ordered_by_recency_without_promotions(self):
+        self.assertEqual(self.get_feed_ids(), [self.new.pk, self.old.pk, self.older.pk])
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.rank_score, self.old.publication_date.timestamp())
+
+    def test_promotion_moves_announcement_up(self):
+        promotion = Promotion.objects.create(announcement=self.older, is_big=True)
+        self.assertEqual(self.get_feed_ids(), [self.new.pk, self.older.pk, self.old.pk])
+        promotion.is_turbo = True
+        promotion.save()
+        self.assertEqual(self.get_feed_ids(pagination='cursor'), [self.older.pk, self.new.pk, self.old.pk])
+        promotion.delete()
+        self.assertEqual(self.get_feed_ids(), [self.new.pk, self.old.pk, self.older.pk])
+
+    def test_to_the_top_bumps_without_changing_publication_date(self):
+        publication_date = self.older.publication_date
+        response = self.client.patch(reverse_lazy('swipe:announcement-to_the_top', kwargs={'pk': self.older.pk}),
+            {'publication_date': '2000-01-01T00:00:00Z'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['bumped_at'])
+        self.assertEqual(self.get_feed_ids(), [self.older.pk, self.new.pk, self.old.pk])
+        self.older.refresh_from_db()
+        self.assertEqual(self.older.publication_date, publication_date)
+
+    def test_scheduled_bumps_are_applied_by_worker(self):
+        response = self.client.post(reverse_lazy('swipe:announcement-schedule_bumps', kwargs={'pk': self.older.pk}),
+            {'interval_hours': 12, 'days': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        schedule = BumpSchedule.objects.get(announcement=self.older)
+
+        call_command('apply_bumps', stdout=io.StringIO())
+        self.assertEqual(self.get_feed_ids(), [self.older.pk, self.new.pk, self.old.pk])
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.next_bump_at - Announcement.objects.get(pk=self.older.pk).bumped_at,
+            timezone.timedelta(hours=12))
+        # not due yet
+        call_command('apply_bumps', stdout=io.StringIO())
+        self.assertEqual(BumpSchedule.objects.get(pk=schedule.pk).next_bump_at, schedule.next_bump_at)
+
+        # the last bump of the schedule is due
+        BumpSchedule.objects.filter(pk=schedule.pk).update(next_bump_at=timezone.now(), ends_at=timezone.now())
+        call_command('apply_bumps', stdout=io.StringIO())
+        self.assertFalse(BumpSchedule.objects.filter(pk=schedule.pk).exists())
+
+    def test_client_can_not_schedule_bumps_of_not_his_announcement(self):
+        other = User.objects.create_user(email='second_client@gmail.com', 
+            phone_number='+38(098)136-02-39', password='123')
+        response = self.client.post('/auth/token/login/', {'email': other.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+        response = self.client.post(reverse_lazy('swipe:announcement-schedule_bumps', kwargs={'pk': self.older.pk}),
+            {'interval_hours': 12, 'days': 1})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ModerationQueueTest(APITestCase):
+    '''Test class for claiming and deciding announcements of the moderation queue'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.first_moderator = User.objects.create_user(email='first_moderator@gmail.com', 
+            phone_number='+38(098)136-02-39', password='123')
+        User.objects.filter(pk=self.first_moderator.pk).update(is_staff=True)
+        self.second_moderator = User.objects.create_user(email='second_moderator@gmail.com', 
+            phone_number='+38(098)137-02-39', password='123')
+        User.objects.filter(pk=self.second_moderator.pk).update(is_staff=True)
+        self.announcements = [self.create_announcement() for _ in range(5)]
+
+    def create_announcement(self):
+        return Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": random.randint(14000, 45000),
+            "advertiser": self.first_client
+        })
+
+    def login(self, user):
+        response = self.client.post('/auth/token/login/', {'email': user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def claim(self, user, size):
+        self.login(user)
+        response = self.client.post(reverse_lazy('swipe:announcement-moderation_claim'), {'size': size}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [announcement['id'] for announcement in response.data['results']]
+
+    def decide(self, user, ids, moder_status):
+        self.login(user)
+        response = self.client.post(reverse_lazy('swipe:announcement-moderation_decide'),
+            {'ids': ids, 'moder_status': moder_status}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['updated']
+
+    def test_moderators_claim_different_announcements(self):
+        with CaptureQueriesContext(connection) as context:
+            first = self.claim(self.first_moderator, 2)
+        self.assertTrue([query for query in context.captured_queries if 'SKIP LOCKED' in query['sql']])
+        second = self.claim(self.second_moderator, 10)
+        self.assertEqual(first, [announcement.pk for announcement in self.announcements[:2]])
+        self.assertEqual(second, [announcement.pk for announcement in self.announcements[2:]])
+        # claiming again keeps the own claims
+        self.assertEqual(self.claim(self.first_moderator, 10), first)
+
+    def test_expired_claims_return_to_queue(self):
+        first = self.claim(self.first_moderator, 5)
+        Announcement.objects.filter(pk__in=first[:2]).update(claimed_until=timezone.now() - timezone.timedelta(minutes=1))
+        self.assertEqual(self.claim(self.second_moderator, 5), first[:2])
+        self.assertEqual(self.decide(self.first_moderator, first, '2'), 3)
+
+    def test_bulk_decision_is_one_update(self):
+        ids = self.claim(self.first_moderator, 3)
+        self.assertEqual(self.decide(self.second_moderator, ids, '2'), 0)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.decide(self.first_moderator, ids + [self.announcements[4].pk], '3'), 3)
+        self.assertEqual(len([query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "swipe_announcement"')]), 1)
+        self.assertEqual(Announcement.objects.filter(moder_status='3', claimed_by=None).count(), 3)
+
+        self.login(self.first_client.user)
+        response = self.client.post(reverse_lazy('swipe:announcement-moderation_claim'), {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_release(self):
+        ids = self.claim(self.first_moderator, 2)
+        response = self.client.post(reverse_lazy('swipe:announcement-moderation_release'), {'ids': ids}, format='json')
+        self.assertEqual(response.data['released'], 2)
+        self.assertEqual(self.claim(self.second_moderator, 2), ids)
+
+    def test_admin_can_not_see_or_change_internal_fields(self):
+        ids = self.claim(self.first_moderator, 1)
+        url = reverse_lazy('swipe:announcement-detail', kwargs={'pk': ids[0]})
+        response = self.client.patch(url, {'rank_score': 100.0, 'claimed_until': None}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for field in ('search_vector', 'rank_score', 'bumped_at', 'claimed_by', 'claimed_until'):
+            self.assertNotIn(field, response.data)
+        announcement = Announcement.objects.get(pk=ids[0])
+        self.assertNotEqual(announcement.rank_score, 100.0)
+        self.assertEqual(announcement.claimed_by, self.first_moderator)
+
+
+class AnnouncementImageProcessingTest(APITransactionTestCase):
+    '''Test class for the image variants made by the process_images command'''
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.announcement = Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": random.randint(14000, 45000),
+            "advertiser": self.first_client,
+            "moder_status": "2",
+        })
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def make_photo(self, name='photo.jpg'):
+        # landscape photo of a camera held upright
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010f] = 'Camera maker'
+        content = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(content, 'JPEG', exif=exif)
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/jpeg')
+
+    def test_uploaded_photo_is_pending(self):
+        response = self.client.post(reverse_lazy('swipe:announcement-add_photo', kwargs={'pk': self.announcement.pk}),
+            {'image': self.make_photo()}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = AnnouncementImage.objects.get()
+        self.assertEqual(response.data['variants']['card']['webp'], image.image.url)
+
+        response = self.client.get(reverse_lazy('swipe:announcement-list'))
+        self.assertEqual(response.data['results'][0]['avatar'], image.image.url)
+        self.assertEqual(response.data['results'][0]['avatar_webp'], image.image.url)
+
+    def test_process_images(self):
+        self.client.post(reverse_lazy('swipe:announcement-add_photo', kwargs={'pk': self.announcement.pk}),
+            {'image': self.make_photo()}, format='multipart')
+        self.assertEqual(self.client.get(reverse_lazy('swipe:announcement-list'))['X-Cache'], 'MISS')
+
+        call_command('process_images', workers=0, stdout=io.StringIO())
+
+        image = AnnouncementImage.objects.get()
+        self.assertIsNotNone(image.processed_at)
+        # rotated by the EXIF orientation
+        self.assertEqual((image.variants['thumb']['width'], image.variants['thumb']['height']), (80, 160))
+        self.assertEqual((image.variants['card']['width'], image.variants['card']['height']), (240, 480))
+        self.assertEqual((image.variants['full']['width'], image.variants['full']['height']), (800, 1600))
+        for extension, image_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            with default_storage.open(image.variants['full'][extension]) as file, Image.open(file) as variant:
+                self.assertEqual(variant.format, image_format)
+                self.assertEqual(len(variant.getexif()), 0)
+
+        response = self.client.get(reverse_lazy('swipe:announcement-list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['avatar'], default_storage.url(image.variants['card']['jpeg']))
+        self.assertEqual(response.data['results'][0]['avatar_webp'], default_storage.url(image.variants['card']['webp']))
+
+        response = self.client.get(reverse_lazy('swipe:announcement-detail', kwargs={'pk': self.announcement.pk}))
+        self.assertEqual(response.data['images'][0]['variants']['thumb']['webp'],
+            default_storage.url(image.variants['thumb']['webp']))
+
+    def test_broken_image_keeps_original(self):
+        AnnouncementImage.objects.create(announcement=self.announcement,
+            image=default_storage.save('broken.jpg', ContentFile(b'not an image')))
+
+        call_command('process_images', workers=0, stdout=io.StringIO())
+
+        image = AnnouncementImage.objects.get()
+        self.assertIsNotNone(image.processed_at)
+        self.assertEqual(image.variants, {})
+        response = self.client.get(reverse_lazy('swipe:announcement-list'))
+        self.assertEqual(response.data['results'][0]['avatar'], image.image.url)
+
+class AnnouncementBatchPhotoUploadTest(APITransactionTestCase):
+    '''Test class for uploading many announcement photos in one request'''
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.announcement = Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": random.randint(14000, 45000),
+            "advertiser": self.first_client,
+            "moder_status": "2",
+        })
+        self.url = reverse_lazy('swipe:announcement-add_photos', kwargs={'pk': self.announcement.pk})
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def make_photo(self, name, size=(300, 200)):
+        content = io.BytesIO()
+        Image.new('RGB', size, 'green').save(content, 'JPEG')
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/jpeg')
+
+    def test_add_photos(self):
+        self.assertEqual(self.client.get(reverse_lazy('swipe:announcement-list'))['X-Cache'], 'MISS')
+        photos = [self.make_photo(f'photo_{number}.jpg') for number in range(3)]
+        broken = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'images': photos + [broken]}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['created']), 3)
+        self.assertEqual([error['file'] for error in response.data['errors']], ['broken.jpg'])
+        self.assertEqual(self.announcement.images.count(), 3)
+        self.assertEqual(len([query for query in queries
+            if query['sql'].startswith('INSERT INTO "swipe_announcementimage"')]), 1)
+        for image in self.announcement.images.all():
+            self.assertTrue(default_storage.exists(image.image.name))
+        self.assertEqual(self.client.get(reverse_lazy('swipe:announcement-list'))['X-Cache'], 'MISS')
+
+    def test_add_photos_limits(self):
+        with self.settings(SWIPE_UPLOAD_MAX_FILES=2, SWIPE_UPLOAD_MAX_FILE_SIZE=20000):
+            response = self.client.post(self.url, {'images': [
+                self.make_photo('small.jpg'),
+                self.make_photo('big.jpg', size=(3000, 3000)),
+                self.make_photo('third.jpg'),
+            ]}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertEqual(sorted(error['file'] for error in response.data['errors']), ['big.jpg', 'third.jpg'])
+        self.assertEqual(self.announcement.images.count(), 1)
+
+    def test_add_photos_without_valid_files(self):
+        response = self.client.post(self.url, {'images': [
+            SimpleUploadedFile('notes.txt', b'not an image', content_type='text/plain'),
+        ]}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['created'], [])
+        self.assertEqual(self.announcement.images.count(), 0)
+
+
+class ContentAddressedStorageTest(APITransactionTestCase):
+    '''Test class for storing announcement photos by their content and deleting them after commits'''
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.faker = Faker()
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.announcement = Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": random.uniform(1.0, 70.0),
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": random.randint(14000, 45000),
+            "advertiser": self.first_client,
+        })
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def make_photo(self, name, color='green'):
+        content = io.BytesIO()
+        Image.new('RGB', (300, 200), color).save(content, 'JPEG')
+        return SimpleUploadedFile(name, content.getvalue(), content_type='image/jpeg')
+
+    def test_identical_photos_share_file(self):
+        first = AnnouncementImage.objects.create(announcement=self.announcement, image=self.make_photo('photo.jpg'))
+        second = AnnouncementImage.objects.create(announcement=self.announcement, image=self.make_photo('other.JPG'))
+        third = AnnouncementImage.objects.create(announcement=self.announcement, image=self.make_photo('photo.jpg', 'red'))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertTrue(is_content_name(first.image.name))
+        self.assertTrue(first.image.name.endswith('.jpg'))
+        self.assertEqual(StoredFile.objects.get(name=first.image.name).references, 2)
+
+        first.delete()
+        deletion_queue.join()
+        self.assertTrue(default_storage.exists(second.image.name))
+        second.delete()
+        deletion_queue.join()
+        self.assertFalse(default_storage.exists(second.image.name))
+        self.assertFalse(StoredFile.objects.filter(name=second.image.name).exists())
+
+    def test_deleting_image_deletes_variants(self):
+        image = AnnouncementImage.objects.create(announcement=self.announcement, image=self.make_photo('photo.jpg'))
+        call_command('process_images', workers=0, stdout=io.StringIO())
+        image.refresh_from_db()
+
+        image.delete()
+        deletion_queue.join()
+
+        self.assertFalse(default_storage.exists(image.image.name))
+        for formats in image.variants.values():
+            self.assertFalse(default_storage.exists(formats['webp']))
+            self.assertFalse(default_storage.exists(formats['jpeg']))
+
+    def test_files_are_kept_on_rollback(self):
+        image = AnnouncementImage.objects.create(announcement=self.announcement, image=self.make_photo('photo.jpg'))
+
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                self.announcement.delete()
+                1 / 0
+        deletion_queue.join()
+
+        self.assertTrue(default_storage.exists(image.image.name))
+        self.assertEqual(StoredFile.objects.get(name=image.image.name).references, 1)
+
+    def test_cascade_deletes_files_after_commit(self):
+        images = [AnnouncementImage.objects.create(announcement=self.announcement,
+            image=self.make_photo('photo.jpg', color)) for color in ('red', 'green', 'blue')]
+
+        with transaction.atomic():
+            self.announcement.delete()
+            for image in images:
+                self.assertTrue(default_storage.exists(image.image.name))
+        deletion_queue.join()
+
+        for image in images:
+            self.assertFalse(default_storage.exists(image.image.name))
+
+    def test_sweep_media(self):
+        referenced = AnnouncementImage.objects.create(announcement=self.announcement, image=self.make_photo('photo.jpg'))
+        orphan = default_storage.save('orphan.jpg', ContentFile(b'orphan'))
+        StoredFile.objects.filter(name=orphan).update(references=0)
+        for name in ('legacy.jpg', 'young.jpg'):
+            with open(os.path.join(self.media_root.name, name), 'wb') as file:
+                file.write(name.encode())
+        an_hour_ago = time.time() - 60 * 60
+        for name in (referenced.image.name, orphan, 'legacy.jpg'):
+            os.utime(os.path.join(self.media_root.name, name), (an_hour_ago, an_hour_ago))
+
+        call_command('sweep_media', min_age=30, stdout=io.StringIO())
+
+        self.assertTrue(default_storage.exists(referenced.image.name))
+        self.assertTrue(default_storage.exists('young.jpg'))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(default_storage.exists('legacy.jpg'))
+        self.assertFalse(StoredFile.objects.filter(name=orphan).exists())
+
+    def test_rehash_media(self):
+        # uploaded before the content addressed storage
+        for name, content in (('old.jpg', self.make_photo('old.jpg').read()), ('old_card.webp', b'webp'),
+                ('old_card.jpeg', b'jpeg')):
+            with open(os.path.join(self.media_root.name, name), 'wb') as file:
+                file.write(content)
+        image = AnnouncementImage.objects.create(announcement=self.announcement, image='old.jpg',
+            variants={'card': {'width': 300, 'height': 200, 'webp': 'old_card.webp', 'jpeg': 'old_card.jpeg'}})
+
+        call_command('rehash_media', stdout=io.StringIO())
+        call_command('rehash_media', stdout=io.StringIO())
+
+        image.refresh_from_db()
+        self.assertTrue(is_content_name(image.image.name))
+        self.assertTrue(is_content_name(image.variants['card']['webp']))
+        self.assertEqual(image.variants['card']['width'], 300)
+        with default_storage.open(image.variants['card']['jpeg']) as file:
+            self.assertEqual(file.read(), b'jpeg')
+        for old_name in ('old.jpg', 'old_card.webp', 'old_card.jpeg'):
+            self.assertFalse(default_storage.exists(old_name))
+        self.assertEqual(StoredFile.objects.get(name=image.image.name).references, 1)
@@ -1,13 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import io
 import random
+import tempfile
 
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse_lazy
+from django.utils import timezone
 from faker import Faker
+from PIL import Image
 from rest_framework import status
 from rest_framework.request import Request
-from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
 
-from swipe.models import Announcement, Flat, House, HouseNews, HouseImage, ClientHouseFavourites, DeveloperHouse
-from swipe.serializers import HouseListSerializer, HouseNewsSerializer, HouseSerializer
+from swipe.models import Announcement, Flat, House, HouseNews, HouseImage, HouseSummary, ClientHouseFavourites, DeveloperHouse
+from swipe.serializers import FlatSerializer, HouseListSerializer, HouseNewsSerializer, HouseSerializer
 from users.models import User, Developer
 
 
@@ -528,9 +540,11 @@ class GetClientHouseFavouritesTest(APITestCase):
                 client=self.first_client
             )]
         )
-        serializer = HouseListSerializer(client_house_favourites, many=True, context={'request': Request(request)})
-        self.assertEqual(response.data, serializer.data)
-        self.assertEqual(len(response.data), 1)
+        serializer = HouseListSerializer(client_house_favourites, many=True, context={
+            'request': Request(request), 'favourite_ids': {self.house.pk}})
+        self.assertEqual(response.data['results'], serializer.data)
+        self.assertEqual(response.data['count'], 1)
+        self.assertTrue(response.data['results'][0]['is_favourite'])
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
@@ -569,3 +583,944 @@ class AddToFavouritesAndRemoveTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         response = self.client.delete(reverse_lazy('swipe:house-remove_from_client_favourites', kwargs={'pk': self.house.pk}), {})
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class HouseSummaryTest(APITransactionTestCase):
+    '''Test class for listing aggregates of houses'''
+
+    def setUp(self):
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.first_client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.house = self.create_house()
+        self.flat = Flat.objects.create(house=self.house, housing=1, section=1, floor=1, number=1, square_meter_price=12500)
+
+    def create_house(self):
+        return House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=2, sections=5, floors=13
+        )
+
+    def create_announcement(self, flat, address, price, total_area):
+        return Announcement.objects.create(**{
+            "address": address,
+            'flat': flat,
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "1",
+            "layout": "1",
+            "state": "1",
+            "total_area": total_area,
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 20),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": price,
+            "advertiser": self.first_client,
+            "moder_status": 2,
+            "available_status": 1
+        })
+
+    def test_summary_follows_announcements_and_images(self):
+        summary = HouseSummary.objects.get(house=self.house)
+        self.assertEqual(summary.announcement_count, 0)
+
+        first = self.create_announcement(self.flat, 'first address', 30000, 45.5)
+        self.create_announcement(self.flat, 'second address', 20000, 50.0)
+        image = HouseImage.objects.create(house=self.house, image='house.jpg')
+        summary.refresh_from_db()
+        self.assertEqual(summary.announcement_count, 2)
+        self.assertEqual(summary.address, 'first address')
+        self.assertEqual(summary.min_price, 20000)
+        self.assertEqual(summary.min_area, 45.5)
+        self.assertEqual(summary.cover_image, image)
+
+        first.delete()
+        image.delete()
+        summary.refresh_from_db()
+        self.assertEqual(summary.announcement_count, 1)
+        self.assertEqual(summary.address, 'second address')
+        self.assertEqual(summary.min_area, 50.0)
+        self.assertIsNone(summary.cover_image)
+
+    def test_summary_follows_announcement_moved_to_another_house(self):
+        announcement = self.create_announcement(self.flat, 'first address', 30000, 45.5)
+        other_house = self.create_house()
+        announcement = Announcement.objects.get(pk=announcement.pk)
+        announcement.flat = Flat.objects.create(house=other_house, housing=1, section=1, floor=1, number=1)
+        announcement.save()
+        self.assertEqual(HouseSummary.objects.get(house=self.house).announcement_count, 0)
+        self.assertEqual(HouseSummary.objects.get(house=other_house).announcement_count, 1)
+
+    def test_houses_list_is_served_from_summary(self):
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+        self.create_announcement(self.flat, 'first address', 30000, 45.5)
+        HouseImage.objects.create(house=self.house, image='house.jpg')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse_lazy('swipe:house-list'))
+        queries = len(context.captured_queries)
+        self.assertEqual(response.data['results'][0]['address'], 'first address')
+        self.assertEqual(response.data['results'][0]['from_summ'], 30000)
+        self.assertTrue(response.data['results'][0]['avatar'].endswith('house.jpg'))
+
+        for _ in range(5):
+            house = self.create_house()
+            flat = Flat.objects.create(house=house, housing=1, section=1, floor=1, number=1)
+            self.create_announcement(flat, self.faker.name(), 40000, 60.0)
+            HouseImage.objects.create(house=house, image='house.jpg')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse_lazy('swipe:house-list'))
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(context.captured_queries), queries)
+
+    def test_client_houses_scope_does_not_depend_on_announcements(self):
+        response = self.client.post('/auth/token/login/', {'email': self.first_client.user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+        self.create_announcement(self.flat, 'first address', 30000, 45.5)
+        self.create_house()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse_lazy('swipe:house-list'))
+        queries = len(context.captured_queries)
+        self.assertEqual([house['id'] for house in response.data['results']], [self.house.pk])
+
+        for _ in range(5):
+            self.create_announcement(self.flat, self.faker.name(), 40000, 60.0)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse_lazy('swipe:house-list'))
+        self.assertEqual([house['id'] for house in response.data['results']], [self.house.pk])
+        self.assertEqual(len(context.captured_queries), queries)
+
+
+class HouseLocationTest(APITestCase):
+    '''Test class for geospatial filters of houses and announcements'''
+
+    def setUp(self):
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        # Odessa center, Odessa Arcadia (~4.5 km away) and Kyiv (~440 km away)
+        self.center = self.create_house('46.4825, 30.7233')
+        self.arcadia = self.create_house('46.4310, 30.7610')
+        self.kyiv = self.create_house('50.4501, 30.5234')
+        self.unknown = self.create_house('unknown')
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_house(self, coords):
+        return House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords=coords,
+            housings=2, sections=5, floors=13
+        )
+
+    def get_house_ids(self, params):
+        response = self.client.get(reverse_lazy('swipe:house-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [house['id'] for house in response.data['results']]
+
+    def test_location_is_parsed_from_coords(self):
+        self.assertEqual((self.center.latitude, self.center.longitude), (46.4825, 30.7233))
+        self.assertTrue(self.center.geohash.startswith('u8m'))
+        self.assertIsNone(self.unknown.latitude)
+        self.assertEqual(self.unknown.geohash, '')
+
+        self.unknown.coords = '50.4501 30.5234'
+        self.unknown.save()
+        self.assertEqual(House.objects.get(pk=self.unknown.pk).geohash, self.kyiv.geohash)
+
+    def test_bounding_box_and_geohash(self):
+        self.assertEqual(self.get_house_ids({'bbox': '46.3,30.6,46.6,30.8'}), [self.center.pk, self.arcadia.pk])
+        self.assertEqual(self.get_house_ids({'geohash': self.kyiv.geohash[:4]}), [self.kyiv.pk])
+        response = self.client.get(reverse_lazy('swipe:house-list'), {'bbox': '46.3,30.6'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_radius_and_distance_ordering(self):
+        self.assertEqual(self.get_house_ids({'near': '46.4300,30.7600', 'radius': 10, 'ordering': 'distance'}),
+            [self.arcadia.pk, self.center.pk])
+        response = self.client.get(reverse_lazy('swipe:house-list'), {'near': '50.45,30.52', 'ordering': 'distance'})
+        self.assertEqual([house['id'] for house in response.data['results']],
+            [self.kyiv.pk, self.center.pk, self.arcadia.pk, self.unknown.pk])
+        self.assertLess(response.data['results'][0]['distance'], 1)
+        self.assertAlmostEqual(response.data['results'][1]['distance'], 440, delta=10)
+
+    def test_announcements_are_filtered_by_house_location(self):
+        client = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        announcements = []
+        for house in (self.center, self.kyiv):
+            announcements.append(Announcement.objects.create(
+                address=self.faker.name(), flat=Flat.objects.create(house=house, housing=1, section=1, floor=1, number=1),
+                foundation_document='1', appointment='1', rooms='1', layout='1', state='1', total_area=40.2,
+                has_balcony='1', calculation_options='1', commision=5, communication=self.faker.name(),
+                description=self.faker.name(), price=30000, advertiser=client, moder_status='2', available_status='1'))
+        response = self.client.get(reverse_lazy('swipe:announcement-list'), {'near': '50.45,30.52', 'radius': 50})
+        self.assertEqual([announcement['id'] for announcement in response.data['results']], [announcements[1].pk])
+
+
+class HouseConditionalGetTest(APITransactionTestCase):
+    '''Test class for ETag/Last-Modified of houses'''
+
+    def setUp(self):
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.house = House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=2, sections=5, floors=13
+        )
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def test_house_detail_is_not_serialized_when_not_modified(self):
+        url = reverse_lazy('swipe:house-detail', kwargs={'pk': self.house.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([query for query in context.captured_queries if 'swipe_houseimage' in query['sql']])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        HouseImage.objects.create(house=self.house, image='house.jpg')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['images']), 1)
+
+    def test_house_list_etag_follows_collection_version(self):
+        url = reverse_lazy('swipe:house-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.house.name = self.faker.name()
+        self.house.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['name'], self.house.name)
+
+
+class HouseImageProcessingTest(APITestCase):
+    '''Test class for the image variants of house photos'''
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.house = House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=2, sections=5, floors=13
+        )
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def test_add_photo_and_process(self):
+        content = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'blue').save(content, 'PNG')
+        response = self.client.post(reverse_lazy('swipe:house-add_photo', kwargs={'pk': self.house.pk}),
+            {'image': SimpleUploadedFile('house.png', content.getvalue(), content_type='image/png')},
+            format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        call_command('process_images', workers=0, stdout=io.StringIO())
+
+        image = HouseImage.objects.get(house=self.house)
+        self.assertEqual((image.variants['card']['width'], image.variants['card']['height']), (480, 320))
+        response = self.client.get(reverse_lazy('swipe:house-get_photos', kwargs={'pk': self.house.pk}))
+        self.assertEqual(response.data[0]['variants']['card']['jpeg'],
+            default_storage.url(image.variants['card']['jpeg']))
+
+    def test_add_photos_sets_cover(self):
+        photos = []
+        for name in ('first.png', 'second.png'):
+            content = io.BytesIO()
+            Image.new('RGB', (300, 200), 'blue').save(content, 'PNG')
+            photos.append(SimpleUploadedFile(name, content.getvalue(), content_type='image/png'))
+
+        response = self.client.post(reverse_lazy('swipe:house-add_photos', kwargs={'pk': self.house.pk}),
+            {'images': photos}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual(HouseSummary.objects.get(house=self.house).cover_image,
+            HouseImage.objects.filter(house=self.house).order_by('pk').first())
+
+
+class HouseChessboardTest(APITransactionTestCase):
+    '''Test class for the grid of flats of a house'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.house = self.create_house()
+        self.other_house = self.create_house()
+        # created out of the grid order
+        self.flats = {}
+        for housing, section, floor, number in ((1, 2, 1, 3), (1, 1, 2, 2), (1, 1, 1, 1), (2, 1, 1, 4)):
+            self.flats[number] = Flat.objects.create(house=self.house, housing=housing, section=section,
+                floor=floor, number=number, square_meter_price=1000.0 * number)
+        self.announcement = Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "flat": self.flats[2],
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": "2",
+            "layout": "1",
+            "state": "1",
+            "total_area": 54.5,
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": 30000,
+            "advertiser": User.objects.create_user(email='first_client@gmail.com', 
+                phone_number='+38(098)135-02-39', password='123').client,
+            "moder_status": "2",
+        })
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_house(self):
+        return House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=2, sections=5, floors=13
+        )
+
+    def test_chessboard(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse_lazy('swipe:house-chessboard', kwargs={'pk': self.house.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([query for query in queries if 'FROM "swipe_flat"' in query['sql']]), 1)
+        flats = response.data['flats']
+        self.assertEqual(flats['number'], [1, 2, 3, 4])
+        self.assertEqual(flats['housing'], [1, 1, 1, 2])
+        self.assertEqual(flats['square_meter_price'], [1000.0, 2000.0, 3000.0, 4000.0])
+        self.assertEqual(flats['announcement'], [None, self.announcement.pk, None, None])
+        self.assertEqual(flats['price'], [None, 30000, None, None])
+        self.assertEqual(flats['rooms'], [None, '2', None, None])
+        self.assertEqual((response.data['housings'], response.data['sections'], response.data['floors']), (2, 5, 13))
+
+    def test_chessboard_of_house_without_flats(self):
+        response = self.client.get(reverse_lazy('swipe:house-chessboard', kwargs={'pk': self.other_house.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['flats']['id'], [])
+
+    def test_chessboard_etag(self):
+        url = reverse_lazy('swipe:house-chessboard', kwargs={'pk': self.house.pk})
+        etag = self.client.get(url)['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # the data of this house did not change
+        Flat.objects.create(house=self.other_house, housing=1, section=1, floor=1, number=1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.flats[3].square_meter_price = 3500.0
+        self.flats[3].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['flats']['square_meter_price'][2], 3500.0)
+
+    def test_chessboard_is_cached_per_house(self):
+        url = reverse_lazy('swipe:house-chessboard', kwargs={'pk': self.house.pk})
+        self.client.get(url)
+
+        # changes of flats of other houses keep the cached chessboard
+        other_flat = Flat.objects.create(house=self.other_house, housing=1, section=1, floor=1, number=1)
+        response = self.client.post(reverse_lazy('swipe:flat-hold'), {'ids': [other_flat.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries if 'swipe_flat' in query['sql']])
+
+        self.client.post(reverse_lazy('swipe:flat-hold'), {'ids': [self.flats[1].pk]}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue([query for query in queries if 'swipe_flat' in query['sql']])
+
+        self.announcement.price = 31000
+        self.announcement.save()
+        self.assertEqual(self.client.get(url).data['flats']['price'][1], 31000)
+
+
+class FlatGenerationTest(APITestCase):
+    '''Test class for creating all flats of a house at once'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.house = House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=2, sections=3, floors=4
+        )
+        self.url = reverse_lazy('swipe:house-generate_flats', kwargs={'pk': self.house.pk})
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def test_generate_flats(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'layout': [1, 1.5], 'square_meter_price': 1000}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'count': 2 * 3 * 4 * 2, 'first_number': 1, 'last_number': 48})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT INTO "swipe_flat"')]), 1)
+        first, second = Flat.objects.filter(house=self.house, housing=2, section=3, floor=4).order_by('number')
+        self.assertEqual((first.number, first.square_meter_price), (47, 1000))
+        self.assertEqual((second.number, second.square_meter_price), (48, 1500))
+
+    def test_generate_flats_of_some_floors(self):
+        self.client.post(self.url, {'layout': [1], 'square_meter_price': 1000}, format='json')
+
+        response = self.client.post(self.url, {'layout': [1, 1, 1], 'square_meter_price': 900,
+            'housings': [1], 'sections': [2], 'floors': [3, 4]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'count': 6, 'first_number': 25, 'last_number': 30})
+        self.assertEqual(Flat.objects.filter(house=self.house, housing=1, section=2, floor=3).count(), 4)
+
+    def test_generate_flats_out_of_house(self):
+        response = self.client.post(self.url, {'layout': [1], 'square_meter_price': 1000, 'floors': [5]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Flat.objects.filter(house=self.house).exists())
+
+    def test_generate_too_many_flats(self):
+        with self.settings(SWIPE_MAX_GENERATED_FLATS=10):
+            response = self.client.post(self.url, {'layout': [1], 'square_meter_price': 1000}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Flat.objects.filter(house=self.house).exists())
+
+    def test_flat_position_is_unique(self):
+        Flat.objects.create(house=self.house, housing=1, section=1, floor=1, number=1)
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Flat.objects.create(house=self.house, housing=1, section=1, floor=1, number=1)
+
+
+class FlatListQueryCountTest(APITestCase):
+    '''Test class for the number of queries of the flat list'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.client_user = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123')
+        self.house = House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=1, sections=1, floors=10
+        )
+        self.flats = Flat.objects.generate(self.house, layout=[1], square_meter_price=1000,
+            housings=[1], sections=[1], floors=range(1, 9))
+        for flat in self.flats[:2]:
+            for rooms in ('2', '3'):
+                Announcement.objects.create(**{
+                    "address": self.faker.name(),
+                    "flat": flat,
+                    "foundation_document": "1",
+                    "appointment": "1",
+                    "rooms": rooms,
+                    "layout": "1",
+                    "state": "1",
+                    "total_area": 50.0,
+                    "has_balcony": "1",
+                    "calculation_options": "1",
+                    "commision": random.randint(1, 100),
+                    "communication": self.faker.name(),
+                    "description": self.faker.name(),
+                    "price": random.randint(14000, 45000),
+                    "advertiser": self.client_user.client,
+                })
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def get_flats(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse_lazy('swipe:flat-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries)
+
+    def test_flat_list_queries_do_not_depend_on_flat_count(self):
+        response, queries = self.get_flats()
+        self.assertEqual(len(response.data['results']), 8)
+        self.assertEqual(response.data['results'][0]['flat_details'], '2 квартира, 50.0 м2, 1/1 эт.')
+        self.assertEqual(response.data['results'][2]['flat_details'], '-')
+
+        Flat.objects.filter(pk__in=[flat.pk for flat in self.flats[2:]]).delete()
+        response, fewer_flats_queries = self.get_flats()
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(fewer_flats_queries, queries)
+
+    def test_flat_update_does_not_query_house(self):
+        flat = self.flats[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(reverse_lazy('swipe:flat-detail', kwargs={'pk': flat.pk}),
+                {'floor': 9}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')
+            and 'FROM "swipe_house"' in query['sql']])
+
+
+class FlatBulkUpdateTest(APITransactionTestCase):
+    '''Test class for changing many flats at once'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.house = self.create_house()
+        self.other_house = self.create_house()
+        for house in (self.house, self.other_house):
+            Flat.objects.generate(house, layout=[1], square_meter_price=1000,
+                housings=[1], sections=[1, 2], floors=range(1, 13))
+        self.url = reverse_lazy('swipe:flat-bulk_update')
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_house(self):
+        return House.objects.create(
+            name=self.faker.name(),
+            description=self.faker.address(),
+            status='2', type='1', 
+            _class='2', building_technology='1', territory='2',
+            sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+            has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+            calculation_type='Ипотека', perpose='Жилое помещение',
+            summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+            housings=1, sections=2, floors=12
+        )
+
+    def get_prices(self, house, section):
+        return list(Flat.objects.filter(house=house, section=section).order_by('floor')
+            .values_list('square_meter_price', flat=True))
+
+    def test_relative_change_of_upper_floors(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'house': self.house.pk, 'section': 1, 'min_floor': 10,
+                'percent': 3}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'updated': 3})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "swipe_flat"')]), 1)
+        self.assertEqual([round(price, 2) for price in self.get_prices(self.house, 1)], [1000] * 9 + [1030] * 3)
+        self.assertEqual(self.get_prices(self.house, 2), [1000] * 12)
+        self.assertEqual(self.get_prices(self.other_house, 1), [1000] * 12)
+
+    def test_absolute_change_and_status(self):
+        response = self.client.post(self.url, {'house': self.house.pk, 'max_floor': 2,
+            'square_meter_price': 1200, 'new_status': True}, format='json')
+
+        self.assertEqual(response.data, {'updated': 4})
+        self.assertEqual(self.get_prices(self.house, 2)[:3], [1200, 1200, 1000])
+        self.assertEqual(Flat.objects.filter(house=self.house, status=True).count(), 4)
+
+        response = self.client.post(self.url, {'house': self.house.pk, 'status': True, 'percent': -50}, format='json')
+        self.assertEqual(response.data, {'updated': 4})
+        self.assertEqual(self.get_prices(self.house, 1)[:3], [600, 600, 1000])
+
+    def test_form_data_keeps_status(self):
+        Flat.objects.filter(house=self.house, floor=1).update(status=True)
+
+        response = self.client.post(self.url, {'house': self.house.pk, 'percent': 10})
+
+        self.assertEqual(response.data, {'updated': 24})
+        self.assertEqual(Flat.objects.filter(house=self.house, status=True).count(), 2)
+        self.assertEqual(Flat.objects.filter(house=self.house, square_meter_price__gt=1099).count(), 24)
+
+    def test_price_by_floor(self):
+        response = self.client.post(self.url, {'house': self.house.pk, 'section': 2,
+            'base_price': 900, 'floor_step': 25.5}, format='json')
+
+        self.assertEqual(response.data, {'updated': 12})
+        self.assertEqual(self.get_prices(self.house, 2), [900 + 25.5 * floor for floor in range(12)])
+
+    def test_invalid_changes(self):
+        for data in ({'house': self.house.pk},
+                {'house': self.house.pk, 'percent': 3, 'square_meter_price': 1000},
+                {'house': self.house.pk, 'base_price': 900},
+                {'house': self.house.pk, 'percent': 3, 'min_floor': 5, 'max_floor': 4}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cached_list_is_invalidated(self):
+        list_url = reverse_lazy('swipe:flat-list')
+        self.client.get(list_url)
+        self.assertEqual(self.client.get(list_url)['X-Cache'], 'HIT')
+
+        self.client.post(self.url, {'house': self.house.pk, 'square_meter_price': 1100}, format='json')
+
+        response = self.client.get(list_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['square_meter_price'], 1100)
+
+
+def create_flat_house(faker):
+    return House.objects.create(
+        name=faker.name(),
+        description=faker.address(),
+        status='2', type='1', 
+        _class='2', building_technology='1', territory='2',
+        sea_distance=1000.1, communal_payments='1', ceiling_height=2.78,
+        has_gas='2', heating_type='1', sewerage='1', water_supply='1',
+        calculation_type='Ипотека', perpose='Жилое помещение',
+        summ_in_contract='Неполная', coords='46.43352126727788, 30.721379643314993',
+        housings=1, sections=1, floors=4
+    )
+
+
+class FlatReservationTest(APITestCase):
+    '''Test class for holding and reserving flats'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.first_agent = User.objects.create_user(email='first_agent@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123')
+        self.second_agent = User.objects.create_user(email='second_agent@gmail.com', 
+            phone_number='+38(098)136-02-39', password='123')
+        house = create_flat_house(self.faker)
+        self.flats = Flat.objects.generate(house, layout=[1], square_meter_price=1000,
+            housings=[1], sections=[1], floors=range(1, 5))
+        self.ids = [flat.pk for flat in self.flats]
+
+    def login(self, user):
+        response = self.client.post('/auth/token/login/', {'email': user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def hold(self, user, ids):
+        self.login(user)
+        return self.client.post(reverse_lazy('swipe:flat-hold'), {'ids': ids}, format='json')
+
+    def reserve(self, user, versions):
+        self.login(user)
+        return self.client.post(reverse_lazy('swipe:flat-reserve'),
+            {'flats': [{'id': pk, 'version': version} for pk, version in versions.items()]}, format='json')
+
+    def test_hold_and_reserve(self):
+        response = self.hold(self.first_agent, self.ids[:2])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['flats'], [{'id': pk, 'version': 1} for pk in self.ids[:2]])
+
+        response = self.hold(self.second_agent, self.ids[1:3])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['conflicts'], [self.ids[1]])
+        # nothing is held when some flats are taken
+        self.assertIsNone(Flat.objects.get(pk=self.ids[2]).held_by)
+
+        response = self.reserve(self.second_agent, {self.ids[0]: 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.reserve(self.first_agent, {self.ids[0]: 1, self.ids[1]: 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['flats'], [{'id': pk, 'version': 2} for pk in self.ids[:2]])
+        flat = Flat.objects.get(pk=self.ids[0])
+        self.assertEqual((flat.reserved_by, flat.held_by, flat.held_until), (self.first_agent, None, None))
+        self.assertIsNotNone(flat.reserved_at)
+
+        response = self.hold(self.first_agent, self.ids[:1])
+        self.assertEqual(response.data['conflicts'], self.ids[:1])
+
+    def test_reserve_compares_versions(self):
+        Flat.objects.filter(pk=self.ids[0]).change(percent=10)
+
+        response = self.reserve(self.first_agent, {self.ids[0]: 0, self.ids[1]: 0})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['conflicts'], self.ids[:1])
+        self.assertFalse(Flat.objects.filter(pk__in=self.ids, reserved_at__isnull=False).exists())
+
+        response = self.reserve(self.first_agent, {self.ids[0]: 1, self.ids[1]: 0})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_expired_hold(self):
+        self.hold(self.first_agent, self.ids[:1])
+        Flat.objects.filter(pk=self.ids[0]).update(held_until=timezone.now() - timedelta(seconds=1))
+
+        response = self.hold(self.second_agent, self.ids[:1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Flat.objects.get(pk=self.ids[0]).held_by, self.second_agent)
+
+    def test_release(self):
+        self.hold(self.first_agent, self.ids[:2])
+
+        self.login(self.second_agent)
+        response = self.client.post(reverse_lazy('swipe:flat-release'), {'ids': self.ids}, format='json')
+        self.assertEqual(response.data, {'released': 0})
+
+        self.login(self.first_agent)
+        response = self.client.post(reverse_lazy('swipe:flat-release'), {'ids': self.ids}, format='json')
+        self.assertEqual(response.data, {'released': 2})
+        self.assertEqual(self.hold(self.second_agent, self.ids[:2]).status_code, status.HTTP_200_OK)
+
+    def test_update_compares_versions(self):
+        self.hold(self.first_agent, self.ids[:1])
+        self.reserve(self.first_agent, {self.ids[0]: 1})
+        url = reverse_lazy('swipe:flat-detail', kwargs={'pk': self.ids[0]})
+
+        self.login(self.admin_user)
+        response = self.client.patch(url, {'square_meter_price': 1200, 'version': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.client.patch(url, {'square_meter_price': 1200, 'version': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 3)
+        # the reservation is not overwritten by the update
+        flat = Flat.objects.get(pk=self.ids[0])
+        self.assertEqual((flat.reserved_by, flat.square_meter_price, flat.version), (self.first_agent, 1200, 3))
+
+
+    def test_clients_can_not_override_versions(self):
+        self.hold(self.first_agent, self.ids[:1])
+        response = self.client.patch(reverse_lazy('swipe:flat-detail', kwargs={'pk': self.ids[0]}),
+            {'square_meter_price': 1, 'version': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Flat.objects.get(pk=self.ids[0]).square_meter_price, 1000)
+
+    def test_developers_hold_flats_of_other_developers(self):
+        developer = Developer.objects.create(user=User.objects.create_user(email='developer@gmail.com', 
+            phone_number='+38(098)138-02-39', password='123'))
+        own_house = create_flat_house(self.faker)
+        DeveloperHouse.objects.create(house=own_house, developer=developer)
+        own_flat = Flat.objects.create(house=own_house, housing=1, section=1, floor=1, number=1)
+        self.assertEqual(self.hold(self.first_agent, [own_flat.pk]).status_code, status.HTTP_200_OK)
+
+        response = self.hold(developer.user, [own_flat.pk, self.ids[0]])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['conflicts'], [own_flat.pk])
+        self.assertEqual(self.hold(developer.user, self.ids[:1]).status_code, status.HTTP_200_OK)
+
+    def test_hold_flats_generated_by_developer(self):
+        developer = Developer.objects.create(user=User.objects.create_user(email='developer@gmail.com', 
+            phone_number='+38(098)138-02-39', password='123'))
+        house = create_flat_house(self.faker)
+        DeveloperHouse.objects.create(house=house, developer=developer)
+        self.login(developer.user)
+        response = self.client.post(reverse_lazy('swipe:house-generate_flats', kwargs={'pk': house.pk}),
+            {'layout': [1], 'square_meter_price': 1000}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # flats of developers are created with status set, which does not reserve them
+        flat = house.flats.get(floor=1)
+        self.assertTrue(flat.status)
+
+        response = self.hold(self.first_agent, [flat.pk])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.reserve(self.first_agent, {flat.pk: 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Flat.objects.get(pk=flat.pk).reserved_by, self.first_agent)
+
+    def test_update_onto_occupied_position(self):
+        # the position includes the number, so the other flat has the same one
+        Flat.objects.create(house=self.flats[0].house, housing=1, section=1, floor=2, number=self.flats[0].number)
+
+        self.login(self.admin_user)
+        response = self.client.patch(reverse_lazy('swipe:flat-detail', kwargs={'pk': self.ids[0]}),
+            {'floor': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Flat.objects.get(pk=self.ids[0]).floor, 1)
+
+    def test_created_flat_ignores_version(self):
+        request = Request(APIRequestFactory().post('/'))
+        request.user = self.admin_user
+        flat = FlatSerializer(context={'request': request}).create({'house': self.flats[0].house, 'housing': 1,
+            'section': 1, 'floor': 1, 'number': 100, 'square_meter_price': 1000, 'version': 7})
+
+        self.assertEqual(Flat.objects.get(pk=flat.pk).version, 0)
+
+
+class FlatHoldContentionTest(APITransactionTestCase):
+    '''Test class for concurrent holds of the same flats'''
+
+    def test_one_hold_wins(self):
+        house = create_flat_house(Faker())
+        ids = [flat.pk for flat in Flat.objects.generate(house, layout=[1], square_meter_price=1000,
+            housings=[1], sections=[1], floors=range(1, 5))]
+        users = [User.objects.create_user(email=f'agent{i}@gmail.com', phone_number=f'+38(098)135-02-{i:02}',
+            password='123') for i in range(8)]
+
+        def hold(user):
+            try:
+                # every user wants the flats in another order
+                return Flat.objects.hold(user, random.sample(ids, len(ids)), timedelta(minutes=15))[2]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            results = list(pool.map(hold, users))
+
+        self.assertEqual(len([taken for taken in results if not taken]), 1)
+        winner = users[results.index([])]
+        self.assertEqual(Flat.objects.filter(pk__in=ids, held_by=winner, version=1).count(), len(ids))
+
+
+class HousePriceStatsTest(APITransactionTestCase):
+    '''Test class for the price distributions of a house'''
+
+    def setUp(self):
+        cache.clear()
+        self.faker = Faker()
+        self.admin_user = User.objects.create_superuser(email='admin@admin.com', 
+            phone_number='+38(098)134-02-39', password='123')
+        self.advertiser = User.objects.create_user(email='first_client@gmail.com', 
+            phone_number='+38(098)135-02-39', password='123').client
+        self.house = create_flat_house(self.faker)
+        # two sections of two floors with a flat of 1000 and one of 2000 on every floor
+        self.flats = Flat.objects.generate(self.house, layout=[1, 2], square_meter_price=1000,
+            housings=[1], sections=[1, 2], floors=[1, 2])
+        for flat, rooms, price, moder_status in ((self.flats[0], '1', 20000, '2'), (self.flats[1], '2', 40000, '2'),
+                (self.flats[4], '2', 30000, '2'), (self.flats[5], '2', 90000, '1')):
+            self.create_announcement(flat, rooms, price, moder_status)
+        self.url = reverse_lazy('swipe:house-price_stats', kwargs={'pk': self.house.pk})
+        response = self.client.post('/auth/token/login/', {'email': self.admin_user.email, 'password': '123'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def create_announcement(self, flat, rooms, price, moder_status):
+        return Announcement.objects.create(**{
+            "address": self.faker.name(),
+            "flat": flat,
+            "foundation_document": "1",
+            "appointment": "1",
+            "rooms": rooms,
+            "layout": "1",
+            "state": "1",
+            "total_area": 54.5,
+            "has_balcony": "1",
+            "calculation_options": "1",
+            "commision": random.randint(1, 100),
+            "communication": self.faker.name(),
+            "description": self.faker.name(),
+            "price": price,
+            "advertiser": self.advertiser,
+            "moder_status": moder_status,
+            "available_status": "1"
+        })
+
+    def test_stats_of_house(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'buckets': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        flats = response.data['square_meter_price']
+        self.assertEqual({name: flats[name] for name in ('count', 'min', 'max', 'mean', 'median')},
+            {'count': 8, 'min': 1000, 'max': 2000, 'mean': 1500, 'median': 1500})
+        self.assertEqual(flats['histogram'], [{'from': 1000, 'to': 1500, 'count': 4},
+            {'from': 1500, 'to': 2000, 'count': 4}])
+        # the unpublished announcement is not counted
+        prices = response.data['price']
+        self.assertEqual((prices['count'], prices['median'], prices['mean']), (3, 30000, 30000))
+        self.assertEqual([bucket['count'] for bucket in prices['histogram']], [1, 2])
+        self.assertEqual(len([query for query in queries if 'swipe_flat"."square_meter_price' in query['sql']
+            or 'swipe_announcement"."price' in query['sql']]), 2)
+
+    def test_stats_of_section_and_rooms(self):
+        response = self.client.get(self.url, {'section': 1, 'rooms': '2'})
+
+        self.assertEqual(response.data['square_meter_price']['count'], 1)
+        self.assertEqual(response.data['square_meter_price']['histogram'], [{'from': 2000, 'to': 2000, 'count': 1}])
+        self.assertEqual(response.data['price']['max'], 40000)
+
+        response = self.client.get(self.url, {'section': 3})
+        self.assertEqual(response.data['price'], {'count': 0, 'min': None, 'max': None, 'mean': None,
+            'median': None, 'histogram': []})
+
+    def test_stats_are_cached_until_flats_change(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse([query for query in queries if 'swipe_flat"."square_meter_price' in query['sql']])
+
+        self.flats[0].square_meter_price = 500
+        self.flats[0].save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['square_meter_price']['min'], 500)
+
+    def test_invalid_parameters(self):
+        for params in ({'buckets': 0}, {'buckets': 51}, {'rooms': '9'}, {'section': 0}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,34 @@
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    '''
+    Writes every uploaded file chunk by chunk to a temporary file, which the
+    file system storage moves into place, so uploads are never kept in memory.
+
+    Files after the first `max_files` and files bigger than `max_file_size`
+    bytes are skipped. They never reach request.FILES, so their names and
+    the reasons are collected in `rejected`.
+    '''
+
+    def __init__(self, request=None, max_files=None, max_file_size=None):
+        super().__init__(request)
+        self.max_files = max_files
+        self.max_file_size = max_file_size
+        self.file_count = 0
+        self.rejected = []
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        # a new temporary file is opened even for a skipped file, since the
+        # parser closes `self.file` on SkipFile and the previous one is done
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.file_count += 1
+        if self.file_count > self.max_files:
+            self.rejected.append((file_name, f'Можно загрузить не больше {self.max_files} файлов за раз'))
+            raise SkipFile()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_file_size:
+            self.rejected.append((self.file_name, f'Размер файла больше {self.max_file_size} байт'))
+            raise SkipFile()
+        return super().receive_data_chunk(raw_data, start)
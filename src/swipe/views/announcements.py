@@ -1,18 +1,29 @@
+from datetime import timedelta
 import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django_filters.rest_framework.backends import DjangoFilterBackend
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg import openapi
+from drf_yasg.utils import no_body, swagger_auto_schema
 from rest_framework import status, filters
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.mixins import RetrieveModelMixin, UpdateModelMixin
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
+from swipe.cache import bump_generation, bump_house_generations, get_generation, make_key, normalize_query
 from swipe.filters import AnnouncementFilter
-from swipe.models import Announcement, AnnouncementImage, ClientAnnouncementFavourites, Promotion
-from swipe.serializers import AnnoncementFavouritesCreateSerializer, AnnouncementAdminSerializer, AnnouncementImagesSerializer, AnnouncementListSerializer, AnnouncementRetrieveSerializer, AnnouncementToTheTopSerializer, ClientAnnouncementRetrieveSerializer, PromotionSerializer
+from swipe.models import CACHE_SCOPES, Announcement, AnnouncementImage, ClientAnnouncementFavourites, Flat, Promotion
+from swipe.pagination import AnnouncementFeedPagination, FavouritesPagination, ModerationQueuePagination
+from swipe.search import search_announcements
+from swipe.serializers import AnnoncementFavouritesCreateSerializer, AnnouncementAdminSerializer, AnnouncementImagesSerializer, AnnouncementListSerializer, AnnouncementRetrieveSerializer, AnnouncementSearchSerializer, AnnouncementToTheTopSerializer, BumpScheduleSerializer, ClientAnnouncementRetrieveSerializer, FavouritesBulkSerializer, ModerationClaimSerializer, ModerationDecisionSerializer, ModerationReleaseSerializer, PromotionSerializer
+from swipe.views.mixins import BatchPhotoUploadMixin, CachedListMixin, ClientFavouritesMixin, ConditionalRetrieveMixin
 
 
 @method_decorator(name='list', decorator=swagger_auto_schema(tags=['announcement']))
@@ -21,13 +32,20 @@ from swipe.serializers import AnnoncementFavouritesCreateSerializer, Announcemen
 @method_decorator(name='update', decorator=swagger_auto_schema(tags=['announcement']))
 @method_decorator(name='partial_update', decorator=swagger_auto_schema(tags=['announcement']))
 @method_decorator(name='destroy', decorator=swagger_auto_schema(tags=['announcement']))
-class APIAnnouncementViewSet(ModelViewSet):
+class APIAnnouncementViewSet(ClientFavouritesMixin, BatchPhotoUploadMixin, ConditionalRetrieveMixin, CachedListMixin, ModelViewSet):
     '''API for announcement'''
-    queryset = Announcement.objects.all().order_by('-publication_date')
+    cache_scope = 'announcements'
+    favourite_model = ClientAnnouncementFavourites
+    favourite_field = 'announcement'
+    photo_model = AnnouncementImage
+    photo_parent_field = 'announcement'
+    photo_serializer_class = AnnouncementImagesSerializer
+    queryset = Announcement.objects.all().order_by('-rank_score', '-id')
     permission_classes = IsAuthenticated,
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['flat']
     filterset_class = AnnouncementFilter
+    pagination_class = AnnouncementFeedPagination
 
     def get_queryset(self):
         qs = self.queryset
@@ -35,15 +53,21 @@ class APIAnnouncementViewSet(ModelViewSet):
             and not self.request.user.is_superuser
             and not self.request.user.is_staff):
             qs = Announcement.objects.filter(advertiser=self.request.user.client)
-        elif self.action == 'list' and not self.request.user.is_superuser:
+        elif self.action in ('list', 'search', 'facets') and not self.request.user.is_superuser:
             qs = qs.filter(moder_status='2', available_status='1')
+        if self.action in ('list', 'search'):
+            qs = qs.for_listing()
         return qs
 
     def get_serializer_class(self):
-        if self.action in ('list', 'get_client_announcements', 'get_client_favourites'):
+        if self.action in ('list', 'get_client_announcements', 'get_client_favourites', 'get_unmoderated_announcements'):
             return AnnouncementListSerializer
+        elif self.action == 'search':
+            return AnnouncementSearchSerializer
         elif self.action in ('add_to_client_favourites', 'remove_from_client_favourites'):
             return AnnoncementFavouritesCreateSerializer
+        elif self.action in ('bulk_add_to_client_favourites', 'bulk_remove_from_client_favourites'):
+            return FavouritesBulkSerializer
         elif self.action == 'to_the_top':
             return AnnouncementToTheTopSerializer
         elif self.action == 'add_photo':
@@ -58,7 +82,37 @@ class APIAnnouncementViewSet(ModelViewSet):
             else:
                 return AnnouncementAdminSerializer
     def get_permissions(self):
-        return [IsAdminUser()] if self.action == 'get_unmoderated_announcements' else [IsAuthenticated()]
+        if self.action in ('get_unmoderated_announcements', 'moderation_claim', 'moderation_release', 'moderation_decide'):
+            return [IsAdminUser()]
+        return [IsAuthenticated()]
+
+    @action(methods=['get'], detail=False, url_path='search', url_name='search')
+    @swagger_auto_schema(
+        operation_description="API for full-text search of announcements by address and description. "
+            "Accepts the same filters as the announcements list. Results are ordered by relevance, "
+            "except in cursor pagination mode, which keeps the order of the announcements list.",
+        manual_parameters=[openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True)],
+        tags=['announcement'])
+    def search(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'q': 'Обязательное поле.'}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = search_announcements(self.filter_queryset(self.get_queryset()), text)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'], detail=False, url_path='facets', url_name='facets')
+    @swagger_auto_schema(
+        operation_description="API for counts of announcements by every option of rooms, state, appointment, "
+            "calculation_options and flat__house__status and for price and total_area ranges. "
+            "Accepts the same filters as the announcements list.",
+        tags=['announcement'])
+    def facets(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        key = make_key('facets', get_generation('announcements'), request.user.is_superuser,
+            normalize_query(request.query_params, exclude=('page', 'page_size', 'cursor', 'pagination')))
+        return Response(data=cache.get_or_set(key, queryset.facets, settings.SWIPE_CACHE_TIMEOUT))
 
     @action(methods=['get'], detail=True, url_path='get-photos', url_name='get_photos')
     @swagger_auto_schema(
@@ -74,18 +128,67 @@ class APIAnnouncementViewSet(ModelViewSet):
         operation_description="API for getting client announcements",
         tags=['announcement'])
     def get_client_announcements(self, request, *args, **kwargs):
-        announcements = Announcement.objects.filter(advertiser=request.user.client).order_by('-publication_date')
-        serializer = AnnouncementListSerializer(announcements, many=True, context={'request': request})
+        announcements = Announcement.objects.filter(
+            advertiser=request.user.client).order_by('-publication_date').for_listing()
+        serializer = self.get_serializer(announcements, many=True)
         return Response(data=serializer.data)
 
-    @action(methods=['get'], detail=False, url_path='get-unmoderated-announcements', url_name='get_unmoderated_announcements')
+    @action(methods=['get'], detail=False, url_path='get-unmoderated-announcements', url_name='get_unmoderated_announcements',
+        pagination_class=ModerationQueuePagination)
     @swagger_auto_schema(
-        operation_description="API for getting unmoderated announcements",
+        operation_description="API for getting unmoderated announcements, oldest first",
         tags=['announcement'])
     def get_unmoderated_announcements(self, request, *args, **kwargs):
-        announcements = Announcement.objects.filter(moder_status='1').order_by('publication_date')
-        serializer = AnnouncementListSerializer(announcements, many=True, context={'request': request})
-        return Response(data=serializer.data)
+        announcements = Announcement.objects.filter(moder_status='1').order_by('publication_date', 'id').for_listing()
+        page = self.paginate_queryset(announcements)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['post'], detail=False, url_path='moderation/claim', url_name='moderation_claim')
+    @swagger_auto_schema(
+        operation_description="API for claiming a batch of the oldest unmoderated announcements. "
+            "Claimed announcements are not given to other moderators until claimed_until.",
+        request_body=ModerationClaimSerializer,
+        tags=['moderation'])
+    def moderation_claim(self, request, *args, **kwargs):
+        serializer = ModerationClaimSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids, claimed_until = Announcement.objects.claim(request.user, serializer.validated_data['size'],
+            timedelta(minutes=settings.SWIPE_MODERATION_LEASE))
+        announcements = Announcement.objects.filter(pk__in=ids).order_by('publication_date', 'id').for_listing()
+        serializer = AnnouncementListSerializer(announcements, many=True, context=self.get_serializer_context())
+        return Response(data={'claimed_until': claimed_until, 'results': serializer.data})
+
+    @action(methods=['post'], detail=False, url_path='moderation/release', url_name='moderation_release')
+    @swagger_auto_schema(
+        operation_description="API for returning claimed announcements to the moderation queue",
+        request_body=ModerationReleaseSerializer,
+        tags=['moderation'])
+    def moderation_release(self, request, *args, **kwargs):
+        serializer = ModerationReleaseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        released = Announcement.objects.release(request.user, serializer.validated_data['ids'])
+        return Response(data={'released': released})
+
+    @action(methods=['post'], detail=False, url_path='moderation/decide', url_name='moderation_decide')
+    @swagger_auto_schema(
+        operation_description="API for approving (moder_status 2) or rejecting (moder_status 3) claimed "
+            "announcements. Announcements that are not claimed by the moderator or whose claim has "
+            "expired are skipped, the number of updated ones is returned.",
+        request_body=ModerationDecisionSerializer,
+        tags=['moderation'])
+    def moderation_decide(self, request, *args, **kwargs):
+        serializer = ModerationDecisionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = Announcement.objects.decide(request.user, serializer.validated_data['ids'],
+            serializer.validated_data['moder_status'])
+        if updated:
+            # the update sends no signals
+            bump_generation(*CACHE_SCOPES[Announcement])
+            # chessboards and price statistics show the published announcements
+            bump_house_generations(Flat.objects.filter(announcements__in=serializer.validated_data['ids'])
+                .values_list('house', flat=True).distinct())
+        return Response(data={'updated': updated})
 
     @action(methods=['post'], detail=True, url_path='add-photo', url_name='add_photo')
     @swagger_auto_schema(
@@ -101,6 +204,17 @@ class APIAnnouncementViewSet(ModelViewSet):
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
     
+    @action(methods=['post'], detail=True, url_path='add-photos', url_name='add_photos', parser_classes=[MultiPartParser])
+    @swagger_auto_schema(
+        operation_description="API for add many announcement photos at once. Every file of `images` is "
+            "validated on its own, the created photos and the errors of the rejected files are returned.",
+        request_body=no_body,
+        manual_parameters=[openapi.Parameter('images', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True)],
+        tags=['announcement'])
+    def add_photos(self, request, *args, **kwargs):
+        announcement = get_object_or_404(Announcement, pk=kwargs.get('pk'))
+        return self.upload_photos(request, announcement)
+
     @action(methods=['delete'], detail=True, url_path='remove-photo', url_name='remove_photo')
     @swagger_auto_schema(
         operation_description="API for remove announcement photo. id - a unique integer value identifying this photo.",
@@ -110,27 +224,27 @@ class APIAnnouncementViewSet(ModelViewSet):
         announcement_image.delete()
         return Response(status=status.HTTP_204_NO_CONTENT) 
     
-    @action(methods=['get'], detail=False, url_path='get-client-favourites', url_name='get_client_favourites')
+    @action(methods=['get'], detail=False, url_path='get-client-favourites', url_name='get_client_favourites',
+        pagination_class=FavouritesPagination)
     @swagger_auto_schema(
-        operation_description="API for getting announcement list of client favourites",
+        operation_description="API for getting announcement list of client favourites, recently added first",
         tags=['announcement'])
     def get_client_favourites(self, request):
-        client_announcement_favourites = Announcement.objects.filter(
-            pk__in=[cf.announcement.pk for cf in ClientAnnouncementFavourites.objects.filter(
-                client=request.user.client
-            )]
-        )
-        serializer = self.get_serializer_class()(client_announcement_favourites, many=True, context={'request': request})
-        return Response(data=serializer.data)
+        announcements = Announcement.objects.filter(
+            clientannouncementfavourites__client=request.user.client
+        ).annotate(favourite_id=F('clientannouncementfavourites__id')).order_by('-favourite_id').for_listing()
+        page = self.paginate_queryset(announcements)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(methods=['post'], detail=True, url_path='add-to-client-favourites', url_name='add_to_client_favourites')
     @swagger_auto_schema(
         operation_description="API for add announcement to client favourites",
+        request_body=no_body,
         tags=['announcement'])
     def add_to_client_favourites(self, request, *args, **kwargs):
-        cf = ClientAnnouncementFavourites.objects.create(
-            client=request.user.client, 
-            announcement=Announcement.objects.get(pk=kwargs.get('pk')))
+        announcement = get_object_or_404(Announcement, pk=kwargs.get('pk'))
+        self.add_favourites([announcement.pk])
         return Response(status=status.HTTP_201_CREATED)
 
     @action(methods=['delete'], detail=True, url_path='remove-from-client-favourites', url_name='remove_from_client_favourites')
@@ -138,19 +252,41 @@ class APIAnnouncementViewSet(ModelViewSet):
         operation_description="API for delete announcement from client favourites",
         tags=['announcement'])
     def remove_from_client_favourites(self, request, *args, **kwargs):
-        announcement = Announcement.objects.get(
-                pk=kwargs.get('pk'))
-        try:
-            ClientAnnouncementFavourites.objects.get(
-                client=request.user.client, 
-                announcement=announcement).delete()
+        announcement = get_object_or_404(Announcement, pk=kwargs.get('pk'))
+        if self.remove_favourites([announcement.pk]):
             return Response(status=status.HTTP_204_NO_CONTENT)
-        except:
-            return Response(data={'announcement': 'Это объявление не находится в списке избранных'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data={'announcement': 'Это объявление не находится в списке избранных'}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(methods=['post'], detail=False, url_path='bulk-add-to-client-favourites', url_name='bulk_add_to_client_favourites')
+    @swagger_auto_schema(
+        operation_description="API for add announcements to client favourites. "
+            "Announcements that are already in favourites or do not exist are skipped, "
+            "ids of the existing ones are returned.",
+        request_body=FavouritesBulkSerializer,
+        tags=['announcement'])
+    def bulk_add_to_client_favourites(self, request, *args, **kwargs):
+        serializer = FavouritesBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = self.add_favourites(serializer.validated_data['ids'])
+        return Response(data={'ids': sorted(ids)}, status=status.HTTP_201_CREATED)
+
+    @action(methods=['post'], detail=False, url_path='bulk-remove-from-client-favourites', url_name='bulk_remove_from_client_favourites')
+    @swagger_auto_schema(
+        operation_description="API for delete announcements from client favourites, returns the number of removed",
+        request_body=FavouritesBulkSerializer,
+        tags=['announcement'])
+    def bulk_remove_from_client_favourites(self, request, *args, **kwargs):
+        serializer = FavouritesBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        removed = self.remove_favourites(serializer.validated_data['ids'])
+        return Response(data={'removed': removed}, status=status.HTTP_200_OK)
 
     @action(methods=['patch'], detail=True, url_path='to-the-top', url_name='to_the_top')
     @swagger_auto_schema(
-        operation_description="API for raising an announcement to the top of the list",
+        operation_description="API for raising an announcement to the top of the list. "
+            "Sets bumped_at to the current time, publication_date is kept.",
+        request_body=no_body,
+        responses={200: AnnouncementToTheTopSerializer},
         tags=['announcement'])
     def to_the_top(self, request, *args, **kwargs):
         announcement = get_object_or_404(Announcement, pk=kwargs.get('pk'))
@@ -159,10 +295,28 @@ class APIAnnouncementViewSet(ModelViewSet):
             and not self.request.user.is_staff):
             return Response({'non_field_errors': 'Только создатель объявления может выполнить это действие'}, 
                 status=status.HTTP_403_FORBIDDEN)
-        serializer = AnnouncementToTheTopSerializer(announcement, data=request.data, partial=True)
+        announcement.bumped_at = timezone.now()
+        announcement.save(update_fields=['bumped_at', 'updated_at'])
+        serializer = AnnouncementToTheTopSerializer(announcement)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['post'], detail=True, url_path='schedule-bumps', url_name='schedule_bumps')
+    @swagger_auto_schema(
+        operation_description="API for scheduling paid bumps of an announcement every interval_hours for days",
+        request_body=BumpScheduleSerializer,
+        responses={201: BumpScheduleSerializer},
+        tags=['announcement'])
+    def schedule_bumps(self, request, *args, **kwargs):
+        announcement = get_object_or_404(Announcement, pk=kwargs.get('pk'))
+        if (announcement.advertiser != request.user.client
+            and not self.request.user.is_superuser
+            and not self.request.user.is_staff):
+            return Response({'non_field_errors': 'Только создатель объявления может выполнить это действие'}, 
+                status=status.HTTP_403_FORBIDDEN)
+        serializer = BumpScheduleSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            serializer.save(announcement=announcement)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -1,50 +1,179 @@
+from datetime import timedelta
 import logging
+
+from django.conf import settings
+from django.db import IntegrityError
 from django.utils.decorators import method_decorator
 from django_filters.rest_framework.backends import DjangoFilterBackend
 
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from swipe.filters import FlatFilter
 
-from swipe.models import (Flat, House, DeveloperHouse)
+from swipe.cache import bump_generation, bump_house_generations
+from swipe.models import CACHE_SCOPES, Flat
 from swipe.permissions import IsDeveloper
-from swipe.serializers import FlatSerializer
+from swipe.serializers import FlatBulkUpdateSerializer, FlatHoldSerializer, FlatReservationSerializer, FlatSerializer
+from swipe.views.mixins import CachedListMixin
 
 
 logger = logging.getLogger(__name__)
 
 
+class FlatChanged(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Квартира изменилась, получите её заново'
+    default_code = 'conflict'
+
+
+def conflict_response(taken):
+    return Response(data={'detail': 'Квартиры заняты или изменились', 'conflicts': taken},
+        status=status.HTTP_409_CONFLICT)
+
+
+def bump_flat_generations(flats):
+    '''Bumps the generations depending on `flats` changed by an update, which sends no signals'''
+    bump_generation(*CACHE_SCOPES[Flat])
+    bump_house_generations(flats.values_list('house', flat=True).distinct())
+
+
+def versions_data(versions):
+    return [{'id': pk, 'version': version} for pk, version in sorted(versions.items())]
+
+
 @method_decorator(name='list', decorator=swagger_auto_schema(tags=['flat']))
 @method_decorator(name='create', decorator=swagger_auto_schema(tags=['flat']))
 @method_decorator(name='retrieve', decorator=swagger_auto_schema(tags=['flat']))
 @method_decorator(name='update', decorator=swagger_auto_schema(tags=['flat']))
 @method_decorator(name='partial_update', decorator=swagger_auto_schema(tags=['flat']))
 @method_decorator(name='destroy', decorator=swagger_auto_schema(tags=['flat']))
-class APIFlatViewSet(ModelViewSet):
+class APIFlatViewSet(CachedListMixin, ModelViewSet):
     '''API for flats'''
+    cache_scope = 'flats'
     serializer_class = FlatSerializer
     queryset = Flat.objects.all().order_by('id')
     filterset_fields = ['flat']
     filterset_class = FlatFilter
 
+    def get_serializer_class(self):
+        if self.action == 'bulk_update':
+            return FlatBulkUpdateSerializer
+        elif self.action in ('hold', 'release'):
+            return FlatHoldSerializer
+        elif self.action == 'reserve':
+            return FlatReservationSerializer
+        return FlatSerializer
+
     def get_permissions(self):
         permission_classes = [IsAuthenticated]
-        if self.action != 'create': 
+        # agents and clients hold and reserve any flat, release only ends the holds of the user
+        if self.action not in ('create', 'hold', 'reserve', 'release'):
             permission_classes = [IsAuthenticated, IsDeveloper|IsAdminUser]
         return [p() for p in permission_classes]
 
+    @action(methods=['post'], detail=False, url_path='bulk-update', url_name='bulk_update')
+    @swagger_auto_schema(
+        operation_description="API for changing the price and/or status of many flats of a house at once. "
+            "Flats are selected by house and optional housing, section, min_floor, max_floor and status. "
+            "The price is either set (square_meter_price), changed by percent or set by floor "
+            "(base_price + floor_step * (floor - 1)). Returns the number of updated flats.",
+        request_body=FlatBulkUpdateSerializer,
+        tags=['flat'])
+    def bulk_update(self, request, *args, **kwargs):
+        serializer = FlatBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        flats = self.get_queryset().filter(house=data['house'])
+        for field, lookup in (('housing', 'housing'), ('section', 'section'), ('min_floor', 'floor__gte'),
+                ('max_floor', 'floor__lte'), ('status', 'status')):
+            if data.get(field) is not None:
+                flats = flats.filter(**{lookup: data[field]})
+        updated = flats.change(square_meter_price=data.get('square_meter_price'), percent=data.get('percent'),
+            base_price=data.get('base_price'), floor_step=data.get('floor_step'), status=data.get('new_status'))
+        if updated:
+            # the update sends no signals
+            bump_generation(*CACHE_SCOPES[Flat])
+            bump_house_generations([data['house']])
+        return Response(data={'updated': updated})
+
+    def perform_update(self, serializer):
+        '''Saves only the sent fields and only if the flat still has the sent (or just read) version'''
+        flat = serializer.instance
+        values = dict(serializer.validated_data)
+        version = values.pop('version', flat.version)
+        try:
+            versions, taken = Flat.objects.compare_and_swap({flat.pk: version}, **values)
+        except IntegrityError:
+            raise ValidationError({'flat': 'Квартира с таким корпусом, секцией, этажом и номером уже есть'})
+        if taken:
+            raise FlatChanged()
+        # the update sends no signals
+        bump_generation(*CACHE_SCOPES[Flat])
+        bump_house_generations([flat.house_id])
+        for field, value in values.items():
+            setattr(flat, field, value)
+        flat.version = versions[flat.pk]
+
+    @action(methods=['post'], detail=False, url_path='hold', url_name='hold')
+    @swagger_auto_schema(
+        operation_description="API for holding flats for SWIPE_FLAT_HOLD minutes, during which other users "
+            "cannot hold or reserve them. Any authenticated user can hold flats. Either all flats are "
+            "held or none: if some are reserved, held by somebody else or do not exist, 409 is returned "
+            "with their ids in `conflicts`. Returns the new versions of the flats for the reservation.",
+        request_body=FlatHoldSerializer,
+        tags=['flat'])
+    def hold(self, request, *args, **kwargs):
+        serializer = FlatHoldSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        held_until, versions, taken = self.get_queryset().hold(request.user, serializer.validated_data['ids'],
+            timedelta(minutes=settings.SWIPE_FLAT_HOLD))
+        if taken:
+            return conflict_response(taken)
+        bump_flat_generations(Flat.objects.filter(pk__in=versions))
+        return Response(data={'held_until': held_until, 'flats': versions_data(versions)})
+
+    @action(methods=['post'], detail=False, url_path='reserve', url_name='reserve')
+    @swagger_auto_schema(
+        operation_description="API for reserving flats that are free or held by the user. Every flat is "
+            "sent with the version the client has read. Either all flats are reserved or none: if some "
+            "are taken or have changed since their versions, 409 is returned with their ids in `conflicts`.",
+        request_body=FlatReservationSerializer,
+        tags=['flat'])
+    def reserve(self, request, *args, **kwargs):
+        serializer = FlatReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        versions, taken = self.get_queryset().reserve(request.user,
+            {flat['id']: flat['version'] for flat in serializer.validated_data['flats']})
+        if taken:
+            return conflict_response(taken)
+        bump_flat_generations(Flat.objects.filter(pk__in=versions))
+        return Response(data={'flats': versions_data(versions)})
+
+    @action(methods=['post'], detail=False, url_path='release', url_name='release')
+    @swagger_auto_schema(
+        operation_description="API for ending the holds of the user on flats",
+        request_body=FlatHoldSerializer,
+        tags=['flat'])
+    def release(self, request, *args, **kwargs):
+        serializer = FlatHoldSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        released = self.get_queryset().release(request.user, serializer.validated_data['ids'])
+        if released:
+            bump_flat_generations(Flat.objects.filter(pk__in=serializer.validated_data['ids']))
+        return Response(data={'released': released})
+
     def get_queryset(self):
         qs = self.queryset
-        if self.action != 'create' and self.request.user.user_developer is not None:
-            qs = Flat.objects.filter(
-                house__in=House.objects.filter(
-                    pk__in=[dh.house.pk for dh in DeveloperHouse.objects.filter(
-                        developer=self.request.user.user_developer
-                    )]))
-        return qs
+        if (self.action not in ('create', 'hold', 'reserve', 'release')
+                and self.request.user.user_developer is not None):
+            qs = Flat.objects.for_developer(self.request.user.user_developer).order_by('id')
+        # validation of updates uses the house too
+        return qs.for_listing()
 
 
 
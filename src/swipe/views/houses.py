@@ -1,19 +1,30 @@
+import json
 import logging
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import Exists, OuterRef
 from django.utils.decorators import method_decorator
+from django.utils.http import quote_etag
 from django_filters.rest_framework.backends import DjangoFilterBackend
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg import openapi
+from drf_yasg.utils import no_body, swagger_auto_schema
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from swipe.filters import FlatFilter
+from swipe.cache import bump_generation, bump_house_generations, get_digest, get_generation, get_house_scope, make_key
+from swipe.filters import FlatFilter, HouseFilter
 
-from swipe.models import ClientHouseFavourites, Flat, HouseImage, House, HouseNews, DeveloperHouse, Announcement
+from swipe.models import CACHE_SCOPES, Announcement, ClientHouseFavourites, Flat, HouseImage, House, HouseNews, HouseSummary, DeveloperHouse
 from swipe.permissions import IsDeveloper
-from swipe.serializers import FlatSerializer, HouseFavouritesCreateSerializer, HouseImagesSerializer, HouseListSerializer, HouseNewsSerializer, HouseSerializer
+from swipe.serializers import FavouritesBulkSerializer, FlatGenerationSerializer, FlatSerializer, HouseFavouritesCreateSerializer, HouseImagesSerializer, HouseListSerializer, HouseNewsSerializer, HouseSerializer, PriceStatsQuerySerializer
+from swipe.stats import describe
+from swipe.views.mixins import BatchPhotoUploadMixin, CachedListMixin, ClientFavouritesMixin, ConditionalRetrieveMixin, conditional_response
 
 
 logger = logging.getLogger(__name__)
@@ -25,32 +36,36 @@ logger = logging.getLogger(__name__)
 @method_decorator(name='update', decorator=swagger_auto_schema(tags=['house']))
 @method_decorator(name='partial_update', decorator=swagger_auto_schema(tags=['house']))
 @method_decorator(name='destroy', decorator=swagger_auto_schema(tags=['house']))
-class APIHouseViewSet(ModelViewSet):
+class APIHouseViewSet(ClientFavouritesMixin, BatchPhotoUploadMixin, ConditionalRetrieveMixin, CachedListMixin, ModelViewSet):
     '''API for houses'''
+    cache_scope = 'houses'
+    favourite_model = ClientHouseFavourites
+    favourite_field = 'house'
+    photo_model = HouseImage
+    photo_parent_field = 'house'
+    photo_serializer_class = HouseImagesSerializer
     queryset = House.objects.all().order_by('id')
     permission_classes = IsAuthenticated, IsDeveloper | IsAdminUser
-    filterset_class = None
+    filterset_class = HouseFilter
 
     def get_queryset(self):
         qs = self.queryset
         if (self.request.user.user_developer is not None 
             and self.request.user.is_superuser == False
             and self.request.user.is_staff == False):
-            qs = House.objects.filter(pk__in=[
-                dv.house.pk for dv in DeveloperHouse.objects.filter(
-                    developer=self.request.user.user_developer)
-            ]).order_by('id')
+            qs = House.objects.for_developer(self.request.user.user_developer).order_by('id')
         elif (self.request.user.user_developer is None
             and self.request.user.is_superuser == False
             and self.request.user.is_staff == False):
-            qs = House.objects.filter(pk__in={
-                an.flat.house.pk for an in Announcement.objects.all() if an.flat is not None
-            }).order_by('id')
+            qs = House.objects.filter(summary__announcement_count__gt=0).order_by('id')
+        if self.action == 'list':
+            qs = qs.for_listing()
         return qs
 
     def get_permissions(self):
         permission_classes = [IsAuthenticated, IsDeveloper|IsAdminUser]
-        if self.action in ['list', 'retrieve', 'get_client_favourites', 'add_to_client_favourites', 'remove_from_client_favourites']: 
+        if self.action in ['list', 'retrieve', 'get_client_favourites', 'add_to_client_favourites', 'remove_from_client_favourites',
+            'bulk_add_to_client_favourites', 'bulk_remove_from_client_favourites', 'chessboard', 'price_stats']: 
             permission_classes = [IsAuthenticated]
         return [p() for p in permission_classes]
 
@@ -59,10 +74,94 @@ class APIHouseViewSet(ModelViewSet):
             return HouseListSerializer
         elif self.action in ('add_to_client_favourites'):
             return HouseFavouritesCreateSerializer
+        elif self.action in ('bulk_add_to_client_favourites', 'bulk_remove_from_client_favourites'):
+            return FavouritesBulkSerializer
         elif self.action == 'add_photo':
             return HouseImagesSerializer
+        elif self.action == 'generate_flats':
+            return FlatGenerationSerializer
         return HouseSerializer
     
+    @action(methods=['post'], detail=True, url_path='generate-flats', url_name='generate_flats')
+    @swagger_auto_schema(
+        operation_description="API for creating all flats of a house at once. Every floor of the given "
+            "(by default all) housings and sections gets a flat for every item of `layout`, priced at "
+            "`square_meter_price` times the item. Numbers continue from the last flat of the house.",
+        request_body=FlatGenerationSerializer,
+        tags=['house'])
+    def generate_flats(self, request, *args, **kwargs):
+        house = self.get_object()
+        serializer = FlatGenerationSerializer(data=request.data, context={'house': house})
+        serializer.is_valid(raise_exception=True)
+        try:
+            flats = Flat.objects.generate(house, status=request.user.user_developer is not None,
+                **serializer.validated_data)
+        except IntegrityError:
+            return Response(data={'flats': 'Квартиры с такими номерами уже есть'}, status=status.HTTP_400_BAD_REQUEST)
+        # bulk_create sends no signals
+        bump_generation(*CACHE_SCOPES[Flat])
+        bump_house_generations([house.pk])
+        return Response(data={'count': len(flats), 'first_number': flats[0].number, 'last_number': flats[-1].number},
+            status=status.HTTP_201_CREATED)
+
+    @action(methods=['get'], detail=True, url_path='chessboard', url_name='chessboard')
+    @swagger_auto_schema(
+        operation_description="API for the grid of all flats of a house. `flats` has an array for every "
+            "column, the n-th flat is the n-th item of all of them; flats are ordered by housing, section, "
+            "floor and number. `announcement`, `price`, `rooms` and `total_area` are of the published "
+            "announcement of the flat or null. Supports If-None-Match, so it is cheap to poll.",
+        tags=['house'])
+    def chessboard(self, request, *args, **kwargs):
+        house = self.get_object()
+        # changes of the house, its flats and their announcements bump the
+        # generation of the house, the ETag only changes with the data
+        key = make_key('chessboard', get_generation(get_house_scope(house.pk)), house.pk)
+        chessboard = cache.get_or_set(key, lambda: self.get_chessboard(house), settings.SWIPE_CACHE_TIMEOUT)
+        return conditional_response(request, lambda: Response(data=chessboard['data']), chessboard['etag'])
+
+    def get_chessboard(self, house):
+        data = {
+            'house': house.pk,
+            'housings': house.housings,
+            'sections': house.sections,
+            'floors': house.floors,
+            'flats': Flat.objects.filter(house=house).chessboard(),
+        }
+        return {'data': data, 'etag': quote_etag(get_digest(json.dumps(data, sort_keys=True)))}
+
+    @action(methods=['get'], detail=True, url_path='price-stats', url_name='price_stats')
+    @swagger_auto_schema(
+        operation_description="API for the distributions of the square meter prices of the flats and of the "
+            "prices of the published announcements of a house: count, min, max, mean, median and a histogram "
+            "of `buckets` equal ranges from min to max. Can be narrowed to a section and to flats with "
+            "announcements of some rooms.",
+        query_serializer=PriceStatsQuerySerializer,
+        tags=['house'])
+    def price_stats(self, request, *args, **kwargs):
+        house = self.get_object()
+        serializer = PriceStatsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        # the same generation as the chessboard
+        key = make_key('price_stats', get_generation(get_house_scope(house.pk)), house.pk, sorted(params.items()))
+        stats = cache.get_or_set(key, lambda: self.get_price_stats(house, **params), settings.SWIPE_CACHE_TIMEOUT)
+        return Response(data=stats)
+
+    def get_price_stats(self, house, buckets, section=None, rooms=None):
+        '''Reads only the prices, one query for flats and one for announcements'''
+        flats = Flat.objects.filter(house=house)
+        announcements = Announcement.objects.filter(flat__house=house, moder_status='2', available_status='1')
+        if section is not None:
+            flats = flats.filter(section=section)
+            announcements = announcements.filter(flat__section=section)
+        if rooms is not None:
+            announcements = announcements.filter(rooms=rooms)
+            flats = flats.filter(Exists(announcements.filter(flat=OuterRef('pk'))))
+        return {
+            'square_meter_price': describe(flats.values_list('square_meter_price', flat=True), buckets),
+            'price': describe(announcements.values_list('price', flat=True), buckets),
+        }
+
     @action(methods=['get'], detail=True, url_path='get-photos', url_name='get_photos')
     @swagger_auto_schema(
         operation_description="API for getting house photos",
@@ -77,7 +176,7 @@ class APIHouseViewSet(ModelViewSet):
         operation_description="API for add house photo",
         tags=['house'])
     def add_photo(self, request, *args, **kwargs):
-        house = get_object_or_404(HouseImage, pk=kwargs.get('pk'))
+        house = get_object_or_404(House, pk=kwargs.get('pk'))
         serializer = HouseImagesSerializer(data=request.FILES)
         if serializer.is_valid():
             serializer.save(house=house)
@@ -85,27 +184,42 @@ class APIHouseViewSet(ModelViewSet):
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=True, url_path='add-photos', url_name='add_photos', parser_classes=[MultiPartParser])
+    @swagger_auto_schema(
+        operation_description="API for add many house photos at once. Every file of `images` is "
+            "validated on its own, the created photos and the errors of the rejected files are returned.",
+        request_body=no_body,
+        manual_parameters=[openapi.Parameter('images', openapi.IN_FORM, type=openapi.TYPE_FILE, required=True)],
+        tags=['house'])
+    def add_photos(self, request, *args, **kwargs):
+        house = get_object_or_404(House, pk=kwargs.get('pk'))
+        return self.upload_photos(request, house)
+
+    def photos_created(self, house):
+        super().photos_created(house)
+        # the first photo becomes the cover, see refresh_house_summary()
+        HouseSummary.objects.filter(house=house).refresh()
+
     @action(methods=['get'], detail=False, url_path='get-client-favourites', url_name='get_client_favourites')
     @swagger_auto_schema(
-        operation_description="API for getting house list of client favourites",
+        operation_description="API for getting house list of client favourites, recently added first",
         tags=['house'])
     def get_client_favourites(self, request):
-        client_house_favourites = House.objects.filter(
-            pk__in=[cf.house.pk for cf in ClientHouseFavourites.objects.filter(
-                client=request.user.client
-            )]
-        )
-        serializer = self.get_serializer_class()(client_house_favourites, many=True, context={'request': request})
-        return Response(data=serializer.data)
+        houses = House.objects.filter(
+            clienthousefavourites__client=request.user.client
+        ).order_by('-clienthousefavourites__id').for_listing()
+        page = self.paginate_queryset(houses)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(methods=['post'], detail=True, url_path='add-to-client-favourites', url_name='add_to_client_favourites')
     @swagger_auto_schema(
         operation_description="API for add house to client favourites",
+        request_body=no_body,
         tags=['house'])
     def add_to_client_favourites(self, request, *args, **kwargs):
-        cf = ClientHouseFavourites.objects.create(
-            client=request.user.client, 
-            house=House.objects.get(pk=kwargs.get('pk')))
+        house = get_object_or_404(House, pk=kwargs.get('pk'))
+        self.add_favourites([house.pk])
         return Response(status=status.HTTP_201_CREATED)
 
     @action(methods=['delete'], detail=True, url_path='remove-from-client-favourites', url_name='remove_from_client_favourites')
@@ -113,16 +227,35 @@ class APIHouseViewSet(ModelViewSet):
         operation_description="API for delete house from client favourites",
         tags=['house'])
     def remove_from_client_favourites(self, request, *args, **kwargs):
-        house = House.objects.get(
-                pk=kwargs.get('pk'))
-        try:
-            ClientHouseFavourites.objects.get(
-                client=request.user.client, 
-                house=house).delete()
+        house = get_object_or_404(House, pk=kwargs.get('pk'))
+        if self.remove_favourites([house.pk]):
             return Response(status=status.HTTP_204_NO_CONTENT)
-        except:
-            return Response(data={'announcement': 'Этот ЖК не находится в списке избранных'}, status=status.HTTP_404_NOT_FOUND)
-    
+        return Response(data={'announcement': 'Этот ЖК не находится в списке избранных'}, status=status.HTTP_404_NOT_FOUND)
+
+    @action(methods=['post'], detail=False, url_path='bulk-add-to-client-favourites', url_name='bulk_add_to_client_favourites')
+    @swagger_auto_schema(
+        operation_description="API for add houses to client favourites. "
+            "Houses that are already in favourites or do not exist are skipped, "
+            "ids of the existing ones are returned.",
+        request_body=FavouritesBulkSerializer,
+        tags=['house'])
+    def bulk_add_to_client_favourites(self, request, *args, **kwargs):
+        serializer = FavouritesBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = self.add_favourites(serializer.validated_data['ids'])
+        return Response(data={'ids': sorted(ids)}, status=status.HTTP_201_CREATED)
+
+    @action(methods=['post'], detail=False, url_path='bulk-remove-from-client-favourites', url_name='bulk_remove_from_client_favourites')
+    @swagger_auto_schema(
+        operation_description="API for delete houses from client favourites, returns the number of removed",
+        request_body=FavouritesBulkSerializer,
+        tags=['house'])
+    def bulk_remove_from_client_favourites(self, request, *args, **kwargs):
+        serializer = FavouritesBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        removed = self.remove_favourites(serializer.validated_data['ids'])
+        return Response(data={'removed': removed}, status=status.HTTP_200_OK)
+
     @action(methods=['delete'], detail=True, url_path='remove-photo', url_name='remove_photo')
     @swagger_auto_schema(
         operation_description="API for remove house photo. id - a unique integer value identifying this photo.",
@@ -139,8 +272,9 @@ class APIHouseViewSet(ModelViewSet):
 @method_decorator(name='update', decorator=swagger_auto_schema(tags=['house_news']))
 @method_decorator(name='partial_update', decorator=swagger_auto_schema(tags=['house_news']))
 @method_decorator(name='destroy', decorator=swagger_auto_schema(tags=['house_news']))
-class APIHouseNewsViewSet(ModelViewSet):
+class APIHouseNewsViewSet(CachedListMixin, ModelViewSet):
     '''API for houses'''
+    cache_scope = 'house_news'
     queryset = HouseNews.objects.all()
     serializer_class = HouseNewsSerializer
     filter_backends = [DjangoFilterBackend]
@@ -0,0 +1,208 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from swipe.cache import bump_generation, get_digest, get_generation, normalize_query, record_access
+from swipe.models import CACHE_SCOPES
+from swipe.uploads import LimitedUploadHandler
+
+
+def get_cache_role(request):
+    '''Everything about the user the responses depend on'''
+    user = request.user
+    if user.is_superuser:
+        return 'superuser'
+    if user.is_staff:
+        return 'staff'
+    if user.user_developer is not None:
+        return f'developer:{user.user_developer.pk}'
+    return 'user'
+
+
+def conditional_response(request, response, etag, last_modified=None):
+    '''
+    Returns 304 instead of the response if the client has the same version.
+    `response` is a callable, so nothing is serialized for 304.
+    '''
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is None:
+        response = response()
+        if response.status_code != 200:
+            return response
+    else:
+        response = not_modified
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ConditionalRetrieveMixin:
+    '''
+    Adds ETag/Last-Modified to retrieve responses and answers
+    If-None-Match/If-Modified-Since by the `updated_at` of the object.
+    '''
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer_class = self.get_serializer_class()
+        # links in the data are absolute, so they depend on the host too
+        etag = quote_etag(get_digest(instance._meta.label, instance.pk, instance.updated_at.isoformat(),
+            serializer_class.__name__, request.scheme, request.get_host()))
+        return conditional_response(request, lambda: Response(self.get_serializer(instance).data),
+            etag, int(instance.updated_at.timestamp()))
+
+
+class CachedListMixin:
+    '''
+    Caches the data of successful list responses in the default cache.
+
+    The key is built from the normalised query string, the role of the user
+    and the generation of `cache_scope`, which is bumped by signals whenever
+    a model the list depends on changes (see swipe.models). The key is also
+    the ETag of the response, so If-None-Match is answered with 304.
+    Responses carry `X-Cache: HIT` or `X-Cache: MISS`.
+    '''
+    cache_scope = None
+
+    def get_list_cache_key(self, request):
+        # links in the data are absolute, so they depend on the host too
+        return get_digest(self.cache_scope, get_generation(self.cache_scope), get_cache_role(request),
+            request.scheme, request.get_host(), request.path, normalize_query(request.query_params))
+
+    def get_list_etag(self, request, digest):
+        return quote_etag(digest)
+
+    def personalize_cached_data(self, data):
+        '''Hook for the parts of cached data that depend on the user, not on the role'''
+        return data
+
+    def list(self, request, *args, **kwargs):
+        digest = self.get_list_cache_key(request)
+        return conditional_response(request, lambda: self.get_cached_list(request, digest, *args, **kwargs),
+            self.get_list_etag(request, digest))
+
+    def get_cached_list(self, request, digest, *args, **kwargs):
+        key = f'swipe:list:{digest}'
+        data = cache.get(key)
+        record_access(self.cache_scope, hit=data is not None)
+        if data is not None:
+            response = Response(self.personalize_cached_data(data))
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.SWIPE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ClientFavouritesMixin:
+    '''
+    Favourites of the client in `favourite_model` by `favourite_field`.
+
+    List serializers get the ids of the page that are in favourites as
+    `favourite_ids` of their context, which costs one query per page.
+    Every change of the favourites of a client bumps their generation,
+    which is a part of list ETags.
+    '''
+    favourite_model = None
+    favourite_field = None
+
+    def get_favourites_scope(self, client):
+        return f'{self.favourite_model._meta.model_name}:{client.pk}'
+
+    def get_favourite_ids(self, ids):
+        client = self.request.user.user_client
+        if client is None or not ids:
+            return set()
+        return set(self.favourite_model.objects.filter(
+            client=client, **{f'{self.favourite_field}__in': ids}
+        ).values_list(self.favourite_field, flat=True))
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args and args[0] is not None:
+            kwargs['context'] = {**self.get_serializer_context(),
+                'favourite_ids': self.get_favourite_ids([instance.pk for instance in args[0]])}
+        return super().get_serializer(*args, **kwargs)
+
+    def personalize_cached_data(self, data):
+        results = data['results'] if isinstance(data, dict) else data
+        favourite_ids = self.get_favourite_ids([item['id'] for item in results])
+        for item in results:
+            item['is_favourite'] = item['id'] in favourite_ids
+        return data
+
+    def get_list_etag(self, request, digest):
+        client = request.user.user_client
+        if client is not None:
+            digest = get_digest(digest, get_generation(self.get_favourites_scope(client)))
+        return quote_etag(digest)
+
+    def add_favourites(self, ids):
+        '''Adds the existing objects of `ids` with one INSERT ... ON CONFLICT DO NOTHING'''
+        client = self.request.user.client
+        related_model = self.favourite_model._meta.get_field(self.favourite_field).related_model
+        existing = set(related_model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        self.favourite_model.objects.bulk_create([
+            self.favourite_model(client=client, **{f'{self.favourite_field}_id': pk}) for pk in existing
+        ], ignore_conflicts=True)
+        bump_generation(self.get_favourites_scope(client))
+        return existing
+
+    def remove_favourites(self, ids):
+        '''Removes `ids` from favourites with one DELETE, returns the number of removed'''
+        client = self.request.user.client
+        removed, _ = self.favourite_model.objects.filter(
+            client=client, **{f'{self.favourite_field}__in': ids}).delete()
+        bump_generation(self.get_favourites_scope(client))
+        return removed
+
+
+class BatchPhotoUploadMixin:
+    '''
+    Upload of many photos of `photo_model` in one multipart request.
+
+    Files of the `images` field are streamed to temporary files and moved
+    to the storage, every file is validated on its own and all valid ones
+    are saved with one bulk_create. The response has the created photos
+    and the errors of every rejected file.
+    '''
+    photo_model = None
+    photo_parent_field = None
+    photo_serializer_class = None
+    photo_files_field = 'images'
+
+    def upload_photos(self, request, parent):
+        handler = LimitedUploadHandler(request._request,
+            max_files=settings.SWIPE_UPLOAD_MAX_FILES, max_file_size=settings.SWIPE_UPLOAD_MAX_FILE_SIZE)
+        # has to be set before the body is parsed
+        request._request.upload_handlers = [handler]
+
+        photos, errors = [], []
+        for file in request.FILES.getlist(self.photo_files_field):
+            serializer = self.photo_serializer_class(data={'image': file})
+            if serializer.is_valid():
+                photos.append(self.photo_model(image=serializer.validated_data['image'],
+                    **{self.photo_parent_field: parent}))
+            else:
+                errors.append({'file': file.name, 'errors': serializer.errors['image']})
+        errors += [{'file': name, 'errors': [reason]} for name, reason in handler.rejected]
+
+        if photos:
+            self.photo_model.objects.bulk_create(photos)
+            self.photos_created(parent)
+        return Response(data={
+            'created': self.photo_serializer_class(photos, many=True).data,
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED if photos else status.HTTP_400_BAD_REQUEST)
+
+    def photos_created(self, parent):
+        # bulk_create sends no signals, see touch_parent() and bump_cache_generations()
+        type(parent).objects.filter(pk=parent.pk).update(updated_at=timezone.now())
+        bump_generation(*CACHE_SCOPES[self.photo_model])
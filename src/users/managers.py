@@ -3,6 +3,10 @@ from django.db import models
 
 
 class UserManager(BaseUserManager):
+    def with_roles(self):
+        '''Joins role profiles, so user_client/user_developer/user_notary do not query'''
+        return self.select_related(*self.model.ROLES)
+
     def create_user(self, email, phone_number, password=None):
         """
         Creates and saves a User with the given email, phone
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.core import validators
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -18,6 +19,9 @@ class User(AbstractUser):
         ])
 
     objects = UserManager()
+
+    # one-to-one profiles that define what the user can do
+    ROLES = ('client', 'developer', 'notary')
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['phone_number']
@@ -29,21 +33,21 @@ class User(AbstractUser):
     def user_client(self):
         try:
             return self.client
-        except:
+        except ObjectDoesNotExist:
             return None
 
     @property
     def user_developer(self):
         try:
             return self.developer
-        except:
+        except ObjectDoesNotExist:
             return None
 
     @property
     def user_notary(self):
         try:
             return self.notary
-        except:
+        except ObjectDoesNotExist:
             return None
 
 
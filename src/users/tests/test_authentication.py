@@ -0,0 +1,32 @@
+from django.urls import reverse_lazy
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from users.authentication import JWTAuthentication, TokenAuthentication
+from users.models import User, Developer
+
+
+class RolesResolvedAtAuthenticationTest(APITestCase):
+    '''Test class for loading user roles together with the authenticated user'''
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.developer = User.objects.create_user(email='developer@gmail.com', 
+            phone_number='+38(098)137-02-39', password='123')
+        Developer.objects.create(user=self.developer)
+
+    def assert_roles_are_loaded(self, authentication, header):
+        request = self.factory.get('/', HTTP_AUTHORIZATION=header)
+        with self.assertNumQueries(1):
+            user, _ = authentication.authenticate(request)
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(user.user_client)
+            self.assertIsNotNone(user.user_developer)
+            self.assertIsNone(user.user_notary)
+
+    def test_token_authentication(self):
+        response = self.client.post('/auth/token/login/', {'email': self.developer.email, 'password': '123'})
+        self.assert_roles_are_loaded(TokenAuthentication(), f'Token {response.data["auth_token"]}')
+
+    def test_jwt_authentication(self):
+        response = self.client.post(reverse_lazy('jwt-create'), {'email': self.developer.email, 'password': '123'})
+        self.assert_roles_are_loaded(JWTAuthentication(), f'JWT {response.data["access"]}')